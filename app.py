@@ -1,26 +1,187 @@
+import os
 import sys
+import socket
+import threading
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QPushButton, QVBoxLayout, QWidget,
-    QLabel, QLineEdit, QTableWidget, QTableWidgetItem, QHBoxLayout,
-    QMessageBox, QSpinBox, QHeaderView, QFrame, QInputDialog, QTextEdit,
-    QCompleter
+    QLabel, QLineEdit, QHBoxLayout,
+    QMessageBox, QSpinBox, QHeaderView, QFrame, QInputDialog,
+    QCompleter, QTableView, QDateEdit, QCheckBox, QFileDialog
 )
-from PyQt5.QtGui import QTextDocument
 from datetime import datetime
-from PyQt5.QtPrintSupport import QPrinter, QPrintDialog
-from PyQt5.QtCore import Qt, QSizeF
+from PyQt5.QtCore import Qt, QSizeF, QDate, pyqtSignal
 from PyQt5.QtGui import QFont
-from database import Inventory, SaleManager, ConcreteProduct
+from database import Inventory, SaleManager, ConcreteProduct, ProductCatalog
+from receipts import FileReceiptSink, Receipt, DEFAULT_TEMPLATE, escpos_sink
+from qt_models import ProductCompleterModel, SalesHistoryModel, ProductTableModel, BillTableModel
+from bill import Bill, format_money
+from promotions import BasketPricer
+from workers import TaskRunner
+from journal import SalesJournal, JournalError
+from connection import ConnectionManager
+import migrations
+from instrumentation import recorder
+# Printing (QtPrintSupport), imports/exports and the shared-till client are imported where
+# they are first used, so the till window comes up without loading them
+
+# Operations timed by the instrumentation recorder (see Diagnostics / --metrics-port)
+INVENTORY_OPS = ("add_product", "update_price", "update_stock", "delete_product",
+                 "search_product", "get_all_products")
+SALE_OPS = ("make_sale", "checkout", "get_all_sales", "get_sales_page")
+CATALOG_OPS = ("lookup", "reload")
+# Longest a worker lane waits for journaled sales to reach the database
+JOURNAL_TIMEOUT = 30
+
+class SalesHistoryWindow(QWidget):
+    def __init__(self, sales, tasks=None):
+        super().__init__()
+        self.sales = sales
+        self.tasks = tasks
+        self.setWindowTitle("Sales History")
+        self.resize(700, 500)
+        layout = QVBoxLayout()
+
+        filters = QHBoxLayout()
+        self.date_filter = QCheckBox("From")
+        self.start_input = QDateEdit(QDate.currentDate().addDays(-30))
+        self.start_input.setCalendarPopup(True)
+        self.end_input = QDateEdit(QDate.currentDate())
+        self.end_input.setCalendarPopup(True)
+        self.product_filter = QLineEdit()
+        self.product_filter.setPlaceholderText("Product name (optional)")
+        apply_btn = QPushButton("🔎 Filter")
+        apply_btn.clicked.connect(self.apply_filters)
+        self.product_filter.returnPressed.connect(self.apply_filters)
+        filters.addWidget(self.date_filter)
+        filters.addWidget(self.start_input)
+        filters.addWidget(QLabel("To"))
+        filters.addWidget(self.end_input)
+        filters.addWidget(self.product_filter)
+        filters.addWidget(apply_btn)
+        export_btn = QPushButton("📤 Export")
+        export_btn.clicked.connect(self.export)
+        filters.addWidget(export_btn)
+        layout.addLayout(filters)
+
+        # Only the rows scrolled into view are fetched from the database
+        self.model = SalesHistoryModel(sales.get_sales_page, runner=tasks, parent=self)
+        self.view = QTableView()
+        self.view.setModel(self.model)
+        self.view.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.view.verticalHeader().setVisible(False)
+        layout.addWidget(self.view)
+        self.setLayout(layout)
+
+        self.apply_filters()
+
+    def apply_filters(self):
+        start = end = None
+        if self.date_filter.isChecked():
+            start = self.start_input.date().toString("yyyy-MM-dd")
+            end = self.end_input.date().toString("yyyy-MM-dd")
+        self.model.set_filters(start, end, self.product_filter.text().strip())
+
+    def export(self):
+        # Exports exactly what the current filters show, oldest first
+        export_report_dialog(self, self.tasks, self.sales.reader, "sales", **self.model.filters)
+
+
+class ProductsWindow(QWidget):
+    def __init__(self, inv, tasks=None):
+        super().__init__()
+        self.inv = inv
+        self.tasks = tasks
+        self.setWindowTitle("All Products")
+        self.resize(700, 500)
+        layout = QVBoxLayout()
+
+        export_btn = QPushButton("📤 Export")
+        export_btn.clicked.connect(self.export)
+        layout.addWidget(export_btn, alignment=Qt.AlignRight)
+
+        # Only the rows scrolled into view are fetched from the database
+        self.model = ProductTableModel(inv.get_products_page, runner=tasks, parent=self)
+        self.view = QTableView()
+        self.view.setModel(self.model)
+        self.view.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.view.verticalHeader().setVisible(False)
+        layout.addWidget(self.view)
+        self.setLayout(layout)
+
+        self.model.set_filters()
+
+    def export(self):
+        export_report_dialog(self, self.tasks, self.inv.db.reader, "products")
+
+
+EXPORT_FILTERS = {"CSV (*.csv)": ".csv", "HTML (*.html)": ".html", "PDF (*.pdf)": ".pdf"}
+
+
+def export_report_dialog(parent, tasks, reader, report, **filters):
+    # Streams the report straight to the chosen file on the "read" worker lane
+    path, selected = QFileDialog.getSaveFileName(
+        parent, "Export Report", f"{report}-{datetime.now():%Y-%m-%d}", ";;".join(EXPORT_FILTERS)
+    )
+    if not path:
+        return
+    import reports
+    if os.path.splitext(path)[1].lower() not in reports.FORMATS:
+        path += EXPORT_FILTERS.get(selected, ".csv")
+
+    def done(count):
+        QMessageBox.information(parent, "Export", f"Wrote {count} rows to {path}")
+
+    def failed(error):
+        QMessageBox.warning(parent, "Error", f"Export failed: {error}")
+
+    def run():
+        # The reader is opened on whichever thread runs the export
+        return reports.export_report(reader(), report, path, **filters)
+
+    if tasks is None:
+        try:
+            done(run())
+        except Exception as e:
+            failed(e)
+        return
+    tasks.submit("read", run, on_done=done, on_error=failed)
+
 
 class POS(QMainWindow):
-    def __init__(self):
+    # Emitted from the import worker with the number of rows processed so far
+    import_progress = pyqtSignal(int)
+
+    def __init__(self, till=None, receipt_printer=None):
         super().__init__()
+        # till: TillClient when this window shares stock with other tills through server.py.
+        # Its calls run on the "till" lane; till_holds ({product name: quantity}) is what the
+        # service holds for the open bill and is only touched there.
+        self.till = till
+        self.till_holds = {}
+        # receipt_printer: EscPosSink for the thermal printer; None prints through Qt
+        # (qt_printer, the default printer until the cashier picks another)
+        self.receipt_printer = receipt_printer
+        self.qt_printer = None
         self.setWindowTitle("🛒 Shop POS System")
         self.setGeometry(100, 50, 1200, 650)
 
+        # Database and printing run on worker threads; results come back as Qt signals
+        self.tasks = TaskRunner(self)
+
         # Database
-        self.inv = Inventory()
-        self.sales = SaleManager(self.inv.conn)
+        # Every statement and commit on these connections is timed by the recorder
+        # Schema migrations run here; their batched backfills run on the "maintenance" lane
+        self.inv = Inventory(backfill=False, factory=recorder.connection_factory())
+        recorder.instrument(self.inv, INVENTORY_OPS, "db")
+        # Checkouts return once the bill is fsync'd to the journal; the database catches up
+        # in the background
+        self.journal = SalesJournal("sales.journal", self.inv.db.db_name)
+        # Loaded on the "db" lane once the window is up (see load_catalog); scans work before that
+        self.catalog = recorder.instrument(ProductCatalog(self.inv, load=False), CATALOG_OPS, "db")
+        # The till prints its own thermal receipt; the spooler only keeps receipt.txt current
+        self.sales = SaleManager(self.inv.conn, receipt_sink=FileReceiptSink(), catalog=self.catalog,
+                                 reader=self.inv.db.reader, journal=self.journal, promotions=self.inv.promotions)
+        recorder.instrument(self.sales, SALE_OPS, "db")
 
         # --- Main Layout ---
         main_layout = QHBoxLayout()
@@ -41,10 +202,18 @@ class POS(QMainWindow):
         btn_update_stock.clicked.connect(self.update_stock_dialog)
         side_menu.addWidget(btn_update_stock)
 
+        btn_restock = QPushButton("🚚 Restock")
+        btn_restock.clicked.connect(self.restock_dialog)
+        side_menu.addWidget(btn_restock)
+
         btn_update_price = QPushButton("💰 Update Price")
         btn_update_price.clicked.connect(self.update_price_dialog)
         side_menu.addWidget(btn_update_price)
 
+        btn_category = QPushButton("🏷️ Set Category")
+        btn_category.clicked.connect(self.set_category_dialog)
+        side_menu.addWidget(btn_category)
+
         btn_all_products = QPushButton("📃 All Products")
         btn_all_products.clicked.connect(self.get_all_products)
         side_menu.addWidget(btn_all_products)
@@ -53,10 +222,22 @@ class POS(QMainWindow):
         btn_delete_product.clicked.connect(self.delete_product_dialog)
         side_menu.addWidget(btn_delete_product)
 
+        btn_import = QPushButton("📥 Import Products")
+        btn_import.clicked.connect(self.import_products_dialog)
+        side_menu.addWidget(btn_import)
+
+        btn_export = QPushButton("📤 Export Products")
+        btn_export.clicked.connect(self.export_products_dialog)
+        side_menu.addWidget(btn_export)
+
         btn_sales_history = QPushButton("📑 Sales History")
         btn_sales_history.clicked.connect(self.get_all_sales)
         side_menu.addWidget(btn_sales_history)
 
+        btn_diagnostics = QPushButton("⏱️ Diagnostics")
+        btn_diagnostics.clicked.connect(self.show_diagnostics)
+        side_menu.addWidget(btn_diagnostics)
+
         side_menu_widget = QFrame()
         side_menu_widget.setLayout(side_menu)
         side_menu_widget.setFixedWidth(200)
@@ -92,17 +273,22 @@ class POS(QMainWindow):
         pos_layout.addLayout(controls_layout)
 
         # Bill Table
-        self.table = QTableWidget()
-        self.table.setColumnCount(6)
-        self.table.setHorizontalHeaderLabels(["Product", "Qty", "Price", "Total", "Barcode","Delete"])
+        # Promotions are applied as lines are scanned; checkout applies the same rules again
+        self.bill = Bill(BasketPricer(self.inv.promotions.index()))
+        self.bill_model = BillTableModel(self.bill, self)
+        self.bill_model.quantity_validator = self.validate_quantity
+        self.bill_model.quantityRejected.connect(lambda error: QMessageBox.warning(self, "Error", error))
+        self.bill_model.totalChanged.connect(self.update_total)
+        self.table = QTableView()
+        self.table.setModel(self.bill_model)
         self.table.setFont(QFont("Segoe UI", 12))
         self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
         self.table.verticalHeader().setVisible(False)
-        self.table.cellChanged.connect(self.edit_quantity)
+        self.table.clicked.connect(self.bill_cell_clicked)
         pos_layout.addWidget(self.table)
 
         # Total Label
-        self.total_label = QLabel("Grand Total: Rs.0")
+        self.total_label = QLabel("Grand Total: Rs.0.00")
         self.total_label.setFont(QFont("Segoe UI", 20, QFont.Bold))
         pos_layout.addWidget(self.total_label)
 
@@ -120,19 +306,99 @@ class POS(QMainWindow):
         container.setLayout(main_layout)
         self.setCentralWidget(container)
 
+        self.import_progress.connect(
+            lambda count: self.statusBar().showMessage(f"Importing products... {count} rows")
+        )
+
         # --- Initialize autocomplete ---
-        self.update_completer()
+        self.init_completer()
+
+        # First job on the "db" lane, so no sale or stock edit can run before it finishes
+        self.tasks.submit("db", self.load_catalog,
+                          on_done=lambda count: self.statusBar().showMessage(f"{count} products loaded", 3000),
+                          on_error=lambda e: QMessageBox.warning(self, "Error", f" Error loading catalog: {e}"))
+        self.backfill_stop = threading.Event()
+        if migrations.pending_backfills(self.inv.conn):
+            self.tasks.submit("maintenance", self.run_backfills,
+                              on_error=lambda e: print(f"Error upgrading database: {e}"))
+
+    def load_catalog(self):
+        # Runs on the "db" worker lane. Sales a crash left unapplied in the journal are
+        # replayed before stock is read.
+        self.wait_for_sales()
+        self.catalog.reload()
+        # Keep stock-at-date lookups cheap: fold the ledger into a snapshot when it has grown
+        self.inv.ledger.snapshot_if_due()
+        return len(self.catalog)
+
+    def run_backfills(self):
+        # Own connection: batches commit one by one between the till's writes. Stopped on
+        # close and resumed on the next start.
+        db = ConnectionManager(self.inv.db.db_name)
+        try:
+            return migrations.run_backfills(db.conn, stop=self.backfill_stop)
+        finally:
+            db.close()
+
+    def closeEvent(self, event):
+        self.backfill_stop.set()
+        self.tasks.wait()
+        if self.till:
+            try:
+                self.till.cancel()
+            except self.till.Error as e:
+                # The service drops the holds itself once the till has been idle a while
+                print(f"Could not release held stock: {e}")
+            self.till.close()
+        # Let queued receipts reach their sink before the database goes away
+        self.sales.close()
+        self.journal.close()
+        if self.receipt_printer:
+            self.receipt_printer.close()
+        self.inv.close()
+        super().closeEvent(event)
+
+    # -------------------------------
+    # Diagnostics
+    # -------------------------------
+    def show_diagnostics(self):
+        # Writes the full snapshot (histograms + recent operations) and summarises the slowest
+        try:
+            path = recorder.dump()
+        except OSError as e:
+            QMessageBox.warning(self, "Error", f"Could not write stats: {e}")
+            return
+        ops = recorder.snapshot(recent=0)["ops"]
+        slowest = sorted(ops.items(), key=lambda item: item[1]["max_ms"], reverse=True)[:10]
+        lines = [f"{name}: {stats['count']}x, mean {stats['mean_ms']:.2f} ms, max {stats['max_ms']:.2f} ms"
+                 for name, stats in slowest]
+        QMessageBox.information(
+            self, "Diagnostics",
+            "\n".join(lines or ["No operations recorded yet."]) +
+            f"\n\nFull stats written to {path}\nOperations over {recorder.slow_ms} ms are logged to {recorder.slow_log}"
+        )
 
     # -------------------------------
     # Autocomplete for product input
     # -------------------------------
-    def update_completer(self):
-        rows = self.inv.get_all_products()
-        product_names = [row[0] for row in rows]
-        completer = QCompleter(product_names)
+    def init_completer(self):
+        # One persistent completer; its model follows the typed text and single product edits
+        self.completer_model = ProductCompleterModel(self.inv.search, parent=self)
+        completer = QCompleter(self.completer_model, self)
         completer.setCaseSensitivity(Qt.CaseInsensitive)
-        completer.setFilterMode(Qt.MatchContains)
+        completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
         self.product_input.setCompleter(completer)
+        self.product_input.textEdited.connect(self.suggest_products)
+        completer.popup().verticalScrollBar().valueChanged.connect(self.load_more_suggestions)
+
+    def suggest_products(self, text):
+        self.completer_model.set_query(text)
+        if text.strip():
+            self.product_input.completer().complete()
+
+    def load_more_suggestions(self, value):
+        if value == self.product_input.completer().popup().verticalScrollBar().maximum():
+            self.completer_model.fetch_more()
 
     # -------------------------------
     # Add product dialog
@@ -150,9 +416,8 @@ class POS(QMainWindow):
         stock, ok3 = QInputDialog.getInt(self, "Add Product", "Enter Stock:")
         if not ok3:
             return
-        result = self.inv.add_product(ConcreteProduct(name, price, stock, barcode))
-        self.update_completer()
-        QMessageBox.information(self, "Info", result)
+        self.tasks.submit("db", self.catalog.add_product, ConcreteProduct(name, price, stock, barcode),
+                          on_done=lambda result: self.product_changed(name, result, added=True))
 
     def update_stock_dialog(self):
         name, ok1 = QInputDialog.getText(self, "Update Stock", "Enter Product Name:")
@@ -161,9 +426,31 @@ class POS(QMainWindow):
         stock, ok2 = QInputDialog.getInt(self, "Update Stock", "Enter New Stock:")
         if not ok2:
             return
-        result = self.inv.update_stock(name, stock)
-        self.update_completer()
-        QMessageBox.information(self, "Info", result)
+        self.tasks.submit("db", self.set_stock, name, stock,
+                          on_done=lambda result: self.product_changed(name, result))
+
+    def set_stock(self, name, stock):
+        # Runs on the "db" worker lane; the new count replaces stock after pending sales land
+        try:
+            self.wait_for_sales()
+        except JournalError as e:
+            return f" Stock not updated: {e}"
+        return self.catalog.update_stock(name, stock)
+
+    def wait_for_sales(self):
+        # Worker lanes only: stock is about to be read or replaced from the database
+        if not self.sales.wait_recorded(JOURNAL_TIMEOUT):
+            raise JournalError("Sales are still being written to the database, please try again")
+
+    def restock_dialog(self):
+        name, ok1 = QInputDialog.getText(self, "Restock", "Enter Product Name:")
+        if not ok1 or not name:
+            return
+        quantity, ok2 = QInputDialog.getInt(self, "Restock", "Units Received:", 1, 1)
+        if not ok2:
+            return
+        self.tasks.submit("db", self.catalog.restock, name, quantity,
+                          on_done=lambda result: self.product_changed(name, result))
 
     def update_price_dialog(self):
         name, ok1 = QInputDialog.getText(self, "Update Price", "Enter Product Name:")
@@ -172,58 +459,104 @@ class POS(QMainWindow):
         price, ok2 = QInputDialog.getDouble(self, "Update Price", "Enter New Price:")
         if not ok2:
             return
-        result = self.inv.update_price(name, price)
-        self.update_completer()
-        QMessageBox.information(self, "Info", result)
+        self.tasks.submit("db", self.catalog.update_price, name, price,
+                          on_done=lambda result: self.product_changed(name, result))
+
+    def set_category_dialog(self):
+        name, ok1 = QInputDialog.getText(self, "Set Category", "Enter Product Name:")
+        if not ok1 or not name:
+            return
+        category, ok2 = QInputDialog.getText(self, "Set Category", "Category (empty to clear):")
+        if not ok2:
+            return
+        self.tasks.submit("db", self.catalog.set_category, name, category.strip(),
+                          on_done=lambda result: self.product_changed(name, result))
 
     def delete_product_dialog(self):
         name, ok = QInputDialog.getText(self, "Delete Product", "Enter Product Name to Delete:")
         if not ok or not name:
             return
-        result = self.inv.delete_product(name)
-        self.update_completer()
+        self.tasks.submit("db", self.catalog.delete_product, name,
+                          on_done=lambda result: self.product_changed(name, result, removed=True))
+
+    def product_changed(self, name, result, added=False, removed=False):
+        if added and self.catalog.get(name=name):
+            self.completer_model.product_added(name)
+        if removed:
+            self.completer_model.product_removed(name)
+        self.refresh_shared(name)
         QMessageBox.information(self, "Info", result)
 
     # -------------------------------
-    # Show products
+    # Bulk import / export
     # -------------------------------
-    def get_all_products(self):
-        rows = self.inv.get_all_products()
-        if not rows:
-            QMessageBox.information(self, "Info", "No products found!")
+    def import_products_dialog(self):
+        path, _ = QFileDialog.getOpenFileName(
+            self, "Import Products", "", "Product files (*.csv *.jsonl *.json);;All files (*)"
+        )
+        if not path:
+            return
+        key, ok = QInputDialog.getItem(
+            self, "Import Products", "Match existing products by:", ["name", "barcode"], 0, False
+        )
+        if not ok:
             return
+        self.statusBar().showMessage("Importing products...")
+        self.tasks.submit("db", self.import_products_file, path, key,
+                          on_done=self.products_imported,
+                          on_error=lambda e: QMessageBox.warning(self, "Error", f" Import failed: {e}"))
+
+    def import_products_file(self, path, key):
+        # Runs on the "db" worker lane
+        import bulk_io
+        self.wait_for_sales()
+        report = bulk_io.import_file(self.inv, path, key, progress=self.import_progress.emit)
+        self.catalog.reload()
+        return report
+
+    def products_imported(self, report):
+        self.completer_model.set_query(self.completer_model.query)
+        if self.till:
+            self.tasks.submit("till", self.till.reload, on_error=self.shared_not_updated)
+        self.statusBar().showMessage(str(report).strip(), 5000)
+        message = str(report)
+        if report.errors:
+            message += "\n\n" + "\n".join(f"Line {line}: {error}" for line, error in report.errors[:10])
+            if len(report.errors) > 10:
+                message += f"\n... and {len(report.errors) - 10} more"
+        QMessageBox.information(self, "Import", message)
+
+    def export_products_dialog(self):
+        path, _ = QFileDialog.getSaveFileName(
+            self, "Export Products", "products.csv", "CSV (*.csv);;JSON Lines (*.jsonl)"
+        )
+        if not path:
+            return
+        import bulk_io
+        self.tasks.submit("read", bulk_io.export_products, self.inv, path,
+                          on_done=lambda count: QMessageBox.information(self, "Export", f" Exported {count} products to {path}"),
+                          on_error=lambda e: QMessageBox.warning(self, "Error", f" Export failed: {e}"))
+
+    def refresh_shared(self, name):
+        # Products are edited in the shared database; the service keeps its own cache
+        if self.till:
+            self.tasks.submit("till", self.till.refresh, name, on_error=self.shared_not_updated)
 
-        html = "<html><head><style>table {border-collapse: collapse; width: 100%;} th, td {border: 1px solid #444; padding: 8px; text-align: left;} th {background-color: #28a745; color: white;} tr:nth-child(even) {background-color: #f2f2f2;}</style></head><body><h2>All Products Report</h2><table><tr><th>Name</th><th>Price (Rs.)</th><th>Stock</th><th>Barcode</th></tr>"
-        for row in rows:
-            html += f"<tr><td>{row[0]}</td><td>{row[1]}</td><td>{row[2]}</td><td>{row[3]}</td></tr>"
-        html += "</table></body></html>"
+    def shared_not_updated(self, error):
+        QMessageBox.warning(self, "Warning", f"Inventory service not updated: {error}")
 
-        self.products_window = QTextEdit()
-        self.products_window.setReadOnly(True)
-        self.products_window.setHtml(html)
-        self.products_window.setWindowTitle("All Products")
-        self.products_window.resize(700, 500)
+    # -------------------------------
+    # Show products
+    # -------------------------------
+    def get_all_products(self):
+        self.products_window = ProductsWindow(self.inv, self.tasks)
         self.products_window.show()
 
     # -------------------------------
     # Show sales history
     # -------------------------------
     def get_all_sales(self):
-        rows = self.sales.get_all_sales()
-        if not rows:
-            QMessageBox.information(self, "Info", "No sales found!")
-            return
-
-        html = "<html><head><style>table {border-collapse: collapse; width: 100%;} th, td {border: 1px solid #444; padding: 8px; text-align: left;} th {background-color: #007bff; color: white;} tr:nth-child(even) {background-color: #f2f2f2;}</style></head><body><h2>Sales History</h2><table><tr><th>Date</th><th>Product</th><th>Qty</th><th>Total (Rs.)</th></tr>"
-        for row in rows:
-            html += f"<tr><td>{row[0]}</td><td>{row[1]}</td><td>{row[2]}</td><td>{row[3]}</td></tr>"
-        html += "</table></body></html>"
-
-        self.sales_window = QTextEdit()
-        self.sales_window.setReadOnly(True)
-        self.sales_window.setHtml(html)
-        self.sales_window.setWindowTitle("Sales History")
-        self.sales_window.resize(700, 500)
+        self.sales_window = SalesHistoryWindow(self.sales, self.tasks)
         self.sales_window.show()
 
     # -------------------------------
@@ -236,190 +569,239 @@ class POS(QMainWindow):
             return
 
         qty = self.qty_input.value()
+        self.product_input.clear()
 
-        self.inv.cursor.execute(
-            "SELECT name, price, stock, barcode FROM products WHERE name=?",
-            (code_or_name,)
-        )
-        row = self.inv.cursor.fetchone()
-
-        if not row:
-            self.inv.cursor.execute(
-                "SELECT name, price, stock, barcode FROM products WHERE barcode=?",
-                (code_or_name,)
-            )
-            row = self.inv.cursor.fetchone()
+        if self.till:
+            # The line appears once the service holds the units; scans queue up in order meanwhile
+            self.tasks.submit("till", self.hold_scanned, code_or_name, qty,
+                              on_done=self.scan_held,
+                              on_error=lambda e: QMessageBox.warning(self, "Error", str(e)))
+            return
 
-        if not row:
+        entry = self.catalog.lookup(code_or_name)
+        if not entry:
             QMessageBox.warning(self, "Error", "Product not found!")
-            self.product_input.clear()
             return
-
-        prod_name, price, stock, barcode = row
-
-        if qty > stock:
-            QMessageBox.warning(self, "Error", f"Not enough stock! Available: {stock}")
-            self.product_input.clear()
+        if qty > entry.stock:
+            QMessageBox.warning(self, "Error", f"Not enough stock! Available: {entry.stock}")
             return
-
-        for r in range(self.table.rowCount()):
-            if self.table.item(r, 0).text() == prod_name:
-                old_qty = int(self.table.item(r, 1).text())
-                new_qty = old_qty + qty
-                self.table.item(r, 1).setText(str(new_qty))
-                self.table.item(r, 3).setText(str(new_qty * price))
-                self.update_total()
-                self.product_input.clear()
-                return
-
-        row_position = self.table.rowCount()
-        self.table.insertRow(row_position)
-        self.table.setItem(row_position, 0, QTableWidgetItem(prod_name))
-        self.table.setItem(row_position, 1, QTableWidgetItem(str(qty)))
-        self.table.setItem(row_position, 2, QTableWidgetItem(str(price)))
-        self.table.setItem(row_position, 3, QTableWidgetItem(str(price * qty)))
-        self.table.setItem(row_position, 4, QTableWidgetItem(str(barcode)))
-
-        delete_btn = QPushButton("🗑️")
-        delete_btn.clicked.connect(lambda _, btn=delete_btn: self.delete_from_bill_widget(btn))
-        self.table.setCellWidget(row_position, 5, delete_btn)
-        self.update_total()
-        self.product_input.clear()
-
-    def delete_from_bill_widget(self, btn):
-        for r in range(self.table.rowCount()):
-            if self.table.cellWidget(r, 5) == btn:
-                self.table.removeRow(r)
-                self.update_total()
-                break
+        self.bill_model.add(entry.id, entry.name, entry.price, qty, entry.barcode, entry.category)
+
+    def hold_scanned(self, code_or_name, qty):
+        # Runs on the "till" lane: hold the units on the shared service so another till
+        # cannot sell them
+        product = self.till.lookup(code_or_name)
+        self.hold(product["name"], self.till_holds.get(product["name"], 0) + qty)
+        return product, qty
+
+    def scan_held(self, result):
+        product, qty = result
+        self.bill_model.add(product["id"], product["name"], product["price"], qty, product["barcode"],
+                            product.get("category"))
+
+    def hold(self, name, quantity):
+        # Runs on the "till" lane
+        self.till.reserve(name, quantity)
+        if quantity:
+            self.till_holds[name] = quantity
+        else:
+            self.till_holds.pop(name, None)
+
+    def bill_cell_clicked(self, index):
+        if index.column() == BillTableModel.DELETE_COLUMN:
+            self.delete_from_bill(index.row())
+
+    def delete_from_bill(self, row):
+        line = self.bill_model.remove(row)
+        if self.till:
+            self.tasks.submit("till", self.hold, line.name, 0, on_error=self.shared_not_updated)
 
     # -------------------------------
     # Edit quantity directly
     # -------------------------------
-    def edit_quantity(self, row, col):
-        if col == 1:
-            try:
-                qty = int(self.table.item(row, col).text())
-                price = float(self.table.item(row, 2).text())
-                self.table.item(row, 3).setText(str(qty * price))
-                self.update_total()
-            except:
-                pass
+    def validate_quantity(self, line, quantity):
+        # Shared tills: the edit shows at once and is put back if the service can't hold it
+        if self.till:
+            previous = line.quantity
+            self.tasks.submit("till", self.hold, line.name, quantity,
+                              on_error=lambda e: self.quantity_refused(line, previous, quantity, e))
+        return None
+
+    def quantity_refused(self, line, previous, quantity, error):
+        row = self.bill.row_of(line.product_id)
+        if row is not None and line.quantity == quantity:
+            self.bill_model.set_quantity(row, previous)
+        QMessageBox.warning(self, "Error", str(error))
 
     # -------------------------------
     # Update total
     # -------------------------------
-    def update_total(self):
-        total = 0
-        for r in range(self.table.rowCount()):
-            total += float(self.table.item(r, 3).text())
-        self.total_label.setText(f"Grand Total: Rs.{total}")
+    def update_total(self, total=None):
+        saved = f"  (saved Rs.{format_money(self.bill.discount)})" if self.bill.discount else ""
+        self.total_label.setText(f"Grand Total: Rs.{format_money(self.bill.total)}{saved}")
 
     # -------------------------------
     # Complete sale and print
     # -------------------------------
     def complete_sale(self):
-        if self.table.rowCount() == 0:
+        if len(self.bill) == 0:
             QMessageBox.warning(self, "Error", "No items in bill!")
             return
 
-        self.finalize_btn.setEnabled(False)
+        # Promotions edited, started or ended since the last scan show before the bill is frozen
+        self.bill_model.reprice(self.inv.promotions.index())
+        lines = self.bill.checkout_lines()
+        receipt_rows = self.bill.receipt_rows()
+        discounts = self.bill.receipt_discounts()
+
+        # The bill is frozen only for the few ms the sale takes to commit
+        self.set_bill_enabled(False)
+        self.tasks.submit(
+            "till" if self.till else "db", self.checkout_lines, lines,
+            on_done=lambda result: self.sale_committed(result, receipt_rows, discounts),
+            on_error=lambda error: self.sale_committed((None, f" Error completing sale: {error}"),
+                                                       receipt_rows, discounts)
+        )
+
+    def checkout_lines(self, lines):
+        # Runs on the "db" worker lane, or the "till" lane for shared tills
+        if self.till:
+            try:
+                # Quantities may have been edited in the table since they were held
+                for name, _, qty in lines:
+                    self.hold(name, qty)
+                result = self.till.checkout()
+            except self.till.Error as e:
+                return None, str(e)
+            # The service released this till's holds with the sale
+            self.till_holds.clear()
+            return result
+        return self.sales.checkout(lines)
+
+    def set_bill_enabled(self, enabled):
+        self.finalize_btn.setEnabled(enabled)
+        self.product_input.setEnabled(enabled)
+        self.table.setEnabled(enabled)
+
+    def sale_committed(self, result, receipt_rows, discounts=()):
+        bill_id, message = result
+        self.set_bill_enabled(True)
+        if bill_id is None:
+            QMessageBox.warning(self, "Error", message)
+            return
 
-        try:
-            shop_name = "🛒 My Shop"
-            user_name = "Admin"
-            date_time = datetime.now().strftime("%d/%m/%Y %H:%M")
-
-            # Optimized for thermal printer: 32 characters width (fits 80mm paper at 10pt monospaced)
-            receipt_width = 32
-            separator = "=" * receipt_width
-
-            receipt = f"{separator}\n"
-            # Center shop name (truncate if too long)
-            shop_name_short = (shop_name[:receipt_width//2 * 2]).center(receipt_width)
-            receipt += f"{shop_name_short}\n"
-            receipt += f"{separator}\n"
-            receipt += f"Date: {date_time}\n"
-            receipt += f"Cashier: {user_name}\n"
-            receipt += f"{separator}\n"
-
-            # Compact items header (fits 32 chars: Name=16, Qty=3, Price=6, Total=7)
-            receipt += f"{'Item':<16} {'Qty':>2} {'@':>1} {'Price':>5} {'Total':>7}\n"
-            receipt += f"{separator}\n"
-
-            total_amount = 0
-            for r in range(self.table.rowCount()):
-                name = self.table.item(r, 0).text()[:16]  # Truncate to 16 chars
-                qty = int(self.table.item(r, 1).text())
-                price = float(self.table.item(r, 2).text())
-                item_total = float(self.table.item(r, 3).text())
-                total_amount += item_total
-                
-                name_padded = name.ljust(16)
-                # Compact line: Name (16) + Qty (2) + @ (1) + Price (5) + Total (7) = 31 chars
-                receipt += f"{name_padded}{qty:>2} @ {price:>5.2f} {item_total:>7.2f}\n"
-                
-                barcode = self.table.item(r, 4).text()
-                self.sales.make_sale(name=name, barcode=barcode, quantity=qty)
-
-            receipt += f"{separator}\n"
-            # Total line (fits width)
-            total_padded = "TOTAL AMOUNT".ljust(22)
-            receipt += f"{total_padded}{total_amount:>7.2f}\n"
-            receipt += f"{separator}\n"
-            receipt += "Thank you!\n"
-            receipt += "Visit again.\n"  # Short footer for small paper
-            receipt += f"{separator}\n"
-            receipt += "\n"  # Extra line for clean cut
-
-            # Direct print setup for thermal printer (small paper, no popups)
-            doc = QTextDocument()
-            doc.setPlainText(receipt)
-            # Monospaced font optimized for thermal (small size, fixed width)
-            font = QFont("Courier New", 8)  # Smaller font (8pt) for compact receipt
-            doc.setDefaultFont(font)
-            
-            printer = QPrinter(QPrinter.HighResolution)
-            printer.setOutputFormat(QPrinter.NativeFormat)  # Only physical printing
-            printer.setPageSize(QPrinter.Custom)
-            # Thermal paper: 80mm width, 150mm height (enough for typical receipt; auto-feeds if longer)
-            printer.setPaperSize(QSizeF(80, 150), QPrinter.Millimeter)
-            printer.setFullPage(True)
-            printer.setPageMargins(0, 0, 0, 0, QPrinter.Millimeter)  # Zero margins for edge-to-edge
-            printer.setOrientation(QPrinter.Portrait)
-            printer.setColorMode(QPrinter.Monochrome)  # Black & white for thermal
-
-            # Attempt direct print to default printer (no dialog for POS speed)
-            success = doc.print_(printer)
-            if success:
-                self.table.setRowCount(0)
-                self.update_total()
-                QMessageBox.information(self, "Success", "Sale Completed and Receipt Printed ✅")
-            else:
-                # Fallback: Manual print dialog (only if direct fails, e.g., no default printer)
-                dialog = QPrintDialog(printer, self)
-                dialog.setWindowTitle("Print Receipt (Manual)")
-                if dialog.exec_() == QPrintDialog.Accepted:
-                    doc.print_(printer)
-                    self.table.setRowCount(0)
-                    self.update_total()
-                    QMessageBox.information(self, "Success", "Sale Completed and Receipt Printed ✅")
-                else:
-                    self.table.setRowCount(0)
-                    self.update_total()
-                    QMessageBox.information(self, "Info", "Sale Completed. Printing Cancelled.")
-        except Exception as e:
-            # Robust error handling: Always complete sale, log error
-            print(f"Error in complete_sale: {e}")
-            self.table.setRowCount(0)
-            self.update_total()
-            QMessageBox.warning(self, "Warning", f"Sale Completed, but printing failed: {str(e)}\nCheck printer connection.")
-        finally:
-            self.finalize_btn.setEnabled(True)
+        self.bill_model.clear()
+        self.product_input.setFocus()
+        self.statusBar().showMessage(f"Bill #{bill_id} completed. Printing receipt...")
+        receipt = Receipt(receipt_rows, bill_id, datetime.now(), discounts)
+        if self.receipt_printer:
+            # Raw ESC/POS to the thermal printer; no Qt document or print dialog involved
+            self.tasks.submit(
+                "print", self.receipt_printer.emit, receipt,
+                on_done=lambda _: self.receipt_printed(True, bill_id, receipt),
+                on_error=lambda error: self.receipt_failed(error, bill_id)
+            )
+            return
+        self.tasks.submit(
+            "print", print_receipt_document, receipt, self.qt_printer,
+            on_done=lambda printed: self.receipt_printed(printed, bill_id, receipt),
+            on_error=lambda error: self.receipt_failed(error, bill_id)
+        )
 
+    def receipt_printed(self, printed, bill_id, receipt):
+        if printed:
+            self.statusBar().showMessage(f"Bill #{bill_id} completed and receipt printed ✅", 5000)
+            return
+        # Fallback: Manual print dialog (only if direct fails, e.g., no default printer)
+        from PyQt5.QtPrintSupport import QPrintDialog
+        printer = thermal_printer()
+        dialog = QPrintDialog(printer, self)
+        dialog.setWindowTitle("Print Receipt (Manual)")
+        if dialog.exec_() == QPrintDialog.Accepted:
+            # Later receipts go straight to the printer picked here
+            self.qt_printer = printer
+            self.tasks.submit(
+                "print", print_receipt_document, receipt, printer,
+                on_done=lambda ok: self.statusBar().showMessage(f"Bill #{bill_id} receipt printed ✅", 5000),
+                on_error=lambda error: self.receipt_failed(error, bill_id)
+            )
+        else:
+            self.statusBar().showMessage(f"Bill #{bill_id} completed. Printing cancelled.", 5000)
+
+    def receipt_failed(self, error, bill_id):
+        print(f"Error printing receipt for bill #{bill_id}: {error}")
+        QMessageBox.warning(self, "Warning", f"Sale Completed, but printing failed: {str(error)}\nCheck printer connection.")
+
+
+def thermal_printer():
+    from PyQt5.QtPrintSupport import QPrinter
+    printer = QPrinter(QPrinter.HighResolution)
+    printer.setOutputFormat(QPrinter.NativeFormat)  # Only physical printing
+    printer.setPageSize(QPrinter.Custom)
+    # Thermal paper: 80mm width, 150mm height (enough for typical receipt; auto-feeds if longer)
+    printer.setPaperSize(QSizeF(80, 150), QPrinter.Millimeter)
+    printer.setFullPage(True)
+    printer.setPageMargins(0, 0, 0, 0, QPrinter.Millimeter)  # Zero margins for edge-to-edge
+    printer.setOrientation(QPrinter.Portrait)
+    printer.setColorMode(QPrinter.GrayScale)  # Black & white for thermal
+    return printer
+
+
+_default_printer = None
+
+
+def default_thermal_printer():
+    # Set up once: building a QPrinter queries the print system for the default printer
+    global _default_printer
+    if _default_printer is None:
+        _default_printer = thermal_printer()
+    return _default_printer
+
+
+def print_receipt_document(receipt, printer=None):
+    # Runs on the "print" worker lane; returns False when there is no usable printer.
+    # Used when no raw ESC/POS printer is configured (--receipt-printer).
+    from PyQt5.QtGui import QTextDocument
+    from PyQt5.QtPrintSupport import QPrinter
+    printer = printer or default_thermal_printer()
+    # No default printer configured: let the cashier pick one
+    if not printer.isValid() or not printer.printerName():
+        return False
+    doc = QTextDocument()
+    doc.setPlainText(DEFAULT_TEMPLATE.render(receipt))
+    # Monospaced font optimized for thermal (small size, fixed width)
+    doc.setDefaultFont(QFont("Courier New", 8))
+    with recorder.timed("print", "print_receipt_document", printer.printerName()):
+        doc.print_(printer)
+    return printer.printerState() != QPrinter.Error
+
+
+# Event handlers are wrapped on the class so the bound methods connected in __init__ are timed
+recorder.instrument(POS, (
+    "add_to_bill", "delete_from_bill", "validate_quantity", "update_total", "complete_sale",
+    "scan_held", "sale_committed", "suggest_products", "load_more_suggestions", "add_product_dialog",
+    "update_stock_dialog", "restock_dialog", "update_price_dialog", "set_category_dialog", "delete_product_dialog",
+    "product_changed", "get_all_products", "get_all_sales", "receipt_printed",
+), "ui", slots=True)
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
-    window = POS()
+    till = None
+    # python app.py --server 127.0.0.1:8765 [--till NAME] shares stock with other tills
+    if "--server" in sys.argv:
+        from server import TillClient
+        host, port = sys.argv[sys.argv.index("--server") + 1].rsplit(":", 1)
+        name = sys.argv[sys.argv.index("--till") + 1] if "--till" in sys.argv else socket.gethostname()
+        till = TillClient(name, host, int(port))
+    # python app.py --metrics-port 9108 serves /stats and /metrics on localhost
+    if "--metrics-port" in sys.argv:
+        recorder.serve(int(sys.argv[sys.argv.index("--metrics-port") + 1]))
+    # python app.py --receipt-printer /dev/usb/lp0 (or tcp:192.168.1.50[:9100]) prints raw ESC/POS
+    receipt_printer = None
+    spec = sys.argv[sys.argv.index("--receipt-printer") + 1] if "--receipt-printer" in sys.argv \
+        else os.environ.get("POS_RECEIPT_PRINTER")
+    if spec:
+        receipt_printer = escpos_sink(spec)
+    window = POS(till, receipt_printer)
     window.show()
     sys.exit(app.exec_())
@@ -0,0 +1,266 @@
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from database import Inventory, SaleManager, ProductCatalog
+from receipts import NullReceiptSink, LoopbackReceiptSink, Receipt, DEFAULT_TEMPLATE
+from bill import Bill, BillLine
+from promotions import BasketPricer, Promotions
+
+# "before" is SQLite's stock configuration (what a bare sqlite3.connect gives you);
+# "after" is ConnectionManager's defaults.
+PROFILES = {
+    "before": dict(journal_mode="DELETE", synchronous="FULL", cache_size=-2000, mmap_size=0),
+    "after": {},
+}
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    k = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[k]
+
+
+def summarize(samples):
+    # samples are seconds; report milliseconds
+    total = sum(samples)
+    return {
+        "count": len(samples),
+        "mean_ms": round(total / len(samples) * 1000, 4) if samples else 0.0,
+        "p50_ms": round(percentile(samples, 50) * 1000, 4),
+        "p99_ms": round(percentile(samples, 99) * 1000, 4),
+        "ops_per_sec": round(len(samples) / total, 1) if total else 0.0,
+    }
+
+
+WORDS = ("apple", "banana", "cola", "juice", "milk", "bread", "soap", "rice", "sugar", "tea",
+         "coffee", "oil", "salt", "egg", "butter", "cheese", "water", "chips", "biscuit", "cream")
+
+
+def product_name(i):
+    return f"{WORDS[i % len(WORDS)]} {WORDS[(i // len(WORDS)) % len(WORDS)]} {i}"
+
+
+def barcode(i):
+    return f"{1000000 + i}"
+
+
+def seed_products(inv, count, stock=1_000_000):
+    # Large catalogs skip per-row search indexing and rebuild it once
+    inv.search.suspend_sync()
+    inv.conn.executemany(
+        "INSERT INTO products (name, price, stock, barcode) VALUES (?, ?, ?, ?)",
+        ((product_name(i), 10.0 + i % 500, stock, barcode(i)) for i in range(count))
+    )
+    inv.conn.commit()
+    inv.search.resume_sync()
+
+
+def seed_sales(inv, count, products, seed=0):
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(count):
+        i = rng.randrange(products)
+        quantity = rng.randint(1, 5)
+        price = 10.0 + i % 500
+        rows.append((product_name(i), quantity, price, price * quantity,
+                     f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} "
+                     f"{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00"))
+        if len(rows) == 10000:
+            inv.conn.executemany(
+                "INSERT INTO sales (product_name, quantity, price, total, sale_time) VALUES (?, ?, ?, ?, ?)", rows
+            )
+            rows = []
+    if rows:
+        inv.conn.executemany(
+            "INSERT INTO sales (product_name, quantity, price, total, sale_time) VALUES (?, ?, ?, ?, ?)", rows
+        )
+    inv.conn.commit()
+
+
+def seed_promotions(inv, products):
+    # A category per first word, a "3 for" bundle and a 2+ percent deal per category, and a
+    # multibuy price on every 10th product
+    inv.conn.executemany("UPDATE products SET category = ? WHERE (id - 1) % ? = ?",
+                         [(word, len(WORDS), i) for i, word in enumerate(WORDS)])
+    inv.conn.commit()
+    for word in WORDS:
+        inv.promotions.add(f"{word} 3 for 25", "bundle", 25, category=word, min_qty=3)
+        inv.promotions.add(f"{word} 5% off", "percent", 5, category=word, min_qty=2)
+    for i in range(0, products, 10):
+        inv.promotions.add(f"{product_name(i)} 2+", "price", 9, product_name=product_name(i), min_qty=2)
+
+
+def scan_bill(index, entries):
+    # A bill built one scan at a time, as the till does; entries: CatalogEntry values
+    bill = Bill(BasketPricer(index))
+    for entry in entries:
+        bill.add(entry.id, entry.name, entry.price, 1 + entry.id % 3, entry.barcode, entry.category)
+    return bill
+
+
+def measure(fn, iterations):
+    # Timings are taken without tracemalloc (it slows allocation-heavy code down a lot);
+    # one extra call under tracemalloc gives the peak memory of a single operation.
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return dict(summarize(samples), peak_kb=round(peak / 1024, 1))
+
+
+def bench_commit_latency(sales=500, products=1000, workdir=None):
+    results = {}
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        for profile, settings in PROFILES.items():
+            inv = Inventory(os.path.join(tmp, f"{profile}.db"), **settings)
+            seed_products(inv, products)
+            manager = SaleManager(inv.conn, receipt_sink=NullReceiptSink())
+            samples = []
+            for i in range(sales):
+                started = time.perf_counter()
+                manager.make_sale(name=product_name(i % products), quantity=1)
+                samples.append(time.perf_counter() - started)
+            manager.close()
+            results[profile] = dict(summarize(samples), journal_mode=inv.db.journal_mode,
+                                    synchronous=inv.db.synchronous)
+            inv.close()
+    return results
+
+
+def bench_suite(products=1000, sales_history=10000, iterations=200, basket_sizes=(1, 10, 40),
+                workdir=None, seed=0):
+    # The scan-to-receipt hot path against a seeded catalog and sales history
+    rng = random.Random(seed)
+    results = {"config": dict(products=products, sales_history=sales_history, iterations=iterations,
+                              basket_sizes=list(basket_sizes))}
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        inv = Inventory(os.path.join(tmp, "shop.db"))
+        started = time.perf_counter()
+        seed_products(inv, products)
+        seed_sales(inv, sales_history, products, seed=seed)
+        results["seed_seconds"] = round(time.perf_counter() - started, 2)
+
+        catalog = ProductCatalog(inv)
+        manager = SaleManager(inv.conn, receipt_sink=NullReceiptSink(), catalog=catalog, reader=inv.db.reader)
+        heavy = max(1, min(iterations, 5))
+
+        results["search_product"] = measure(
+            lambda: inv.search_product(name=WORDS[rng.randrange(len(WORDS))][:4]), iterations
+        )
+        results["scan_lookup_barcode"] = measure(
+            lambda: catalog.lookup(barcode(rng.randrange(products))), iterations
+        )
+        results["scan_lookup_name"] = measure(
+            lambda: catalog.lookup(product_name(rng.randrange(products))), iterations
+        )
+        results["make_sale"] = measure(
+            lambda: manager.make_sale(name=product_name(rng.randrange(products))), iterations
+        )
+        for size in basket_sizes:
+            results[f"checkout_{size}_lines"] = measure(
+                lambda: manager.checkout([(product_name(rng.randrange(products)), None, 1) for _ in range(size)]),
+                max(1, iterations // 4)
+            )
+        # Receipt rendering, off the sale path but once per bill
+        receipt = Receipt([(product_name(i), 1 + i % 3, 12.5, 12.5 * (1 + i % 3)) for i in range(10)], 1, None)
+        results["render_receipt_text"] = measure(lambda: DEFAULT_TEMPLATE.render(receipt), iterations)
+        printer = LoopbackReceiptSink()
+        results["print_receipt_escpos"] = measure(lambda: printer.emit(receipt), iterations)
+        # Promotions: pricing a 100-line basket at checkout, scanning one line by line, and
+        # one quantity change in it (only that line's product and category are re-priced)
+        seed_promotions(inv, products)
+        catalog.reload()
+        index = inv.promotions.index()
+        entries = [catalog.lookup(product_name(rng.randrange(products))) for _ in range(100)]
+        basket = [BillLine(e.id, e.name, None, int(e.price * 100), 1 + e.id % 3, e.category) for e in entries]
+        results["promotions_index_load"] = measure(lambda: Promotions(inv.conn).index(), heavy)
+        results["promotions_price_100_lines"] = measure(lambda: BasketPricer(index).reprice(basket), iterations)
+        results["promotions_scan_100_lines"] = measure(lambda: scan_bill(index, entries), iterations)
+        bill = scan_bill(index, entries)
+        results["promotions_change_1_of_100"] = measure(
+            lambda: bill.set_quantity(rng.randrange(len(bill)), rng.randint(1, 5)), iterations
+        )
+        promoted = SaleManager(inv.conn, receipt_sink=NullReceiptSink(), catalog=catalog, reader=inv.db.reader,
+                               promotions=inv.promotions)
+        size = max(basket_sizes)
+        results[f"checkout_{size}_lines_promotions"] = measure(
+            lambda: promoted.checkout([(product_name(rng.randrange(products)), None, 1) for _ in range(size)]),
+            max(1, iterations // 4)
+        )
+        promoted.close()
+        results["sales_page"] = measure(lambda: manager.get_sales_page(limit=200), iterations)
+        results["get_all_products"] = measure(inv.get_all_products, heavy)
+        results["get_all_sales"] = measure(manager.get_all_sales, heavy)
+
+        manager.close()
+        inv.close()
+    return results
+
+
+def compare(current, baseline, threshold=0.10):
+    # Lines describing p50/p99/peak memory changes beyond `threshold` (0.10 = 10%) against a baseline run
+    lines = []
+    for name, metrics in current.items():
+        base = baseline.get(name)
+        if not isinstance(metrics, dict) or not isinstance(base, dict):
+            continue
+        for key in ("p50_ms", "p99_ms", "peak_kb"):
+            if key not in metrics or not base.get(key):
+                continue
+            change = (metrics[key] - base[key]) / base[key]
+            if abs(change) >= threshold:
+                verdict = "REGRESSION" if change > 0 else "improvement"
+                lines.append(f"{verdict:<11} {name}.{key}: {base[key]} -> {metrics[key]} ({change:+.0%})")
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Headless POS benchmarks (JSON output)")
+    sub = parser.add_subparsers(dest="command")
+    suite = sub.add_parser("suite", help="time the scan-to-receipt hot path (default)")
+    suite.add_argument("--products", type=int, default=1000, help="catalog size to seed (1k-1M)")
+    suite.add_argument("--sales-history", type=int, default=10000, help="past sales rows to seed")
+    suite.add_argument("--iterations", type=int, default=200)
+    suite.add_argument("--baskets", default="1,10,40", help="comma-separated checkout basket sizes")
+    suite.add_argument("--baseline", help="earlier JSON result to compare against")
+    commit = sub.add_parser("commit", help="per-sale commit latency, stock SQLite vs tuned")
+    commit.add_argument("--sales", type=int, default=500, help="sales to time per profile")
+    commit.add_argument("--products", type=int, default=1000, help="catalog size to seed")
+    for p in (suite, commit):
+        p.add_argument("--workdir", default=None, help="directory for scratch databases")
+        p.add_argument("--output", help="also write the JSON result to this file")
+    args = parser.parse_args(argv)
+
+    if args.command == "commit":
+        result = {"commit_latency": bench_commit_latency(args.sales, args.products, args.workdir)}
+    else:
+        if args.command is None:
+            args = suite.parse_args([])
+        baskets = tuple(int(size) for size in args.baskets.split(","))
+        result = bench_suite(args.products, args.sales_history, args.iterations, baskets, args.workdir)
+
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    if getattr(args, "baseline", None):
+        with open(args.baseline) as f:
+            for line in compare(result, json.load(f)) or ["No changes beyond 10%"]:
+                print(line)
+
+
+if __name__ == "__main__":
+    main()
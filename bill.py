@@ -0,0 +1,140 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+
+def to_paisa(amount):
+    # Money is held as integer paisa so running totals never drift
+    return int((Decimal(str(amount)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def format_money(paisa):
+    return f"{Decimal(paisa) / 100:.2f}"
+
+
+def line_total(price, quantity, discount=0):
+    # What a sales row charged (price and discount in rupees); undiscounted lines stay
+    # exactly price * quantity
+    return round(price * quantity - discount, 2) if discount else price * quantity
+
+
+def discount_summary(lines):
+    # [(promotion name, amount)] saved on BillLine values, per promotion (Receipt.discounts)
+    totals = {}
+    for line in lines:
+        if line.discount:
+            totals[line.promotion.name] = totals.get(line.promotion.name, 0) + line.discount
+    return [(name, paisa / 100) for name, paisa in totals.items()]
+
+
+class BillLine:
+    __slots__ = ("product_id", "name", "barcode", "unit_price", "quantity", "category", "discount", "promotion")
+
+    def __init__(self, product_id, name, barcode, unit_price, quantity, category=None):
+        self.product_id = product_id
+        self.name = name
+        self.barcode = barcode
+        self.unit_price = unit_price  # paisa
+        self.quantity = quantity
+        self.category = category
+        # Set by promotions.BasketPricer: paisa off this line and the promotions.Rule giving it
+        self.discount = 0
+        self.promotion = None
+
+    @property
+    def total(self):
+        # Before discount
+        return self.unit_price * self.quantity
+
+
+class Bill:
+    # The cart: lines in display order plus a product id -> row index, and a running
+    # total kept up to date on every change, so add/edit/remove never scan the bill.
+    # pricer: promotions.BasketPricer applying discounts as lines change; after each change
+    # `repriced` lists the other rows whose discount it moved.
+    def __init__(self, pricer=None):
+        self.lines = []
+        self.rows = {}
+        self.subtotal = 0
+        self.pricer = pricer
+        self.repriced = []
+
+    def __len__(self):
+        return len(self.lines)
+
+    @property
+    def discount(self):
+        return self.pricer.discount if self.pricer else 0
+
+    @property
+    def total(self):
+        return self.subtotal - self.discount
+
+    def line(self, row):
+        return self.lines[row]
+
+    def row_of(self, product_id):
+        return self.rows.get(product_id)
+
+    def quantity_of(self, product_id):
+        row = self.rows.get(product_id)
+        return self.lines[row].quantity if row is not None else 0
+
+    def add(self, product_id, name, price, quantity, barcode=None, category=None):
+        # Returns (row, created): adding a product already on the bill raises its quantity
+        row = self.rows.get(product_id)
+        if row is not None:
+            self.set_quantity(row, self.lines[row].quantity + quantity)
+            return row, False
+        line = BillLine(product_id, name, barcode, to_paisa(price), quantity, category)
+        self.rows[product_id] = len(self.lines)
+        self.lines.append(line)
+        self.subtotal += line.total
+        self._repriced(self.pricer.update(line) if self.pricer else ())
+        return len(self.lines) - 1, True
+
+    def set_quantity(self, row, quantity):
+        line = self.lines[row]
+        self.subtotal += line.unit_price * (quantity - line.quantity)
+        line.quantity = quantity
+        self._repriced(self.pricer.update(line) if self.pricer else ())
+
+    def remove(self, row):
+        # Lines after `row` shift up one so the cart and receipt keep scan order;
+        # only their index entries are rewritten, the total is still adjusted in O(1)
+        line = self.lines.pop(row)
+        self.subtotal -= line.total
+        del self.rows[line.product_id]
+        for index in range(row, len(self.lines)):
+            self.rows[self.lines[index].product_id] = index
+        self._repriced(self.pricer.remove(line) if self.pricer else ())
+
+    def reprice(self, index=None):
+        # Re-prices the bill if the promotions changed (index: the current
+        # promotions.PromotionIndex) or one started or ended since the last change.
+        # True when any discount moved; `repriced` lists the rows.
+        if not self.pricer:
+            return False
+        if index is not None:
+            self.pricer.set_index(index)
+        self._repriced(self.pricer.refresh())
+        return bool(self.repriced)
+
+    def _repriced(self, lines):
+        self.repriced = [self.rows[line.product_id] for line in lines if line.product_id in self.rows]
+
+    def clear(self):
+        self.lines = []
+        self.rows = {}
+        self.subtotal = 0
+        self.repriced = []
+        if self.pricer:
+            self.pricer.clear()
+
+    def checkout_lines(self):
+        # In the (name, barcode, quantity) shape SaleManager.checkout takes
+        return [(line.name, None, line.quantity) for line in self.lines]
+
+    def receipt_rows(self):
+        return [(line.name, line.quantity, line.unit_price / 100, line.total / 100) for line in self.lines]
+
+    def receipt_discounts(self):
+        return discount_summary(self.lines)
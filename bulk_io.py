@@ -0,0 +1,176 @@
+import csv
+import json
+import os
+import sqlite3
+from itertools import islice
+
+FIELDS = ("name", "price", "stock", "barcode", "category")
+
+# A missing or empty category keeps the product's current one
+UPSERT_SQL = {
+    "name": """
+        INSERT INTO products (name, price, stock, barcode, category) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(name) DO UPDATE SET
+            price = excluded.price, stock = excluded.stock,
+            barcode = COALESCE(excluded.barcode, products.barcode),
+            category = COALESCE(excluded.category, products.category)
+    """,
+    "barcode": """
+        INSERT INTO products (name, price, stock, barcode, category) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(barcode) DO UPDATE SET
+            name = excluded.name, price = excluded.price, stock = excluded.stock,
+            category = COALESCE(excluded.category, products.category)
+    """,
+}
+
+
+class ImportReport:
+    def __init__(self):
+        self.processed = 0
+        self.imported = 0
+        self.errors = []  # (line number, message)
+
+    def __str__(self):
+        return f" Imported {self.imported} of {self.processed} rows ({len(self.errors)} errors)"
+
+
+def read_csv(path):
+    # Yields (line number, record dict); the header row names the columns
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        for record in reader:
+            yield reader.line_num, record
+
+
+def read_jsonl(path):
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            if line.strip():
+                try:
+                    yield line_no, json.loads(line)
+                except json.JSONDecodeError as e:
+                    yield line_no, e
+
+
+def _clean(record):
+    if isinstance(record, Exception):
+        raise ValueError(f"Invalid JSON: {record}")
+    name = str(record.get("name") or "").strip()
+    if not name:
+        raise ValueError("Missing product name")
+    try:
+        price = float(record.get("price"))
+        stock = int(record.get("stock") or 0)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid price/stock for '{name}'")
+    if price < 0 or stock < 0:
+        raise ValueError(f"Negative price/stock for '{name}'")
+    # Empty barcodes are stored as NULL so they don't collide on the UNIQUE index
+    barcode = str(record.get("barcode") or "").strip() or None
+    category = str(record.get("category") or "").strip() or None
+    return name, price, stock, barcode, category
+
+
+def import_products(inv, records, key="name", chunk_size=5000, progress=None):
+    # records: iterable of (line number, record dict). Each chunk is upserted with one
+    # executemany in its own transaction, so memory stays bounded by chunk_size and a
+    # bad chunk only costs a row-by-row retry of that chunk.
+    if key not in UPSERT_SQL:
+        raise ValueError(f"Products can be matched by name or barcode, not {key!r}")
+    sql = UPSERT_SQL[key]
+    report = ImportReport()
+    records = iter(records)
+    cursor = inv.conn.cursor()
+
+    suspended = False
+    try:
+        with inv.ledger.capture_adjustments("import"):
+            while True:
+                chunk = list(islice(records, chunk_size))
+                if not chunk:
+                    break
+                if report.processed and not suspended:
+                    # More than one chunk: rebuild the search index once at the end instead
+                    inv.search.suspend_sync()
+                    suspended = True
+                _import_chunk(inv, cursor, sql, key, chunk, report)
+                if progress:
+                    progress(report.processed)
+    finally:
+        if suspended:
+            inv.search.resume_sync()
+    return report
+
+
+def _import_chunk(inv, cursor, sql, key, chunk, report):
+    rows = []
+    line_numbers = []
+    for line_no, record in chunk:
+        report.processed += 1
+        try:
+            row = _clean(record)
+        except ValueError as e:
+            report.errors.append((line_no, str(e)))
+            continue
+        if key == "barcode" and row[3] is None:
+            report.errors.append((line_no, f"Missing barcode for '{row[0]}'"))
+            continue
+        rows.append(row)
+        line_numbers.append(line_no)
+
+    try:
+        cursor.executemany(sql, rows)
+        inv.conn.commit()
+        report.imported += len(rows)
+    except sqlite3.Error:
+        inv.conn.rollback()
+        for line_no, row in zip(line_numbers, rows):
+            try:
+                cursor.execute(sql, row)
+                report.imported += 1
+            except sqlite3.Error as e:
+                report.errors.append((line_no, f"{row[0]}: {e}"))
+        inv.conn.commit()
+
+
+def import_file(inv, path, key="name", chunk_size=5000, progress=None):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".csv":
+        records = read_csv(path)
+    elif ext in (".jsonl", ".json", ".ndjson"):
+        records = read_jsonl(path)
+    else:
+        raise ValueError(f"Unsupported import format: {ext}")
+    return import_products(inv, records, key, chunk_size, progress)
+
+
+def iter_products(conn, batch=1000):
+    # Streams (name, price, stock, barcode, category) without materialising the table
+    cursor = conn.execute(
+        "SELECT name, price, stock, COALESCE(barcode, ''), COALESCE(category, '') FROM products ORDER BY id"
+    )
+    while True:
+        rows = cursor.fetchmany(batch)
+        if not rows:
+            return
+        yield from rows
+
+
+def export_products(inv, path, progress=None, batch=1000):
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in (".csv", ".jsonl", ".json", ".ndjson"):
+        raise ValueError(f"Unsupported export format: {ext}")
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f) if ext == ".csv" else None
+        if writer:
+            writer.writerow(FIELDS)
+        for row in iter_products(inv.db.reader(), batch):
+            if writer:
+                writer.writerow(row)
+            else:
+                f.write(json.dumps(dict(zip(FIELDS, row))) + "\n")
+            count += 1
+            if progress and count % batch == 0:
+                progress(count)
+    return count
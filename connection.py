@@ -0,0 +1,69 @@
+import sqlite3
+import threading
+
+SYNCHRONOUS_MODES = ("OFF", "NORMAL", "FULL", "EXTRA")
+
+
+class ConnectionManager:
+    # One tuned writer connection plus a lazily opened read-only connection per thread.
+    # In WAL mode readers see the last committed state and never block the writer, so
+    # long report queries don't stall checkout.
+    def __init__(self, db_name="shop.db", journal_mode="WAL", synchronous="NORMAL",
+                 cache_size=-16000, mmap_size=64 * 1024 * 1024, busy_timeout=5000,
+                 cached_statements=256, factory=sqlite3.Connection):
+        synchronous = synchronous.upper()
+        if synchronous not in SYNCHRONOUS_MODES:
+            raise ValueError(f"synchronous must be one of {SYNCHRONOUS_MODES}, got {synchronous!r}")
+        self.db_name = db_name
+        self.synchronous = synchronous
+        self.cache_size = int(cache_size)
+        self.mmap_size = int(mmap_size)
+        self.busy_timeout = int(busy_timeout)
+        self.cached_statements = int(cached_statements)
+        # factory: sqlite3.Connection subclass, e.g. instrumentation's timing connection
+        self.factory = factory
+
+        # Serialises writers that share `conn` across threads
+        self.write_lock = threading.RLock()
+        self._local = threading.local()
+        self._readers = []
+        self._readers_lock = threading.Lock()
+
+        self.conn = self._connect()
+        self.journal_mode = self.conn.execute(f"PRAGMA journal_mode={journal_mode}").fetchone()[0]
+
+    def _connect(self):
+        # cached_statements: sqlite3 keeps this many compiled statements per connection,
+        # so the hot INSERT/UPDATE/SELECT strings are prepared once and reused.
+        conn = sqlite3.connect(
+            self.db_name,
+            timeout=self.busy_timeout / 1000,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+            factory=self.factory
+        )
+        conn.execute(f"PRAGMA busy_timeout={self.busy_timeout}")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute(f"PRAGMA cache_size={self.cache_size}")
+        conn.execute(f"PRAGMA mmap_size={self.mmap_size}")
+        return conn
+
+    def reader(self):
+        # In-memory databases are private to one connection, so they read through the writer
+        if self.db_name == ":memory:":
+            return self.conn
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            conn.execute("PRAGMA query_only=ON")
+            self._local.conn = conn
+            with self._readers_lock:
+                self._readers.append(conn)
+        return conn
+
+    def close(self):
+        with self._readers_lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers.clear()
+        self.conn.close()
@@ -1,7 +1,15 @@
 import sqlite3
+import threading
 from abc import ABC, abstractmethod
-import os
 from datetime import datetime
+from receipts import ReceiptSpooler, Receipt
+from search import ProductSearch
+from connection import ConnectionManager
+from journal import JournalError
+from ledger import StockLedger, MOVEMENT_SQL, ADJUSTMENT_BY_NAME_SQL
+from promotions import Promotions, BasketPricer
+from bill import BillLine, to_paisa, line_total, discount_summary
+import migrations
 
 class Product(ABC):
     @abstractmethod
@@ -18,33 +26,19 @@ class ConcreteProduct(Product):
 
 
 class Inventory:
-    def __init__(self, db_name="shop.db"):
-        self.conn = sqlite3.connect(db_name)
+    def __init__(self, db_name="shop.db", backfill=True, **settings):
+        # backfill=False: the caller runs migrations.run_backfills() itself, e.g. in the background
+        # settings: ConnectionManager tuning (synchronous, cache_size, mmap_size, busy_timeout, ...)
+        self.db = ConnectionManager(db_name, **settings)
+        self.conn = self.db.conn
         self.cursor = self.conn.cursor()
 
-        self.cursor.execute("""
-        CREATE TABLE IF NOT EXISTS products(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT UNIQUE,
-            price REAL,
-            stock INTEGER,
-            barcode TEXT UNIQUE
-        )
-        """)
-
-        self.cursor.execute("""
-        CREATE TABLE IF NOT EXISTS sales(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            product_name TEXT,
-            quantity INTEGER,
-            price REAL,
-            total REAL,
-            sale_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """)
-        
-
-        self.conn.commit()
+        # Schema upgrades (and, unless backfill=False, any batched backfills they schedule)
+        migrations.migrate(self.conn, backfill=backfill)
+        self.search = ProductSearch(self.conn, reader=self.db.reader)
+        self.reports = SalesReport(self.conn, reader=self.db.reader)
+        self.ledger = StockLedger(self.conn, reader=self.db.reader)
+        self.promotions = Promotions(self.conn, reader=self.db.reader)
 
     def add_product(self, product: Product):
         try:
@@ -57,15 +51,15 @@ class Inventory:
         except Exception as e:
             return f" Error adding product: {e}"
 
-    def search_product(self, name=None, barcode=None):
+    def search_product(self, name=None, barcode=None, limit=20):
         if barcode:
             self.cursor.execute("SELECT name, price, stock, barcode FROM products WHERE barcode=?", (barcode,))
+            rows = self.cursor.fetchall()
         elif name:
-            self.cursor.execute("SELECT name, price, stock, barcode FROM products WHERE name LIKE ?", (f"%{name}%",))
+            rows = self.search.search(name, limit)
         else:
             return " Must provide name or barcode!"
 
-        rows = self.cursor.fetchall()
         if not rows:
             return " Product not found!"
         report = "===== SEARCH RESULTS =====\n"
@@ -73,9 +67,24 @@ class Inventory:
             report += f"{row[0]:<15} | Price: Rs.{row[1]:<5} | Stock: {row[2]} | Barcode: {row[3]}\n"
         return report
     def get_all_products(self):
-     self.cursor.execute("SELECT name, price, stock, COALESCE(barcode, '') FROM products")
-     return self.cursor.fetchall()
+     return self.db.reader().execute("SELECT name, price, stock, COALESCE(barcode, '') FROM products").fetchall()
+
 
+    def get_products_page(self, limit=200, after=None):
+        # Keyset pagination by name (the UNIQUE index keeps every page an index range);
+        # returns (rows, next_cursor) with rows (id, name, price, stock, barcode)
+        if after is None:
+            rows = self.db.reader().execute(
+                "SELECT id, name, price, stock, COALESCE(barcode, '') FROM products ORDER BY name LIMIT ?",
+                (limit,)
+            ).fetchall()
+        else:
+            rows = self.db.reader().execute(
+                "SELECT id, name, price, stock, COALESCE(barcode, '') FROM products "
+                "WHERE name > ? ORDER BY name LIMIT ?",
+                (after, limit)
+            ).fetchall()
+        return rows, (rows[-1][1] if len(rows) == limit else None)
 
     def update_price(self, name, new_price):
         self.cursor.execute("UPDATE products SET price = ? WHERE name = ?", (new_price, name))
@@ -85,12 +94,37 @@ class Inventory:
         return f" Price of {name} updated to Rs.{new_price}"
 
     def update_stock(self, name, new_stock):
+        # An absolute count: the ledger records the difference as an adjustment
+        self.cursor.execute(ADJUSTMENT_BY_NAME_SQL, (new_stock, None, name, new_stock))
         self.cursor.execute("UPDATE products SET stock = ? WHERE name = ?", (new_stock, name))
         if self.cursor.rowcount == 0:
+            self.conn.rollback()
             return f" Product '{name}' not found!"
         self.conn.commit()
         return f" Stock of {name} updated to {new_stock}"
 
+    def restock(self, name, quantity, ref=None):
+        # Goods received: a relative increase, so it can't overwrite a concurrent sale
+        self.cursor.execute("UPDATE products SET stock = stock + ? WHERE name = ?", (quantity, name))
+        if self.cursor.rowcount == 0:
+            self.conn.rollback()
+            return f" Product '{name}' not found!"
+        # Same transaction, so this is the stock the update left
+        product_id, new_stock = self.cursor.execute(
+            "SELECT id, stock FROM products WHERE name = ?", (name,)
+        ).fetchone()
+        self.cursor.execute(MOVEMENT_SQL, (product_id, quantity, "restock", ref))
+        self.conn.commit()
+        return f" Restocked {quantity} x {name}. Stock: {new_stock}"
+
+    def set_category(self, name, category):
+        # Category promotions apply to the products in it; None takes a product out
+        self.cursor.execute("UPDATE products SET category = ? WHERE name = ?", (category or None, name))
+        if self.cursor.rowcount == 0:
+            return f" Product '{name}' not found!"
+        self.conn.commit()
+        return f" Category of {name} set to {category}" if category else f" Category of {name} cleared"
+
     def delete_product(self, name):
         self.cursor.execute("DELETE FROM products WHERE name=?", (name,))
         if self.cursor.rowcount == 0:
@@ -100,19 +134,238 @@ class Inventory:
    
 
     def close(self):
-        self.conn.close()
+        self.db.close()
+
+
+class SalesReport:
+    # Per-day and per-hour, per-product rollups of `sales`, maintained by triggers as sale
+    # rows are written, so reports read a few aggregate rows instead of the sales table.
+    # Days/hours are in the same (UTC) clock as sales.sale_time. Tables and triggers are
+    # created by migrations.sales_rollups.
+    def __init__(self, conn, reader=None):
+        # reader: callable returning the connection report queries run on
+        self.conn = conn
+        self.reader = reader or (lambda: conn)
+
+    def _day_range(self, start, end):
+        clauses = []
+        params = []
+        if start:
+            clauses.append("day >= ?")
+            params.append(str(start))
+        if end:
+            clauses.append("day <= ?")
+            params.append(str(end))
+        return (f"WHERE {' AND '.join(clauses)}" if clauses else ""), params
+
+    def top_products(self, n=10, start=None, end=None, by="quantity"):
+        # Best sellers between inclusive 'YYYY-MM-DD' dates: (product_name, quantity, revenue, sale_count)
+        if by not in ("quantity", "revenue"):
+            raise ValueError(f"Cannot rank products by {by!r}")
+        where, params = self._day_range(start, end)
+        return self.reader().execute(
+            f"SELECT product_name, SUM(quantity), SUM(revenue), SUM(sale_count) FROM sales_daily {where} "
+            f"GROUP BY product_name ORDER BY SUM({by}) DESC LIMIT ?",
+            params + [n]
+        ).fetchall()
+
+    def revenue_by_period(self, period="day", start=None, end=None):
+        # [(day or 'YYYY-MM-DD HH', revenue, quantity, sale_count)] in time order
+        if period == "day":
+            where, params = self._day_range(start, end)
+            table, bucket = "sales_daily", "day"
+        elif period == "hour":
+            clauses = []
+            params = []
+            if start:
+                clauses.append("hour >= ?")
+                params.append(str(start))
+            if end:
+                clauses.append("hour < date(?, '+1 day')")
+                params.append(str(end))
+            where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+            table, bucket = "sales_hourly", "hour"
+        else:
+            raise ValueError(f"Unknown report period {period!r}")
+        return self.reader().execute(
+            f"SELECT {bucket}, SUM(revenue), SUM(quantity), SUM(sale_count) FROM {table} {where} "
+            f"GROUP BY {bucket} ORDER BY {bucket}",
+            params
+        ).fetchall()
+
+    def slow_movers(self, n=10, start=None, end=None):
+        # Products that sold least (including not at all) in the range: (name, stock, quantity_sold)
+        where, params = self._day_range(start, end)
+        return self.reader().execute(
+            "SELECT p.name, p.stock, COALESCE(d.quantity, 0) FROM products p "
+            f"LEFT JOIN (SELECT product_name, SUM(quantity) AS quantity FROM sales_daily {where} "
+            "GROUP BY product_name) d ON d.product_name = p.name "
+            "ORDER BY COALESCE(d.quantity, 0), p.stock DESC LIMIT ?",
+            params + [n]
+        ).fetchall()
+
+
+class CatalogEntry:
+    __slots__ = ("id", "name", "price", "stock", "barcode", "category")
+
+    def __init__(self, id, name, price, stock, barcode, category=None):
+        self.id = id
+        self.name = name
+        self.price = price
+        self.stock = stock
+        self.barcode = barcode
+        self.category = category
+
+
+CATALOG_COLUMNS = "id, name, price, stock, barcode, category"
+
+
+class ProductCatalog:
+    # In-memory copy of `products` indexed by name and barcode so a scan needs no SQL.
+    # All writes must go through the catalog (or be followed by refresh/reload) to stay coherent.
+    def __init__(self, inventory, load=True):
+        self.inv = inventory
+        self.by_name = {}
+        self.by_barcode = {}
+        # owns_stock: set when sales go through a journal. products.stock then lags the
+        # journaled sales, so refresh() keeps the stock counted here instead of re-reading it
+        self.owns_stock = False
+        # load=False defers the full read (e.g. to a worker after the window is up); until
+        # reload() finishes, lookups fall back to one indexed query each
+        self.loaded = False
+        if load:
+            self.reload()
+
+    def reload(self):
+        by_name = {}
+        by_barcode = {}
+        for row in self.inv.conn.execute(f"SELECT {CATALOG_COLUMNS} FROM products"):
+            entry = CatalogEntry(*row)
+            by_name[entry.name] = entry
+            if entry.barcode:
+                by_barcode[entry.barcode] = entry
+        self.by_name = by_name
+        self.by_barcode = by_barcode
+        self.loaded = True
+
+    def __len__(self):
+        return len(self.by_name)
+
+    def lookup(self, code_or_name):
+        # Same precedence as the till: exact name first, then barcode
+        if not self.loaded:
+            return self._fetch("name", code_or_name) or self._fetch("barcode", code_or_name)
+        return self.by_name.get(code_or_name) or self.by_barcode.get(code_or_name)
+
+    def get(self, name=None, barcode=None):
+        if not self.loaded:
+            return self._fetch("barcode", barcode) if barcode else self._fetch("name", name)
+        if barcode:
+            return self.by_barcode.get(barcode)
+        return self.by_name.get(name)
+
+    def _fetch(self, column, value):
+        if value is None:
+            return None
+        row = self.inv.db.reader().execute(
+            f"SELECT {CATALOG_COLUMNS} FROM products WHERE {column}=?", (value,)
+        ).fetchone()
+        return CatalogEntry(*row) if row else None
+
+    def refresh(self, name, stock_delta=0):
+        # stock_delta: the change just written to products.stock, applied to the kept stock
+        old = self._drop(name)
+        row = self.inv.conn.execute(
+            f"SELECT {CATALOG_COLUMNS} FROM products WHERE name=?", (name,)
+        ).fetchone()
+        if row:
+            entry = CatalogEntry(*row)
+            if self.owns_stock and old is not None:
+                entry.stock = old.stock + stock_delta
+            self.by_name[entry.name] = entry
+            if entry.barcode:
+                self.by_barcode[entry.barcode] = entry
+
+    def _drop(self, name):
+        entry = self.by_name.pop(name, None)
+        if entry and entry.barcode and self.by_barcode.get(entry.barcode) is entry:
+            del self.by_barcode[entry.barcode]
+        return entry
+
+    def add_product(self, product: Product):
+        result = self.inv.add_product(product)
+        self.refresh(product.name)
+        return result
+
+    def update_price(self, name, new_price):
+        result = self.inv.update_price(name, new_price)
+        self.refresh(name)
+        return result
+
+    def update_stock(self, name, new_stock):
+        # An absolute count replaces the kept stock too: callers wait for the journal first
+        result = self.inv.update_stock(name, new_stock)
+        self._drop(name)
+        self.refresh(name)
+        return result
+
+    def restock(self, name, quantity, ref=None):
+        result = self.inv.restock(name, quantity, ref)
+        self.refresh(name, stock_delta=quantity)
+        return result
+
+    def set_category(self, name, category):
+        result = self.inv.set_category(name, category)
+        self.refresh(name)
+        return result
+
+    def delete_product(self, name):
+        result = self.inv.delete_product(name)
+        self._drop(name)
+        return result
+
+    def apply_sale(self, quantities):
+        # quantities: {product_name: quantity sold}, called after the sale is committed
+        for name, quantity in quantities.items():
+            entry = self.by_name.get(name)
+            if entry:
+                entry.stock -= quantity
+
+
+def _discount_of(line):
+    # (discount in rupees, promotion id) of a priced BillLine, or of none
+    if line is None or not line.discount:
+        return 0, None
+    return line.discount / 100, line.promotion.id
 
 
 class SaleManager:
-    def __init__(self, conn):
+    def __init__(self, conn, receipt_sink=None, catalog=None, reader=None, journal=None, promotions=None):
         self.conn = conn
         self.cursor = self.conn.cursor()
+        # reader: callable returning the connection history queries run on
+        self.reader = reader or (lambda: conn)
+        self.catalog = catalog
+        # journal: journal.SalesJournal. Sales are then recorded durably in the journal and
+        # written to the database behind the till; stock is checked against the catalog.
+        if journal and catalog is None:
+            raise ValueError("A sales journal needs the product catalog to check stock")
+        self.journal = journal
+        if journal:
+            catalog.owns_stock = True
+        self.journal_lock = threading.Lock()
+        # promotions: promotions.Promotions (Inventory.promotions); without it, no discounts
+        self.promotions = promotions
+        # Receipts are written/printed by a background worker once the sale is committed
+        self.spooler = ReceiptSpooler(receipt_sink)
 
     def make_sale(self, name=None, barcode=None, quantity=1):
+        if self.journal:
+            return self.checkout([(name, barcode, quantity)])[1]
         if barcode:
-            self.cursor.execute("SELECT name, stock, price FROM products WHERE barcode=?", (barcode,))
+            self.cursor.execute("SELECT id, name, stock, price, category FROM products WHERE barcode=?", (barcode,))
         elif name:
-            self.cursor.execute("SELECT name, stock, price FROM products WHERE name=?", (name,))
+            self.cursor.execute("SELECT id, name, stock, price, category FROM products WHERE name=?", (name,))
         else:
             return " Must provide product name or barcode!"
 
@@ -120,39 +373,234 @@ class SaleManager:
         if not row:
             return " Product not found!"
 
-        prod_name, stock, price = row
+        product_id, prod_name, stock, price, category = row
         if quantity > stock:
             return f" Not enough stock for {prod_name}! Available: {stock}"
+        line = self._price_lines({product_id: [prod_name, price, quantity, stock, category]}).get(product_id)
+        discount, promotion_id = _discount_of(line)
 
-        new_stock = stock - quantity
-        self.cursor.execute("UPDATE products SET stock=? WHERE name=?", (new_stock, prod_name))
+        # Relative and guarded: a sale committed since the SELECT can't be overwritten
+        self.cursor.execute(
+            "UPDATE products SET stock = stock - ? WHERE id = ? AND stock >= ?",
+            (quantity, product_id, quantity)
+        )
+        if self.cursor.rowcount == 0:
+            self.conn.rollback()
+            return f" Not enough stock for {prod_name}!"
+        new_stock = self.cursor.execute("SELECT stock FROM products WHERE id = ?", (product_id,)).fetchone()[0]
+        self.cursor.execute(MOVEMENT_SQL, (product_id, -quantity, "sale", None))
 
-        total = price * quantity
+        total = line_total(price, quantity, discount)
         self.cursor.execute(
-            "INSERT INTO sales (product_name, quantity, price, total) VALUES (?, ?, ?, ?)",
-            (prod_name, quantity, price, total)
+            "INSERT INTO sales (product_name, quantity, price, total, discount, promotion_id) VALUES (?, ?, ?, ?, ?, ?)",
+            (prod_name, quantity, price, total, discount, promotion_id)
         )
         self.conn.commit()
+        if self.catalog:
+            self.catalog.apply_sale({prod_name: quantity})
 
-        self.print_receipt(prod_name, quantity, price, total, new_stock)
+        self.print_receipt(prod_name, quantity, price, price * quantity, new_stock,
+                           discount_summary([line]) if line else ())
 
         return f" Sold {quantity} x {prod_name} = Rs.{total}\nRemaining stock: {new_stock}"
     
+    def checkout(self, lines):
+        # lines: iterable of (name, barcode, quantity); barcode wins when both are given.
+        # Every stock decrement and sales row of the basket is written in one transaction,
+        # so a basket is either recorded completely or not at all.
+        lines = [(name, barcode, quantity) for name, barcode, quantity in lines]
+        if not lines:
+            return None, " No items in bill!"
+        if self.journal:
+            return self._checkout_journaled(lines)
+
+        try:
+            if not self.conn.in_transaction:
+                self.cursor.execute("BEGIN IMMEDIATE")
+            by_barcode = self._fetch_products("barcode", {b for _, b, _ in lines if b})
+            by_name = self._fetch_products("name", {n for n, b, _ in lines if not b and n})
+
+            basket = {}
+            for name, barcode, quantity in lines:
+                row = by_barcode.get(barcode) if barcode else by_name.get(name)
+                if row is None:
+                    self.conn.rollback()
+                    return None, f" Product not found: {barcode or name}"
+                if not isinstance(quantity, int) or quantity <= 0:
+                    self.conn.rollback()
+                    return None, f" Invalid quantity for {row[1]}: {quantity}"
+                product_id, prod_name, stock, price, category = row
+                if product_id in basket:
+                    basket[product_id][2] += quantity
+                else:
+                    basket[product_id] = [prod_name, price, quantity, stock, category]
+
+            for prod_name, price, quantity, stock, _ in basket.values():
+                if quantity > stock:
+                    self.conn.rollback()
+                    return None, f" Not enough stock for {prod_name}! Available: {stock}"
+
+            lines = self._price_lines(basket)
+            rows = self._sale_rows(basket, lines)
+            bill_total = sum(row[3] for row in rows)
+            self.cursor.execute("INSERT INTO bills (total) VALUES (?)", (bill_total,))
+            bill_id = self.cursor.lastrowid
+
+            # Guarded relative decrements: if stock moved since it was read, a row is
+            # skipped and the whole bill is rolled back
+            self.cursor.executemany(
+                "UPDATE products SET stock = stock - ? WHERE id = ? AND stock >= ?",
+                [(quantity, product_id, quantity) for product_id, (_, _, quantity, _, _) in basket.items()]
+            )
+            if self.cursor.rowcount != len(basket):
+                self.conn.rollback()
+                return None, " Stock changed during checkout, please retry"
+            self.cursor.executemany(
+                MOVEMENT_SQL,
+                [(product_id, -quantity, "sale", bill_id) for product_id, (_, _, quantity, _, _) in basket.items()]
+            )
+            self.cursor.executemany(
+                "INSERT INTO sales (product_name, quantity, price, total, discount, promotion_id, bill_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(*row, bill_id) for row in rows]
+            )
+            self.conn.commit()
+        except sqlite3.Error as e:
+            self.conn.rollback()
+            return None, f" Error completing sale: {e}"
+
+        if self.catalog:
+            self.catalog.apply_sale({prod_name: quantity for prod_name, _, quantity, _, _ in basket.values()})
+        self._submit_receipt(basket, lines, bill_id)
+        return bill_id, f" Bill #{bill_id}: {len(basket)} item(s) sold = Rs.{bill_total}"
+
+    def _checkout_journaled(self, lines):
+        # Same checks as checkout, against the catalog; the sale is done once it is in the journal
+        with self.journal_lock:
+            basket = {}
+            for name, barcode, quantity in lines:
+                entry = self.catalog.get(name=name, barcode=barcode)
+                if entry is None:
+                    return None, f" Product not found: {barcode or name}"
+                if not isinstance(quantity, int) or quantity <= 0:
+                    return None, f" Invalid quantity for {entry.name}: {quantity}"
+                if entry.id in basket:
+                    basket[entry.id][2] += quantity
+                else:
+                    basket[entry.id] = [entry.name, entry.price, quantity, entry.stock, entry.category]
+
+            for prod_name, price, quantity, stock, _ in basket.values():
+                if quantity > stock:
+                    return None, f" Not enough stock for {prod_name}! Available: {stock}"
+
+            lines = self._price_lines(basket)
+            rows = self._sale_rows(basket, lines)
+            bill_total = sum(row[3] for row in rows)
+            try:
+                seq, bill_id = self.journal.append(
+                    bill_total,
+                    [(product_id, prod_name, quantity, price, discount, promotion_id)
+                     for product_id, (prod_name, quantity, price, _, discount, promotion_id) in zip(basket, rows)]
+                )
+            except JournalError as e:
+                return None, f" Error completing sale: {e}"
+            self.catalog.apply_sale({prod_name: quantity for prod_name, _, quantity, _, _ in basket.values()})
+
+        # Outside the lock, so other tills' bills join the same fsync
+        try:
+            self.journal.wait_durable(seq)
+        except JournalError as e:
+            return None, f" Error completing sale: {e}"
+
+        self._submit_receipt(basket, lines, bill_id)
+        return bill_id, f" Bill #{bill_id}: {len(basket)} item(s) sold = Rs.{bill_total}"
+
+    def _price_lines(self, basket):
+        # basket: {product_id: [name, price, quantity, stock, category]}. Returns
+        # {product_id: BillLine} with the promotion discount each line gets now ({} when no
+        # promotion runs)
+        if self.promotions is None:
+            return {}
+        index = self.promotions.index()
+        if not index:
+            return {}
+        lines = {product_id: BillLine(product_id, name, None, to_paisa(price), quantity, category)
+                 for product_id, (name, price, quantity, _, category) in basket.items()}
+        BasketPricer(index).reprice(lines.values())
+        return lines
+
+    def _sale_rows(self, basket, lines):
+        # (product_name, quantity, price, total, discount, promotion_id) per basket line
+        rows = []
+        for product_id, (prod_name, price, quantity, _, _) in basket.items():
+            discount, promotion_id = _discount_of(lines.get(product_id))
+            rows.append((prod_name, quantity, price, line_total(price, quantity, discount), discount, promotion_id))
+        return rows
+
+    def _submit_receipt(self, basket, lines, bill_id):
+        self.spooler.submit(Receipt(
+            [(prod_name, quantity, price, price * quantity) for prod_name, price, quantity, _, _ in basket.values()],
+            bill_id, datetime.now(), discount_summary(lines.values())
+        ))
+
+    def _fetch_products(self, column, keys):
+        # Chunked IN (...) lookup keyed by `column`, kept under SQLite's bound-parameter limit
+        keys = list(keys)
+        rows = {}
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            marks = ", ".join("?" * len(chunk))
+            self.cursor.execute(
+                f"SELECT {column}, id, name, stock, price, category FROM products WHERE {column} IN ({marks})",
+                chunk
+            )
+            for row in self.cursor.fetchall():
+                rows[row[0]] = row[1:]
+        return rows
+
     def get_all_sales(self):
-     self.cursor.execute("SELECT sale_time, product_name, quantity, total FROM sales ORDER BY sale_time DESC")
-     return self.cursor.fetchall()
+     return self.reader().execute(
+         "SELECT sale_time, product_name, quantity, total FROM sales ORDER BY sale_time DESC"
+     ).fetchall()
     
-    def print_receipt(self, product_name, quantity, price, total, remaining_stock):
-        receipt = f"=== K&B MART ===\n"
-        receipt+= f"User:Admin\n"
-        receipt += f"{datetime.now()}\n"
-        receipt += f"Item         Qty          Price    Total: \n"
-        receipt += f"{product_name}  {quantity}  {price}   {total}\n"
+    def get_sales_page(self, limit=100, after=None, start=None, end=None, product=None):
+        # Keyset pagination, newest first. `after` is the cursor returned with the previous
+        # page; start/end are inclusive 'YYYY-MM-DD' dates. Returns (rows, next_cursor) where
+        # rows are (id, sale_time, product_name, quantity, total) and next_cursor is None
+        # on the last page.
+        clauses = []
+        params = []
+        if start:
+            clauses.append("sale_time >= ?")
+            params.append(str(start))
+        if end:
+            clauses.append("sale_time < date(?, '+1 day')")
+            params.append(str(end))
+        if product:
+            clauses.append("product_name = ?")
+            params.append(product)
+        if after:
+            clauses.append("(sale_time, id) < (?, ?)")
+            params.extend(after)
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self.reader().execute(
+            f"SELECT id, sale_time, product_name, quantity, total FROM sales {where} "
+            "ORDER BY sale_time DESC, id DESC LIMIT ?",
+            params + [limit]
+        ).fetchall()
+        next_cursor = (rows[-1][1], rows[-1][0]) if len(rows) == limit else None
+        return rows, next_cursor
 
-        receipt += "Thank you for shopping!\n"
+    def print_receipt(self, product_name, quantity, price, total, remaining_stock, discounts=()):
+        self.spooler.submit(Receipt([(product_name, quantity, price, total)], None, datetime.now(), discounts))
 
-        filename = "receipt.txt"
-        with open(filename, "w") as f:
-            f.write(receipt)
-        os.startfile(filename, "print") 
+    def flush_receipts(self):
+        self.spooler.flush()
 
+    def wait_recorded(self, timeout=None):
+        # Blocks until journaled sales are in the database, e.g. before stock is overwritten
+        return self.journal.wait_applied(timeout) if self.journal else True
+
+    def close(self):
+        self.spooler.close()
@@ -0,0 +1,186 @@
+import math
+import os
+import time
+
+import numpy as np
+
+# Reorder suggestions from sales velocity. Sales are read once, by id, as column arrays
+# and folded into a products x days demand matrix that is saved between runs, so the
+# nightly run only reads the sales written since the last one. Everything after that is
+# whole-catalog array arithmetic, no per-product queries.
+#
+# Sales deleted or re-dated after they were folded in are not seen until a full rebuild
+# (DemandHistory(...).update(conn) on a fresh history, `python -m pos reorder --full`).
+
+SECONDS_PER_DAY = 86400
+
+# (name, stock, daily demand, days of cover, reorder point, suggested order)
+COLUMNS = ("name", "stock", "daily_demand", "days_of_cover", "reorder_point", "order_qty")
+
+
+def epoch_day(date=None):
+    # Days since 1970-01-01 of a 'YYYY-MM-DD' date (UTC, like sale_time), default today
+    if date is None:
+        return int(time.time()) // SECONDS_PER_DAY
+    return int(np.datetime64(str(date)[:10], "D").astype(np.int64))
+
+
+class DemandHistory:
+    # Units sold per product per day for the `days` days ending at end_day (inclusive).
+    # Rows are product names, as sales record them.
+    def __init__(self, days=56, end_day=None):
+        self.days = days
+        self.end_day = epoch_day() if end_day is None else end_day
+        self.names = []
+        self.rows = {}
+        self.demand = np.zeros((0, days), dtype=np.float32)
+        self.last_sale_id = 0
+        # Sales read so far were counted up to read_day; ahead_id is the first of them dated
+        # after it (0: none), where the next update has to start reading again
+        self.read_day = self.end_day
+        self.ahead_id = 0
+
+    @classmethod
+    def load(cls, path, days=56, end_day=None):
+        # A fresh history when there is no saved one, or it doesn't fit the request
+        history = cls(days, end_day)
+        if not path or not os.path.exists(path):
+            return history
+        with np.load(path, allow_pickle=False) as saved:
+            if int(saved["days"]) != days or int(saved["end_day"]) > history.end_day:
+                return history
+            history.names = saved["names"].tolist()
+            history.demand = saved["demand"]
+            history.end_day = int(saved["end_day"])
+            history.last_sale_id = int(saved["last_sale_id"])
+            history.read_day = int(saved["read_day"])
+            history.ahead_id = int(saved["ahead_id"])
+        history.rows = {name: row for row, name in enumerate(history.names)}
+        return history
+
+    def save(self, path):
+        # Written next to the target and swapped in, so a crash leaves the old state
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, days=self.days, end_day=self.end_day, last_sale_id=self.last_sale_id,
+                     read_day=self.read_day, ahead_id=self.ahead_id,
+                     names=np.array(self.names, dtype=str), demand=self.demand)
+        os.replace(tmp, path)
+
+    def advance(self, end_day):
+        # Moves the window forward; days that fall off the front are dropped
+        shift = end_day - self.end_day
+        if shift <= 0:
+            return
+        if shift >= self.days:
+            self.demand[:] = 0
+        else:
+            self.demand[:, :-shift] = self.demand[:, shift:]
+            self.demand[:, -shift:] = 0
+        self.end_day = end_day
+
+    def _rows_for(self, names):
+        # Matrix row of every name, adding rows for products not seen before
+        unique, inverse = np.unique(names, return_inverse=True)
+        new = [name for name in unique.tolist() if name not in self.rows]
+        if new:
+            for name in new:
+                self.rows[name] = len(self.names)
+                self.names.append(name)
+            self.demand = np.vstack([self.demand, np.zeros((len(new), self.days), dtype=np.float32)])
+        return np.array([self.rows[name] for name in unique.tolist()], dtype=np.int64)[inverse]
+
+    def update(self, conn, chunk_size=100000):
+        # Folds in sales with id > last_sale_id. Returns the number of sales read.
+        if conn.execute("SELECT COALESCE(MAX(id), 0) FROM sales").fetchone()[0] < self.last_sale_id:
+            raise ValueError("Sales history is older than the saved forecast state; rebuild it")
+        first_day = self.end_day - self.days + 1
+        read_before, read_day = self.last_sale_id, self.read_day
+        columns = "SELECT id, COALESCE(product_name, ''), CAST(strftime('%s', sale_time) AS INTEGER) / ?, quantity FROM sales"
+        start = (self.ahead_id - 1) if self.ahead_id else self.last_sale_id
+        if start:
+            cursor = conn.execute(f"{columns} WHERE id > ? ORDER BY id", (SECONDS_PER_DAY, start))
+        else:
+            # First build: only the window's days matter, and the sale_time index finds them
+            # (+id keeps the planner off a whole-table rowid range; no ORDER BY, so no sort)
+            upto = conn.execute("SELECT COALESCE(MAX(id), 0) FROM sales").fetchone()[0]
+            cursor = conn.execute(
+                f"{columns} WHERE sale_time >= ? AND +id <= ?",
+                (SECONDS_PER_DAY, str(np.datetime64(first_day, "D")), upto)
+            )
+            self.last_sale_id = upto
+        self.ahead_id = 0
+        count = 0
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                self.read_day = self.end_day
+                return count
+            ids, names, days, quantities = zip(*rows)
+            ids = np.array(ids, dtype=np.int64)
+            days = np.array(days, dtype=np.float64)
+            quantities = np.array(quantities, dtype=np.float64)
+            # Dated after end_day (a backdated run, or a till clock ahead): left for later runs
+            ahead = days > self.end_day
+            if ahead.any():
+                first_ahead = int(ids[ahead].min())
+                self.ahead_id = min(self.ahead_id, first_ahead) if self.ahead_id else first_ahead
+            # Re-read sales were already counted if they were dated up to the last read_day
+            keep = (days >= first_day) & ~ahead & ~np.isnan(quantities) & ((ids > read_before) | (days > read_day))
+            if keep.any():
+                columns = (days[keep] - first_day).astype(np.int64)
+                rows_idx = self._rows_for(np.array(names, dtype=str)[keep])
+                np.add.at(self.demand, (rows_idx, columns), quantities[keep])
+            self.last_sale_id = max(self.last_sale_id, int(ids.max()))
+            count += len(rows)
+
+
+def reorder_suggestions(conn, history, window=28, lead_time=3, review_days=7, service_z=1.65,
+                        all_products=False):
+    # One row per product (COLUMNS), most urgent first. Demand is the moving average of the
+    # last `window` days (days without sales count as zero). A product is due when its
+    # stock is at or below the reorder point (lead-time demand plus safety stock); the
+    # suggestion tops it up to cover lead time plus the review period.
+    # all_products=False returns only the products that are due.
+    window = min(window, history.days)
+    products = conn.execute("SELECT name, COALESCE(stock, 0) FROM products").fetchall()
+    if not products:
+        return []
+    names = [name for name, _ in products]
+    stock = np.array([stock for _, stock in products], dtype=np.float64)
+
+    recent = history.demand[:, -window:].astype(np.float64)
+    # Extra zero row for products that have never sold
+    mean = np.append(recent.mean(axis=1), 0.0)
+    std = np.append(recent.std(axis=1), 0.0)
+    rows = np.array([history.rows.get(name, -1) for name in names], dtype=np.int64)
+    daily = mean[rows]
+    safety = service_z * std[rows] * math.sqrt(lead_time)
+
+    cover = np.full(len(names), np.inf)
+    np.divide(stock, daily, out=cover, where=daily > 0)
+    reorder_point = daily * lead_time + safety
+    target = daily * (lead_time + review_days) + safety
+    order = np.where((stock <= reorder_point) & (daily > 0), np.ceil(target - stock), 0).clip(min=0)
+
+    picked = np.arange(len(names)) if all_products else np.flatnonzero(order > 0)
+    # Fewest days of cover first, then the bigger orders, then by name
+    picked = picked[np.lexsort((np.array(names, dtype=str)[picked], -order[picked], cover[picked]))]
+    return [
+        (names[i], int(stock[i]), round(float(daily[i]), 2),
+         None if math.isinf(cover[i]) else round(float(cover[i]), 1),
+         round(float(reorder_point[i]), 1), int(order[i]))
+        for i in picked.tolist()
+    ]
+
+
+def plan(conn, state_path=None, full=False, days=56, as_of=None, **params):
+    # Loads the saved demand history (unless full), folds in new sales, saves it and
+    # returns (suggestions, sales read). params: see reorder_suggestions.
+    end_day = epoch_day(as_of)
+    history = DemandHistory(days, end_day) if full else DemandHistory.load(state_path, days, end_day)
+    history.advance(end_day)
+    read = history.update(conn)
+    if state_path:
+        history.save(state_path)
+    return reorder_suggestions(conn, history, **params), read
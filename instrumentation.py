@@ -0,0 +1,217 @@
+import bisect
+import functools
+import inspect
+import json
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in milliseconds; the last bucket is open-ended
+BUCKETS_MS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+class OpStats:
+    __slots__ = ("category", "count", "total_ms", "max_ms", "buckets")
+
+    def __init__(self, category):
+        self.category = category
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def as_dict(self):
+        return {
+            "category": self.category,
+            "count": self.count,
+            "mean_ms": round(self.total_ms / self.count, 4) if self.count else 0.0,
+            "max_ms": round(self.max_ms, 4),
+            "histogram_ms": {
+                **{f"<={bound}": n for bound, n in zip(BUCKETS_MS, self.buckets)},
+                f">{BUCKETS_MS[-1]}": self.buckets[-1],
+            },
+        }
+
+
+class Recorder:
+    # Per-operation timings: the most recent `capacity` samples in a ring buffer, running
+    # counts/histograms per operation, and a JSON-lines log of anything slower than
+    # slow_ms. Recording costs a lock and a deque append, so it stays on in production.
+    def __init__(self, capacity=10000, slow_ms=100, slow_log="slow_ops.log"):
+        self.recent = deque(maxlen=capacity)
+        self.ops = {}
+        self.slow_ms = slow_ms
+        self.slow_log = slow_log
+        self.lock = threading.Lock()
+        self.started = time.time()
+
+    def record(self, category, name, duration_ms, detail=None):
+        now = time.time()
+        with self.lock:
+            self.recent.append((now, category, name, duration_ms))
+            stats = self.ops.get(name)
+            if stats is None:
+                stats = self.ops[name] = OpStats(category)
+            stats.count += 1
+            stats.total_ms += duration_ms
+            if duration_ms > stats.max_ms:
+                stats.max_ms = duration_ms
+            stats.buckets[bisect.bisect_left(BUCKETS_MS, duration_ms)] += 1
+        if self.slow_log and duration_ms >= self.slow_ms:
+            self._log_slow(now, category, name, duration_ms, detail)
+
+    def _log_slow(self, when, category, name, duration_ms, detail):
+        entry = {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(when)),
+            "category": category,
+            "op": name,
+            "ms": round(duration_ms, 3),
+            "thread": threading.current_thread().name,
+        }
+        if detail:
+            entry["detail"] = detail
+        try:
+            with open(self.slow_log, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+        except OSError as e:
+            print(f"Error writing slow-operation log: {e}")
+
+    @contextmanager
+    def timed(self, category, name, detail=None):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(category, name, (time.perf_counter() - started) * 1000, detail)
+
+    def wrap(self, fn, category, name, slot=False):
+        # slot=True: drop surplus positional arguments the way PyQt does when it calls a
+        # slot (e.g. clicked(bool) into a handler that takes none), since the wrapper's
+        # *args hides the real signature from PyQt
+        arity = None
+        if slot:
+            params = inspect.signature(fn).parameters.values()
+            if not any(p.kind == p.VAR_POSITIONAL for p in params):
+                arity = sum(p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD) for p in params)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if arity is not None:
+                args = args[:arity]
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.record(category, name, (time.perf_counter() - started) * 1000)
+        wrapper.__instrumented__ = True
+        return wrapper
+
+    def instrument(self, target, methods, category, slots=False):
+        # target: an instance (wraps just that object) or a class (wraps it for every
+        # instance, which is what Qt slots connected in __init__ need)
+        owner = target.__name__ if isinstance(target, type) else type(target).__name__
+        for method in methods:
+            fn = getattr(target, method)
+            if getattr(fn, "__instrumented__", False):
+                continue
+            setattr(target, method, self.wrap(fn, category, f"{owner}.{method}", slots))
+        return target
+
+    def snapshot(self, recent=100):
+        with self.lock:
+            ops = {name: stats.as_dict() for name, stats in self.ops.items()}
+            latest = list(self.recent)[-recent:]
+        return {
+            "uptime_s": round(time.time() - self.started, 1),
+            "slow_ms": self.slow_ms,
+            "ops": ops,
+            "recent": [
+                {"time": round(when, 3), "category": category, "op": name, "ms": round(ms, 3)}
+                for when, category, name, ms in latest
+            ],
+        }
+
+    def dump(self, path="pos_stats.json"):
+        with open(path, "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+        return path
+
+    def prometheus(self):
+        lines = [
+            "# TYPE pos_op_duration_ms histogram",
+        ]
+        with self.lock:
+            for name, stats in sorted(self.ops.items()):
+                labels = f'op="{name}",category="{stats.category}"'
+                cumulative = 0
+                for bound, n in zip(BUCKETS_MS, stats.buckets):
+                    cumulative += n
+                    lines.append(f'pos_op_duration_ms_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'pos_op_duration_ms_bucket{{{labels},le="+Inf"}} {stats.count}')
+                lines.append(f"pos_op_duration_ms_sum{{{labels}}} {stats.total_ms:.3f}")
+                lines.append(f"pos_op_duration_ms_count{{{labels}}} {stats.count}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port=9108, host="127.0.0.1"):
+        # Local stats endpoint: /stats (JSON) and /metrics (Prometheus text)
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        recorder = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/stats":
+                    body, kind = json.dumps(recorder.snapshot(), indent=2), "application/json"
+                elif self.path == "/metrics":
+                    body, kind = recorder.prometheus(), "text/plain; version=0.0.4"
+                else:
+                    self.send_error(404)
+                    return
+                data = body.encode()
+                self.send_response(200)
+                self.send_header("Content-Type", kind)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        return server
+
+    def connection_factory(self):
+        # sqlite3 connection class that times every statement ("sql") and commit ("commit");
+        # pass as ConnectionManager(factory=...) / Inventory(factory=...)
+        recorder = self
+
+        class InstrumentedCursor(sqlite3.Cursor):
+            def execute(self, sql, parameters=()):
+                with recorder.timed("sql", "sql.execute", sql.strip()[:120]):
+                    return super().execute(sql, parameters)
+
+            def executemany(self, sql, seq_of_parameters):
+                with recorder.timed("sql", "sql.executemany", sql.strip()[:120]):
+                    return super().executemany(sql, seq_of_parameters)
+
+        class InstrumentedConnection(sqlite3.Connection):
+            def cursor(self, factory=InstrumentedCursor):
+                return super().cursor(factory)
+
+            def execute(self, sql, parameters=()):
+                return self.cursor().execute(sql, parameters)
+
+            def executemany(self, sql, seq_of_parameters):
+                return self.cursor().executemany(sql, seq_of_parameters)
+
+            def commit(self):
+                with recorder.timed("commit", "sql.commit"):
+                    super().commit()
+
+        return InstrumentedConnection
+
+
+# Process-wide recorder used by the POS
+recorder = Recorder()
@@ -0,0 +1,288 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from connection import ConnectionManager
+from bill import line_total
+
+
+class JournalError(Exception):
+    pass
+
+
+class SalesJournal:
+    # Append-only, fsync'd log of completed bills that is applied to the database behind
+    # the till's back. A checkout returns once its line is durable in the journal; a
+    # background applier then writes bills/sales/stock in grouped transactions and
+    # advances a watermark (journal_state.applied_seq) in the same transaction, so every
+    # entry is applied exactly once. Entries past the watermark are replayed on open.
+    #
+    # Bill ids are shown at checkout, before the bill reaches the database, so they are
+    # reserved in blocks of id_block: the bills AUTOINCREMENT counter (sqlite_sequence) is
+    # moved past the block, and bills any other writer inserts are numbered after it.
+    # Ids left over in a block when the till closes are skipped.
+    def __init__(self, path, db_name, group_delay=0, apply_batch=256, compact_bytes=4 * 1024 * 1024,
+                 id_block=100):
+        self.path = path
+        self.name = os.path.basename(path)
+        # Optional extra wait before each fsync; entries written while one fsync runs already
+        # share the next one
+        self.group_delay = group_delay
+        self.apply_batch = apply_batch
+        self.compact_bytes = compact_bytes
+        self.id_block = id_block
+
+        # Separate writer connection: the applier never interleaves with the till's own transactions
+        self.db = ConnectionManager(db_name)
+        self.conn = self.db.conn
+        self.conn.execute("""
+        CREATE TABLE IF NOT EXISTS journal_state(
+            name TEXT PRIMARY KEY,
+            applied_seq INTEGER NOT NULL
+        )
+        """)
+        self.conn.commit()
+        row = self.conn.execute("SELECT applied_seq FROM journal_state WHERE name=?", (self.name,)).fetchone()
+        self.applied_seq = row[0] if row else 0
+
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.pending = []       # durable entries not yet applied, in seq order
+        self.unsynced = []      # written entries waiting for the next fsync
+        self.closing = False
+        self.drained = False    # set once the flusher has handed over its last entries
+        self.error = None       # fsync failure: nothing more can be made durable
+        self.apply_error = None
+        self.apply_failed = None  # an entry the database refuses: applying has stopped
+        self.retry_interval = 1.0
+
+        entries = self._read_entries()
+        self.seq = max([self.applied_seq] + [entry["seq"] for entry in entries])
+        # Entries journaled before ids were reserved must not be handed out again either
+        self._reserve_bill_ids(max([0] + [entry["bill"] for entry in entries]))
+        self.written_seq = self.synced_seq = self.seq
+
+        self.file = open(self.path, "a", encoding="utf-8")
+        # Recovery: whatever the last run journaled but never applied
+        self.pending = [entry for entry in entries if entry["seq"] > self.applied_seq]
+        self.replayed = len(self.pending)
+
+        self.flusher = threading.Thread(target=self._flush_loop, name="journal-fsync", daemon=True)
+        self.applier = threading.Thread(target=self._apply_loop, name="journal-apply", daemon=True)
+        self.flusher.start()
+        self.applier.start()
+
+    def _read_entries(self):
+        if not os.path.exists(self.path):
+            return []
+        entries = []
+        good_bytes = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                # A torn last line (power lost mid-write) was never acknowledged; drop it
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    break
+                good_bytes += len(line)
+        if good_bytes != os.path.getsize(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(good_bytes)
+        return entries
+
+    def append(self, total, lines):
+        # lines: [(product_id, name, quantity, price, discount, promotion_id)]. Writes the entry and returns
+        # (seq, bill id) without waiting for the disk; see wait_durable.
+        with self.lock:
+            if self.closing:
+                raise JournalError("Sales journal is closed")
+            if self.error:
+                raise JournalError(f"Sales journal failed: {self.error}")
+            if self.apply_failed:
+                raise JournalError(f"Sales journal cannot be applied: {self.apply_failed}")
+            if self.bill_id >= self.bill_limit:
+                self._reserve_bill_ids()
+            self.seq += 1
+            self.bill_id += 1
+            entry = {
+                "seq": self.seq,
+                "bill": self.bill_id,
+                "time": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),
+                "total": total,
+                "lines": lines,
+            }
+            self.file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+            self.file.flush()
+            self.written_seq = entry["seq"]
+            self.unsynced.append(entry)
+            self.changed.notify_all()
+            return entry["seq"], entry["bill"]
+
+    def _reserve_bill_ids(self, floor=0):
+        # Takes the next id_block bill ids; a short write transaction once per block
+        with self.db.write_lock:
+            cursor = self.conn.cursor()
+            try:
+                cursor.execute("BEGIN IMMEDIATE")
+                start = cursor.execute(
+                    "SELECT MAX(?, (SELECT COALESCE(MAX(id), 0) FROM bills), "
+                    "(SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name = 'bills'))",
+                    (floor,)
+                ).fetchone()[0]
+                limit = start + self.id_block
+                cursor.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'bills'", (limit,))
+                if cursor.rowcount == 0:
+                    cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('bills', ?)", (limit,))
+                self.conn.commit()
+            except sqlite3.Error as e:
+                self.conn.rollback()
+                raise JournalError(f"Could not reserve bill numbers: {e}") from e
+        self.bill_id, self.bill_limit = start, limit
+
+    def wait_durable(self, seq):
+        # Blocks until entry `seq` has been fsync'd; entries written meanwhile share the fsync
+        with self.lock:
+            while self.synced_seq < seq:
+                if self.error:
+                    raise JournalError(f"Sales journal failed: {self.error}")
+                self.changed.wait()
+
+    def _flush_loop(self):
+        # Group commit: one fsync covers every entry written since the last one
+        while True:
+            with self.lock:
+                while not self.unsynced and not self.closing:
+                    self.changed.wait()
+                if not self.unsynced:
+                    return
+            if self.group_delay:
+                time.sleep(self.group_delay)
+            with self.lock:
+                batch = self.unsynced
+                self.unsynced = []
+                fd = self.file.fileno()
+            try:
+                os.fsync(fd)
+            except OSError as e:
+                with self.lock:
+                    self.error = e
+                    self.changed.notify_all()
+                return
+            with self.lock:
+                # Synced entries become visible to the applier in seq order
+                self.pending.extend(batch)
+                self.synced_seq = batch[-1]["seq"]
+                self.changed.notify_all()
+
+    def _apply_loop(self):
+        while True:
+            with self.lock:
+                while not self.pending and not self.drained:
+                    self.changed.wait()
+                if not self.pending:
+                    return
+                batch = self.pending[:self.apply_batch]
+            try:
+                self._apply(batch)
+            except sqlite3.OperationalError as e:
+                # The entries are safe in the journal: keep retrying (e.g. database locked),
+                # or leave them to be replayed on the next start if we are shutting down
+                if str(e) != self.apply_error:
+                    print(f"Error applying sales journal: {e}")
+                self.apply_error = str(e)
+                with self.lock:
+                    if self.drained:
+                        return
+                    self.changed.wait(self.retry_interval)
+                continue
+            except Exception as e:
+                # Retrying can't help (e.g. a constraint the entry breaks): stop, and fail
+                # new sales and waiters so the till shows it. The entries stay in the journal.
+                print(f"Error applying sales journal: {e}")
+                with self.lock:
+                    self.apply_failed = e
+                    self.changed.notify_all()
+                return
+            self.apply_error = None
+            with self.lock:
+                del self.pending[:len(batch)]
+                self.applied_seq = batch[-1]["seq"]
+                self.changed.notify_all()
+                self._maybe_compact()
+
+    def _apply(self, batch):
+        with self.db.write_lock:
+            self._apply_batch(batch)
+
+    def _apply_batch(self, batch):
+        cursor = self.conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            for entry in batch:
+                cursor.execute("INSERT INTO bills (id, total, created_at) VALUES (?, ?, ?)",
+                               (entry["bill"], entry["total"], entry["time"]))
+                # Not guarded: the sale already happened at the till, so stock follows it
+                # Entries journaled before promotions have 4-item lines: no discount
+                lines = [(*line, 0, None)[:6] for line in entry["lines"]]
+                cursor.executemany("UPDATE products SET stock = stock - ? WHERE id = ?",
+                                   [(quantity, product_id) for product_id, _, quantity, _, _, _ in lines])
+                cursor.executemany(
+                    "INSERT INTO stock_movements (product_id, delta, reason, ref, created_at) "
+                    "VALUES (?, ?, 'sale', ?, ?)",
+                    [(product_id, -quantity, entry["bill"], entry["time"])
+                     for product_id, _, quantity, _, _, _ in lines]
+                )
+                cursor.executemany(
+                    "INSERT INTO sales (product_name, quantity, price, total, discount, promotion_id, sale_time, "
+                    "bill_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(name, quantity, price, line_total(price, quantity, discount), discount, promotion_id,
+                      entry["time"], entry["bill"])
+                     for _, name, quantity, price, discount, promotion_id in lines]
+                )
+            cursor.execute(
+                "INSERT INTO journal_state (name, applied_seq) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET applied_seq = excluded.applied_seq",
+                (self.name, batch[-1]["seq"])
+            )
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    def _maybe_compact(self):
+        # Called with the lock held: once everything written is applied the file can start over
+        if (self.applied_seq == self.written_seq == self.synced_seq and not self.pending
+                and self.file.tell() >= self.compact_bytes):
+            self.file.truncate(0)
+            self.file.seek(0)
+            os.fsync(self.file.fileno())
+
+    def wait_applied(self, timeout=None):
+        # True once every acknowledged entry is in the database, False on timeout; raises
+        # JournalError if applying has stopped on an entry the database refuses
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.lock:
+            while self.applied_seq < self.synced_seq and not self.error:
+                if self.apply_failed:
+                    raise JournalError(f"Sales journal cannot be applied: {self.apply_failed}")
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.changed.wait(remaining)
+            return self.applied_seq >= self.synced_seq
+
+    def close(self):
+        with self.lock:
+            self.closing = True
+            self.changed.notify_all()
+        self.flusher.join()
+        with self.lock:
+            self.drained = True
+            self.changed.notify_all()
+        self.applier.join()
+        self.file.close()
+        self.db.close()
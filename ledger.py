@@ -0,0 +1,169 @@
+import time
+from contextlib import contextmanager
+
+# Movement reasons: opening (initial stock), sale, restock, adjustment (counts, imports, edits).
+# Movements are written next to every products.stock change, in the same transaction.
+# `?`s: product id, delta, reason, ref
+MOVEMENT_SQL = "INSERT INTO stock_movements (product_id, delta, reason, ref) VALUES (?, ?, ?, ?)"
+
+# Records the change an absolute stock value makes, before it is written.
+# `?`s: new stock, ref, product name, new stock
+ADJUSTMENT_BY_NAME_SQL = """
+    INSERT INTO stock_movements (product_id, delta, reason, ref)
+    SELECT id, ? - stock, 'adjustment', ? FROM products WHERE name = ? AND stock IS NOT ?
+"""
+
+
+class StockLedger:
+    # Append-only history of stock movements (sale, restock, adjustment) with sparse
+    # snapshots: each snapshot stores the on-hand of every product that moved since the
+    # previous one, so stock at any date is one snapshot row plus the movements after it.
+    # products.stock stays the live on-hand; the ledger always sums to it unless stock
+    # was edited behind its back, which check() finds. Tables and the opening-stock trigger
+    # are created by migrations.stock_ledger.
+    def __init__(self, conn, reader=None):
+        self.conn = conn
+        self.reader = reader or (lambda: conn)
+
+    @contextmanager
+    def capture_adjustments(self, ref):
+        # For bulk statements (imports) that overwrite stock: while active, every stock
+        # change made on this connection is recorded as an adjustment. The TEMP trigger
+        # is private to the connection, so other writers are unaffected.
+        self.conn.execute(f"""
+        CREATE TEMP TRIGGER IF NOT EXISTS stock_ledger_capture AFTER UPDATE OF stock ON main.products
+        WHEN new.stock IS NOT old.stock
+        BEGIN
+            INSERT INTO stock_movements (product_id, delta, reason, ref)
+            VALUES (new.id, COALESCE(new.stock, 0) - COALESCE(old.stock, 0), 'adjustment', {self._quote(ref)});
+        END
+        """)
+        try:
+            yield
+        finally:
+            self.conn.execute("DROP TRIGGER IF EXISTS temp.stock_ledger_capture")
+
+    def _quote(self, value):
+        return "NULL" if value is None else "'" + str(value).replace("'", "''") + "'"
+
+    def _now(self):
+        return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+
+    def last_snapshot(self):
+        row = self.reader().execute(
+            "SELECT movement_id, taken_at FROM stock_snapshot_runs ORDER BY movement_id DESC LIMIT 1"
+        ).fetchone()
+        return row or (0, None)
+
+    def snapshot(self):
+        # Folds the movements since the last snapshot into new per-product snapshot rows.
+        # Returns the number of products snapshotted.
+        last, _ = self.last_snapshot()
+        cursor = self.conn.cursor()
+        upto = cursor.execute("SELECT COALESCE(MAX(id), 0) FROM stock_movements").fetchone()[0]
+        if upto <= last:
+            return 0
+        now = self._now()
+        cursor.execute("""
+            INSERT INTO stock_snapshots (product_id, movement_id, taken_at, stock)
+            SELECT m.product_id, :upto, :now,
+                   COALESCE((SELECT s.stock FROM stock_snapshots s WHERE s.product_id = m.product_id
+                             ORDER BY s.movement_id DESC LIMIT 1), 0) + SUM(m.delta)
+            FROM stock_movements m
+            WHERE m.id > :last AND m.id <= :upto
+            GROUP BY m.product_id
+        """, {"upto": upto, "now": now, "last": last})
+        count = cursor.rowcount
+        cursor.execute("INSERT INTO stock_snapshot_runs (movement_id, taken_at) VALUES (?, ?)", (upto, now))
+        self.conn.commit()
+        return count
+
+    def snapshot_if_due(self, min_movements=5000):
+        last, _ = self.last_snapshot()
+        pending = self.reader().execute(
+            "SELECT COUNT(*) FROM stock_movements WHERE id > ?", (last,)
+        ).fetchone()[0]
+        return self.snapshot() if pending >= min_movements else 0
+
+    def _product_id(self, name):
+        row = self.reader().execute("SELECT id FROM products WHERE name=?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def stock_at(self, name, when=None):
+        # On-hand of `name` at `when` ('YYYY-MM-DD[ HH:MM:SS]', UTC like sale_time; a bare
+        # date means the end of that day). None when the product is unknown.
+        product_id = self._product_id(name)
+        if product_id is None:
+            return None
+        if when is None:
+            when = "9999-12-31"
+        if len(str(when)) == 10:
+            when = f"{when} 23:59:59"
+        return self._on_hand(self.reader(), product_id, when)
+
+    def _on_hand(self, conn, product_id, when="9999-12-31 23:59:59"):
+        snap = conn.execute(
+            "SELECT movement_id, stock FROM stock_snapshots WHERE product_id = ? AND taken_at <= ? "
+            "ORDER BY movement_id DESC LIMIT 1",
+            (product_id, when)
+        ).fetchone()
+        after, stock = snap or (0, 0)
+        moved = conn.execute(
+            "SELECT COALESCE(SUM(delta), 0) FROM stock_movements "
+            "WHERE product_id = ? AND id > ? AND created_at <= ?",
+            (product_id, after, when)
+        ).fetchone()[0]
+        return stock + moved
+
+    def history(self, name, limit=100):
+        # Most recent movements first: (created_at, delta, reason, ref)
+        product_id = self._product_id(name)
+        if product_id is None:
+            return []
+        return self.reader().execute(
+            "SELECT created_at, delta, reason, ref FROM stock_movements WHERE product_id = ? "
+            "ORDER BY id DESC LIMIT ?",
+            (product_id, limit)
+        ).fetchall()
+
+    def check(self):
+        # Products whose stock column disagrees with the ledger: (name, stock, ledger stock).
+        # Reads the latest snapshot plus movements since, never the whole ledger.
+        last, _ = self.last_snapshot()
+        return self.reader().execute("""
+            WITH snap AS (
+                -- bare column: stock comes from the row holding MAX(movement_id)
+                SELECT product_id, stock, MAX(movement_id) FROM stock_snapshots GROUP BY product_id
+            ), moved AS (
+                -- +product_id keeps the scan on the rowid range instead of the whole product index
+                SELECT product_id, SUM(delta) AS delta FROM stock_movements WHERE id > ? GROUP BY +product_id
+            )
+            SELECT p.name, p.stock, COALESCE(snap.stock, 0) + COALESCE(moved.delta, 0) AS ledger
+            FROM products p
+            LEFT JOIN snap ON snap.product_id = p.id
+            LEFT JOIN moved ON moved.product_id = p.id
+            WHERE COALESCE(p.stock, 0) <> ledger
+        """, (last,)).fetchall()
+
+    def reconcile(self, counts, ref="count"):
+        # counts: {product name: physically counted units}. Sets stock to the count and
+        # records counted - ledger on-hand as an adjustment, so stock and ledger agree again
+        # even after edits the ledger never saw. Returns {name: that difference}; negative
+        # means shrinkage.
+        cursor = self.conn.cursor()
+        differences = {}
+        try:
+            for name, counted in counts.items():
+                row = cursor.execute("SELECT id FROM products WHERE name=?", (name,)).fetchone()
+                if row is None:
+                    continue
+                difference = counted - self._on_hand(self.conn, row[0])
+                differences[name] = difference
+                if difference:
+                    cursor.execute(MOVEMENT_SQL, (row[0], difference, "adjustment", ref))
+                cursor.execute("UPDATE products SET stock = ? WHERE id = ?", (counted, row[0]))
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return differences
@@ -0,0 +1,453 @@
+import sqlite3
+import time
+
+# Schema versions, tracked in PRAGMA user_version. Each migration runs once, in order,
+# in its own transaction together with the version bump. Steps are written to be safe on
+# databases that already have some of the schema (every shop database made before the
+# runner existed is at version 0), so they check before they create.
+MIGRATIONS = []
+
+# Online backfills: name -> (table, fn(cursor, first_id, last_id)). A migration schedules
+# one for the rows that exist when it runs (later rows are kept up to date by triggers);
+# run_backfills() then works through that rowid range in short transactions, so a large
+# live database is never locked for the whole pass. Progress is stored, so an interrupted
+# backfill resumes where it stopped.
+BACKFILLS = {}
+
+
+class MigrationError(Exception):
+    pass
+
+
+def migration(version):
+    def register(fn):
+        MIGRATIONS.append((version, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+
+def backfill(name, table):
+    def register(fn):
+        BACKFILLS[name] = (table, fn)
+        return fn
+    return register
+
+
+def _columns(cursor, table):
+    return [col[1] for col in cursor.execute(f"PRAGMA table_info({table})").fetchall()]
+
+
+def _table_exists(cursor, name):
+    return cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (name,)
+    ).fetchone() is not None
+
+
+def _has_unique_index(cursor, table, column):
+    for _, index, unique, *_ in cursor.execute(f"PRAGMA index_list({table})").fetchall():
+        if unique and [col[2] for col in cursor.execute(f"PRAGMA index_info({index})")] == [column]:
+            return True
+    return False
+
+
+def schedule_backfill(cursor, name):
+    table, _ = BACKFILLS[name]
+    last_id = cursor.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {table}").fetchone()[0]
+    if last_id:
+        cursor.execute(
+            "INSERT OR REPLACE INTO schema_backfills (name, next_id, last_id) VALUES (?, 1, ?)",
+            (name, last_id)
+        )
+
+
+# -------------------------------
+# Migrations
+# -------------------------------
+@migration(1)
+def base_tables(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS products(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT UNIQUE,
+        price REAL,
+        stock INTEGER,
+        barcode TEXT UNIQUE
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS sales(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_name TEXT,
+        quantity INTEGER,
+        price REAL,
+        total REAL,
+        sale_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    # Shop databases from before barcodes were added (the old add_barcode_column.py
+    # script). ALTER TABLE can't add a UNIQUE column; migration 3 adds the index.
+    if "barcode" not in _columns(cursor, "products"):
+        cursor.execute("ALTER TABLE products ADD COLUMN barcode TEXT")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS schema_backfills(
+        name TEXT PRIMARY KEY,
+        next_id INTEGER NOT NULL,
+        last_id INTEGER NOT NULL
+    )
+    """)
+
+
+@migration(2)
+def bills(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS bills(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        total REAL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    # Older shop databases were created before sales rows were grouped into bills
+    if "bill_id" not in _columns(cursor, "sales"):
+        cursor.execute("ALTER TABLE sales ADD COLUMN bill_id INTEGER REFERENCES bills(id)")
+
+
+@migration(3)
+def lookup_indexes(cursor):
+    # Sales history pages by time, optionally narrowed to one product
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sales_sale_time ON sales(sale_time)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sales_product_name ON sales(product_name, sale_time)")
+    # The lines of one bill (receipt reprints, sync)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sales_bill ON sales(bill_id)")
+    # Serves case-insensitive prefix matches, which rank above substring matches
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_name_nocase ON products(name COLLATE NOCASE)")
+    if not _has_unique_index(cursor, "products", "name"):
+        cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_products_name ON products(name)")
+
+    # Scans look products up by barcode, and imports upsert on it
+    if not _has_unique_index(cursor, "products", "barcode"):
+        # Blank barcodes typed in by hand mean "none", and would collide
+        cursor.execute("UPDATE products SET barcode = NULL WHERE TRIM(barcode) = ''")
+        duplicate = cursor.execute(
+            "SELECT barcode FROM products WHERE barcode IS NOT NULL GROUP BY barcode HAVING COUNT(*) > 1 LIMIT 1"
+        ).fetchone()
+        if duplicate:
+            print(f"Warning: barcode {duplicate[0]!r} is used by more than one product; barcodes are "
+                  "indexed but not unique (barcode imports need that) until the duplicates are fixed "
+                  "and idx_products_barcode is created by hand")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_barcode_dup ON products(barcode)")
+        else:
+            cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_products_barcode ON products(barcode)")
+
+
+@migration(4)
+def sales_rollups(cursor):
+    # Per-day and per-hour, per-product rollups of `sales` (see SalesReport), kept up to
+    # date by triggers as sale rows are written
+    created = not _table_exists(cursor, "sales_daily")
+    for table, bucket in (("sales_daily", "day"), ("sales_hourly", "hour")):
+        cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table}(
+            {bucket} TEXT,
+            product_name TEXT,
+            quantity INTEGER,
+            revenue REAL,
+            sale_count INTEGER,
+            PRIMARY KEY ({bucket}, product_name)
+        ) WITHOUT ROWID
+        """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS sales_rollup_ai AFTER INSERT ON sales BEGIN
+        INSERT INTO sales_daily(day, product_name, quantity, revenue, sale_count)
+        VALUES (substr(new.sale_time, 1, 10), new.product_name, new.quantity, new.total, 1)
+        ON CONFLICT(day, product_name) DO UPDATE SET
+            quantity = quantity + excluded.quantity,
+            revenue = revenue + excluded.revenue,
+            sale_count = sale_count + 1;
+        INSERT INTO sales_hourly(hour, product_name, quantity, revenue, sale_count)
+        VALUES (substr(new.sale_time, 1, 13), new.product_name, new.quantity, new.total, 1)
+        ON CONFLICT(hour, product_name) DO UPDATE SET
+            quantity = quantity + excluded.quantity,
+            revenue = revenue + excluded.revenue,
+            sale_count = sale_count + 1;
+    END
+    """)
+    # Rows the backfill hasn't reached yet aren't in the rollups, so their deletes aren't either
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS sales_rollup_ad AFTER DELETE ON sales
+    WHEN NOT EXISTS (SELECT 1 FROM schema_backfills
+                     WHERE name = 'sales_rollups' AND old.id BETWEEN next_id AND last_id)
+    BEGIN
+        UPDATE sales_daily SET quantity = quantity - old.quantity, revenue = revenue - old.total,
+            sale_count = sale_count - 1
+        WHERE day = substr(old.sale_time, 1, 10) AND product_name = old.product_name;
+        UPDATE sales_hourly SET quantity = quantity - old.quantity, revenue = revenue - old.total,
+            sale_count = sale_count - 1
+        WHERE hour = substr(old.sale_time, 1, 13) AND product_name = old.product_name;
+    END
+    """)
+    if created:
+        schedule_backfill(cursor, "sales_rollups")
+
+
+@backfill("sales_rollups", "sales")
+def backfill_sales_rollups(cursor, first_id, last_id):
+    for table, bucket, width in (("sales_daily", "day", 10), ("sales_hourly", "hour", 13)):
+        cursor.execute(f"""
+            INSERT INTO {table}({bucket}, product_name, quantity, revenue, sale_count)
+            SELECT substr(sale_time, 1, {width}), product_name, SUM(quantity), SUM(total), COUNT(*)
+            FROM sales WHERE id BETWEEN ? AND ? GROUP BY 1, 2
+            ON CONFLICT({bucket}, product_name) DO UPDATE SET
+                quantity = quantity + excluded.quantity,
+                revenue = revenue + excluded.revenue,
+                sale_count = sale_count + excluded.sale_count
+        """, (first_id, last_id))
+
+
+@migration(5)
+def stock_ledger(cursor):
+    # Movement history and snapshots behind StockLedger
+    created = not _table_exists(cursor, "stock_movements")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS stock_movements(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_id INTEGER NOT NULL,
+        delta INTEGER NOT NULL,
+        reason TEXT NOT NULL,
+        ref TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    # (product_id, rowid): one product's movements after a snapshot are an index range
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_stock_movements_product ON stock_movements(product_id)")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS stock_snapshots(
+        product_id INTEGER NOT NULL,
+        movement_id INTEGER NOT NULL,
+        taken_at TIMESTAMP NOT NULL,
+        stock INTEGER NOT NULL,
+        PRIMARY KEY (product_id, movement_id)
+    ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS stock_snapshot_runs(
+        movement_id INTEGER PRIMARY KEY,
+        taken_at TIMESTAMP NOT NULL
+    )
+    """)
+    # New products open the ledger with whatever stock they were created with
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS stock_ledger_ai AFTER INSERT ON products
+    WHEN COALESCE(new.stock, 0) <> 0
+    BEGIN
+        INSERT INTO stock_movements (product_id, delta, reason) VALUES (new.id, new.stock, 'opening');
+    END
+    """)
+    if created:
+        # Not batched: the opening balance has to be read in the same transaction that
+        # starts recording movements, or a sale in between would be counted twice
+        cursor.execute("""
+            INSERT INTO stock_movements (product_id, delta, reason)
+            SELECT id, stock, 'opening' FROM products WHERE COALESCE(stock, 0) <> 0
+        """)
+
+
+@migration(6)
+def change_log(cursor):
+    # Row-level change capture for sync.py. Product edits and sales deletes are logged here;
+    # new sales and stock changes need no log, as sales.id and stock_movements.id already
+    # number them in commit order.
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS change_log(
+        seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        table_name TEXT NOT NULL,
+        row_id INTEGER NOT NULL,
+        op TEXT NOT NULL,
+        old_name TEXT,
+        old_price REAL,
+        changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS change_log_products_ai AFTER INSERT ON products BEGIN
+        INSERT INTO change_log (table_name, row_id, op) VALUES ('products', new.id, 'insert');
+    END
+    """)
+    # Stock is left out: it changes on every sale and travels through the ledger instead
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS change_log_products_au AFTER UPDATE OF name, price, barcode ON products
+    WHEN new.name IS NOT old.name OR new.price IS NOT old.price OR new.barcode IS NOT old.barcode
+    BEGIN
+        INSERT INTO change_log (table_name, row_id, op, old_name, old_price)
+        VALUES ('products', new.id, 'update', old.name, old.price);
+    END
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS change_log_products_ad AFTER DELETE ON products BEGIN
+        INSERT INTO change_log (table_name, row_id, op, old_name, old_price)
+        VALUES ('products', old.id, 'delete', old.name, old.price);
+    END
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS change_log_sales_ad AFTER DELETE ON sales BEGIN
+        INSERT INTO change_log (table_name, row_id, op) VALUES ('sales', old.id, 'delete');
+    END
+    """)
+    # What this shop has exported so far (see sync.export_batches)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS sync_state(
+        branch TEXT PRIMARY KEY,
+        change_seq INTEGER NOT NULL,
+        sale_id INTEGER NOT NULL,
+        movement_id INTEGER NOT NULL,
+        batches INTEGER NOT NULL
+    )
+    """)
+
+
+@migration(7)
+def promotions(cursor):
+    # Price rules for promotions.py, product categories they can target, and the discount
+    # each sale was given (sales.total is what was charged: price * quantity - discount)
+    if "category" not in _columns(cursor, "products"):
+        cursor.execute("ALTER TABLE products ADD COLUMN category TEXT")
+    sales_columns = _columns(cursor, "sales")
+    if "discount" not in sales_columns:
+        cursor.execute("ALTER TABLE sales ADD COLUMN discount REAL NOT NULL DEFAULT 0")
+    if "promotion_id" not in sales_columns:
+        cursor.execute("ALTER TABLE sales ADD COLUMN promotion_id INTEGER")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS promotions(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        kind TEXT NOT NULL CHECK (kind IN ('percent', 'price', 'bundle')),
+        product_name TEXT,
+        category TEXT,
+        value REAL NOT NULL CHECK (value >= 0),
+        min_qty INTEGER NOT NULL DEFAULT 1 CHECK (min_qty >= 1),
+        starts_at TEXT,
+        ends_at TEXT,
+        daily_from TEXT,
+        daily_to TEXT,
+        active INTEGER NOT NULL DEFAULT 1,
+        version INTEGER NOT NULL DEFAULT 1,
+        CHECK ((product_name IS NULL) <> (category IS NULL))
+    )
+    """)
+    # Any edit bumps the row's version, so tills notice it with one aggregate query
+    # (AUTOINCREMENT ids are never reused, so inserts and deletes always show too)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS promotions_version AFTER UPDATE ON promotions
+    WHEN new.version = old.version
+    BEGIN
+        UPDATE promotions SET version = old.version + 1 WHERE id = new.id;
+    END
+    """)
+
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+# -------------------------------
+# Runner
+# -------------------------------
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn, backfill=True, batch_size=5000):
+    # Brings the database up to SCHEMA_VERSION; returns the names of the migrations applied.
+    # backfill=False leaves scheduled backfills for run_backfills() to do in the background.
+    version = schema_version(conn)
+    if version > SCHEMA_VERSION:
+        raise MigrationError(f"Database schema version {version} is newer than this program "
+                             f"supports ({SCHEMA_VERSION}); please upgrade")
+    applied = []
+    for number, step in MIGRATIONS:
+        if number <= version:
+            continue
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            # Another process may have migrated while we waited for the write lock
+            if schema_version(conn) < number:
+                step(cursor)
+                cursor.execute(f"PRAGMA user_version = {number}")
+                applied.append(step.__name__)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise MigrationError(f"Migration {number} ({step.__name__}) failed: {e}") from e
+    if backfill:
+        run_backfills(conn, batch_size)
+    return applied
+
+
+def pending_backfills(conn):
+    # [(name, rows done, rows in range)]
+    if not _table_exists(conn, "schema_backfills"):
+        return []
+    return [(name, next_id - 1, last_id) for name, next_id, last_id in
+            conn.execute("SELECT name, next_id, last_id FROM schema_backfills ORDER BY name").fetchall()]
+
+
+def run_backfills(conn, batch_size=5000, stop=None, progress=None, pause=0.05):
+    # Works through every scheduled backfill one batch per transaction. stop: optional
+    # threading.Event checked between batches; progress(name, done, total) after each.
+    # pause: seconds between batches, so writers waiting in their busy handler get the
+    # lock (they poll; without a gap the next batch would take it straight back).
+    # Returns True once nothing is left to backfill.
+    for name, done, last_id in pending_backfills(conn):
+        _, fill = BACKFILLS[name]
+        next_id = done + 1
+        while next_id <= last_id:
+            if stop is not None and stop.is_set():
+                return False
+            end = min(next_id + batch_size - 1, last_id)
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                fill(cursor, next_id, end)
+                cursor.execute("UPDATE schema_backfills SET next_id = ? WHERE name = ?", (end + 1, name))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            next_id = end + 1
+            if progress:
+                progress(name, end, last_id)
+            if pause and next_id <= last_id:
+                time.sleep(pause)
+        conn.execute("DELETE FROM schema_backfills WHERE name = ?", (name,))
+        conn.commit()
+    return True
+
+
+def main(argv=None):
+    import argparse
+    from connection import ConnectionManager
+
+    parser = argparse.ArgumentParser(description="Upgrade a shop database to the current schema")
+    parser.add_argument("--db", default="shop.db")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args(argv)
+
+    db = ConnectionManager(args.db)
+    try:
+        before = schema_version(db.conn)
+        applied = migrate(db.conn, backfill=False)
+        print(f"Schema version {before} -> {schema_version(db.conn)}"
+              + (f" ({', '.join(applied)})" if applied else ""))
+        run_backfills(db.conn, args.batch_size,
+                      progress=lambda name, done, total: print(f"  {name}: {done}/{total}"))
+    except (MigrationError, sqlite3.Error) as e:
+        print(f"Error migrating {args.db}: {e}")
+        return 1
+    finally:
+        db.close()
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+    sys.exit(main())
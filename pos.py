@@ -0,0 +1,363 @@
+import argparse
+import csv
+import os
+import sys
+
+from database import Inventory, SaleManager, ProductCatalog, ConcreteProduct
+from receipts import NullReceiptSink, FileReceiptSink, escpos_sink
+import reports
+import migrations
+
+# Headless entry point for scripts and cron jobs: python -m pos <command> ...
+# Nothing here imports Qt (PDF reports load it only when asked for).
+
+
+def print_rows(rows, headers=None):
+    if headers:
+        print("\t".join(headers))
+    for row in rows:
+        print("\t".join("" if value is None else str(value) for value in row))
+
+
+def parse_item(item):
+    # CODE or CODE:QTY, CODE being a product name or barcode
+    code, _, qty = item.rpartition(":")
+    if code and qty.isdigit():
+        return code, int(qty)
+    return item, 1
+
+
+def cmd_products(inv, args):
+    if args.search:
+        rows = inv.search.search(args.search, args.limit)
+    else:
+        rows, _ = inv.get_products_page(limit=args.limit)
+        rows = [row[1:] for row in rows]
+    print_rows(rows, ("name", "price", "stock", "barcode"))
+
+
+def cmd_add(inv, args):
+    print(inv.add_product(ConcreteProduct(args.name, args.price, args.stock, args.barcode)).strip())
+
+
+def cmd_price(inv, args):
+    print(inv.update_price(args.name, args.price).strip())
+
+
+def cmd_stock(inv, args):
+    print(inv.update_stock(args.name, args.stock).strip())
+
+
+def cmd_restock(inv, args):
+    print(inv.restock(args.name, args.quantity, args.ref).strip())
+
+
+def cmd_category(inv, args):
+    print(inv.set_category(args.name, args.category).strip())
+
+
+def cmd_delete(inv, args):
+    print(inv.delete_product(args.name).strip())
+
+
+def cmd_sell(inv, args):
+    # One bill; items are resolved the way the till resolves a scan (name, then barcode)
+    catalog = ProductCatalog(inv, load=False)
+    lines = []
+    for item in args.items:
+        code, quantity = parse_item(item)
+        entry = catalog.lookup(code)
+        if entry is None:
+            print(f"Product not found: {code}", file=sys.stderr)
+            return 1
+        lines.append((entry.name, None, quantity))
+    if args.printer:
+        sink = escpos_sink(args.printer)
+    elif args.receipt:
+        sink = FileReceiptSink(args.receipt)
+    else:
+        sink = NullReceiptSink()
+    sales = SaleManager(inv.conn, receipt_sink=sink, catalog=catalog, reader=inv.db.reader, promotions=inv.promotions)
+    try:
+        bill_id, message = sales.checkout(lines)
+    finally:
+        sales.close()
+    print(message.strip(), file=sys.stdout if bill_id else sys.stderr)
+    return 0 if bill_id else 1
+
+
+def cmd_sales(inv, args):
+    sales = SaleManager(inv.conn, receipt_sink=NullReceiptSink(), reader=inv.db.reader)
+    try:
+        rows, _ = sales.get_sales_page(limit=args.limit, start=args.start, end=args.end, product=args.product)
+    finally:
+        sales.close()
+    print_rows(rows, ("id", "sale_time", "product", "quantity", "total"))
+
+
+def cmd_top(inv, args):
+    print_rows(inv.reports.top_products(args.n, args.start, args.end, args.by),
+               ("product", "quantity", "revenue", "sales"))
+
+
+def cmd_revenue(inv, args):
+    print_rows(inv.reports.revenue_by_period(args.period, args.start, args.end),
+               (args.period, "revenue", "quantity", "sales"))
+
+
+def cmd_stock_at(inv, args):
+    stock = inv.ledger.stock_at(args.name, args.date)
+    if stock is None:
+        print(f"Product '{args.name}' not found!", file=sys.stderr)
+        return 1
+    print(stock)
+
+
+def cmd_history(inv, args):
+    print_rows(inv.ledger.history(args.name, args.limit), ("time", "delta", "reason", "ref"))
+
+
+def cmd_snapshot(inv, args):
+    print(f"Snapshot covers {inv.ledger.snapshot()} products")
+
+
+def cmd_check(inv, args):
+    rows = inv.ledger.check()
+    print_rows(rows, ("product", "stock", "ledger"))
+    return 1 if rows else 0
+
+
+def cmd_reconcile(inv, args):
+    # CSV with name,count columns from a stock take
+    with open(args.file, newline="", encoding="utf-8-sig") as f:
+        counts = {row["name"]: int(row["count"]) for row in csv.DictReader(f)}
+    differences = inv.ledger.reconcile(counts)
+    print_rows(sorted(differences.items()), ("product", "difference"))
+
+
+def cmd_import(inv, args):
+    import bulk_io
+    report = bulk_io.import_file(inv, args.file, args.key)
+    print(str(report).strip())
+    for line_no, message in report.errors:
+        print(f"line {line_no}: {message}", file=sys.stderr)
+    return 1 if report.errors else 0
+
+
+def cmd_export(inv, args):
+    import bulk_io
+    print(f"Exported {bulk_io.export_products(inv, args.file)} products to {args.file}")
+
+
+def cmd_report(inv, args):
+    count = reports.export_report(inv.db.reader(), args.report, args.output, args.format,
+                                  start=args.start, end=args.end, product=args.product)
+    print(f"Wrote {count} rows to {args.output}")
+
+
+def cmd_reorder(inv, args):
+    # NumPy is only needed here
+    import forecast
+    state = args.state or f"{os.path.splitext(args.db)[0]}-forecast.npz"
+    rows, read = forecast.plan(inv.db.reader(), state, full=args.full, as_of=args.as_of,
+                               window=args.window, lead_time=args.lead_time, review_days=args.review_days,
+                               all_products=args.all)
+    if args.csv:
+        with open(args.csv, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(forecast.COLUMNS)
+            writer.writerows(rows)
+        print(f"Read {read} new sales; wrote {len(rows)} products to {args.csv}")
+    else:
+        print_rows(rows, forecast.COLUMNS)
+
+
+def cmd_promos(inv, args):
+    print_rows(inv.promotions.get_all_promotions(),
+               ("id", "name", "kind", "applies_to", "value", "min_qty", "from", "to", "hours", "active"))
+
+
+def cmd_promo_add(inv, args):
+    daily_from, _, daily_to = (args.hours or "").partition("-")
+    result = inv.promotions.add(args.name, args.kind, args.value, args.product, args.category, args.min_qty,
+                                args.start, args.end, daily_from or None, daily_to or None)
+    print(result.strip(), file=sys.stderr if result.startswith(" Error") else sys.stdout)
+    return 1 if result.startswith(" Error") else 0
+
+
+def cmd_promo_on(inv, args):
+    print(inv.promotions.set_active(args.id, True).strip())
+
+
+def cmd_promo_off(inv, args):
+    print(inv.promotions.set_active(args.id, False).strip())
+
+
+def cmd_schema(inv, args):
+    # Opening the database already applied any migrations and finished their backfills
+    print(f"Schema version {migrations.schema_version(inv.conn)} (current: {migrations.SCHEMA_VERSION})")
+    for name, done, total in migrations.pending_backfills(inv.conn):
+        print(f"  backfill {name}: {done}/{total}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="python -m pos", description="Shop POS from the command line (no GUI)")
+    parser.add_argument("--db", default="shop.db")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("products", help="list or search products")
+    p.add_argument("--search", help="name or part of a name")
+    p.add_argument("--limit", type=int, default=100)
+    p.set_defaults(run=cmd_products)
+
+    p = sub.add_parser("add", help="add a product")
+    p.add_argument("name")
+    p.add_argument("price", type=float)
+    p.add_argument("stock", type=int)
+    p.add_argument("--barcode")
+    p.set_defaults(run=cmd_add)
+
+    p = sub.add_parser("price", help="set a product's price")
+    p.add_argument("name")
+    p.add_argument("price", type=float)
+    p.set_defaults(run=cmd_price)
+
+    p = sub.add_parser("stock", help="set a product's stock (recorded as an adjustment)")
+    p.add_argument("name")
+    p.add_argument("stock", type=int)
+    p.set_defaults(run=cmd_stock)
+
+    p = sub.add_parser("restock", help="add received units to a product's stock")
+    p.add_argument("name")
+    p.add_argument("quantity", type=int)
+    p.add_argument("--ref", help="delivery note / supplier reference")
+    p.set_defaults(run=cmd_restock)
+
+    p = sub.add_parser("category", help="set a product's category (used by category promotions)")
+    p.add_argument("name")
+    p.add_argument("category", nargs="?", help="omit to clear it")
+    p.set_defaults(run=cmd_category)
+
+    p = sub.add_parser("delete", help="delete a product")
+    p.add_argument("name")
+    p.set_defaults(run=cmd_delete)
+
+    p = sub.add_parser("sell", help="record one bill, e.g. sell Juice:2 6789",
+                       description="Writes straight to the database, so don't use it while a till "
+                                   "with a sales journal is running on the same database.")
+    p.add_argument("items", nargs="+", metavar="CODE[:QTY]", help="product name or barcode, optional quantity")
+    p.add_argument("--receipt", help="also write the receipt to this file")
+    p.add_argument("--printer", help="print the receipt as raw ESC/POS: a device such as /dev/usb/lp0, "
+                                     "or tcp:HOST[:PORT]")
+    p.set_defaults(run=cmd_sell)
+
+    p = sub.add_parser("sales", help="recent sales, newest first")
+    p.add_argument("--limit", type=int, default=50)
+    p.add_argument("--product")
+    p.set_defaults(run=cmd_sales)
+
+    p = sub.add_parser("top", help="best sellers")
+    p.add_argument("-n", type=int, default=10)
+    p.add_argument("--by", choices=("quantity", "revenue"), default="quantity")
+    p.set_defaults(run=cmd_top)
+
+    p = sub.add_parser("revenue", help="revenue per day or hour")
+    p.add_argument("--period", choices=("day", "hour"), default="day")
+    p.set_defaults(run=cmd_revenue)
+
+    p = sub.add_parser("report", help="stream a products/sales report to CSV, HTML or PDF")
+    p.add_argument("report", choices=sorted(reports.REPORTS))
+    p.add_argument("output", help="the extension picks the format")
+    p.add_argument("--format", choices=sorted(reports.WRITERS))
+    p.add_argument("--product", help="only sales of this product")
+    p.set_defaults(run=cmd_report)
+
+    for name in ("sales", "top", "revenue", "report"):
+        sub.choices[name].add_argument("--from", dest="start", help="YYYY-MM-DD")
+        sub.choices[name].add_argument("--to", dest="end", help="YYYY-MM-DD")
+
+    p = sub.add_parser("stock-at", help="stock on hand at a date (default: now)")
+    p.add_argument("name")
+    p.add_argument("date", nargs="?", help="YYYY-MM-DD[ HH:MM:SS], UTC")
+    p.set_defaults(run=cmd_stock_at)
+
+    p = sub.add_parser("history", help="stock movements of a product, newest first")
+    p.add_argument("name")
+    p.add_argument("--limit", type=int, default=50)
+    p.set_defaults(run=cmd_history)
+
+    p = sub.add_parser("snapshot", help="fold recent stock movements into a snapshot")
+    p.set_defaults(run=cmd_snapshot)
+
+    p = sub.add_parser("check", help="products whose stock disagrees with the ledger (exit 1 if any)")
+    p.set_defaults(run=cmd_check)
+
+    p = sub.add_parser("reconcile", help="apply a stock take (CSV with name,count columns)")
+    p.add_argument("file")
+    p.set_defaults(run=cmd_reconcile)
+
+    p = sub.add_parser("import", help="import products from CSV or JSON Lines")
+    p.add_argument("file")
+    p.add_argument("--key", choices=("name", "barcode"), default="name")
+    p.set_defaults(run=cmd_import)
+
+    p = sub.add_parser("export", help="export products to CSV or JSON Lines")
+    p.add_argument("file")
+    p.set_defaults(run=cmd_export)
+
+    p = sub.add_parser("reorder", help="products to reorder, from recent sales velocity (needs NumPy)")
+    p.add_argument("--window", type=int, default=28, help="days of sales averaged")
+    p.add_argument("--lead-time", type=int, default=3, help="days from order to delivery")
+    p.add_argument("--review-days", type=int, default=7, help="days until the next order")
+    p.add_argument("--all", action="store_true", help="every product, not only those due")
+    p.add_argument("--as-of", help="YYYY-MM-DD (default: today, UTC)")
+    p.add_argument("--csv", help="write the suggestions to this file")
+    p.add_argument("--state", help="saved demand history (default: <db>-forecast.npz)")
+    p.add_argument("--full", action="store_true", help="rebuild the demand history from scratch")
+    p.set_defaults(run=cmd_reorder)
+
+    p = sub.add_parser("promos", help="list promotions")
+    p.set_defaults(run=cmd_promos)
+
+    p = sub.add_parser("promo-add", help="add a promotion, e.g. promo-add '3 for 100' bundle 100 --min-qty 3 "
+                                         "--category snacks",
+                       description="percent: VALUE%% off each unit; price: each unit at VALUE; bundle: every "
+                                   "MIN_QTY units for VALUE. A line gets at most one promotion; product "
+                                   "promotions come before category ones.")
+    p.add_argument("name", help="shown on receipts")
+    p.add_argument("kind", choices=("percent", "price", "bundle"))
+    p.add_argument("value", type=float)
+    target = p.add_mutually_exclusive_group(required=True)
+    target.add_argument("--product", help="product name")
+    target.add_argument("--category")
+    p.add_argument("--min-qty", type=int, default=1, help="units needed on the bill")
+    p.add_argument("--from", dest="start", help="YYYY-MM-DD[ HH:MM], local time")
+    p.add_argument("--to", dest="end", help="YYYY-MM-DD[ HH:MM] (a date includes that day)")
+    p.add_argument("--hours", help="HH:MM-HH:MM every day, e.g. 17:00-19:00")
+    p.set_defaults(run=cmd_promo_add)
+
+    p = sub.add_parser("promo-on", help="enable a promotion")
+    p.add_argument("id", type=int)
+    p.set_defaults(run=cmd_promo_on)
+
+    p = sub.add_parser("promo-off", help="disable a promotion")
+    p.add_argument("id", type=int)
+    p.set_defaults(run=cmd_promo_off)
+
+    p = sub.add_parser("schema", help="upgrade the database schema and show its version")
+    p.set_defaults(run=cmd_schema)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    inv = Inventory(args.db)
+    try:
+        return args.run(inv, args) or 0
+    finally:
+        inv.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,347 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+from bill import to_paisa
+
+# Promotions: price rules applied to the bill as it is scanned, and again at checkout.
+#
+# A rule targets one product (product_name) or a category (category; its products are
+# mixed and matched) and needs min_qty units of its target on the bill:
+#   percent - value% off every unit
+#   price   - every unit at `value`, where that is cheaper
+#   bundle  - every min_qty units together for `value` (3 for Rs.100; buy 2 get 1 free is
+#             a bundle of 3 priced at two); the dearest units are bundled first
+# starts_at/ends_at ('YYYY-MM-DD[ HH:MM]', shop local time) bound when a rule runs; a
+# date-only ends_at includes that day. daily_from/daily_to ('HH:MM') narrow it to part of
+# each day (happy hour; may wrap past midnight).
+#
+# Discounts don't stack: a line gets at most one rule. A product's own rules come first
+# (the one saving most wins); lines they leave undiscounted share whichever rule of their
+# category saves most on them together.
+#
+# Rules are compiled into a PromotionIndex keyed by product name and category. A
+# BasketPricer then re-prices only what a changed line can affect: that line against its
+# product's rules and, when it is in a discounted category, that category's lines.
+
+KINDS = ("percent", "price", "bundle")
+
+RULE_COLUMNS = ("id, name, kind, product_name, category, value, min_qty, "
+                "starts_at, ends_at, daily_from, daily_to")
+
+# Changes with every insert, edit or delete (see migrations.promotions)
+SIGNATURE_SQL = "SELECT COUNT(*), COALESCE(MAX(id), 0), TOTAL(version) FROM promotions"
+
+
+def _parse_time(text, end=False):
+    if not text:
+        return None
+    when = datetime.fromisoformat(str(text).strip())
+    if end and len(str(text).strip()) == 10:
+        when += timedelta(days=1)
+    return when
+
+
+def _parse_clock(text):
+    # 'HH:MM' -> minutes since midnight
+    if not text:
+        return None
+    hours, _, minutes = str(text).strip().partition(":")
+    hours, minutes = int(hours), int(minutes or 0)
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise ValueError(f"Invalid time of day: {text}")
+    return hours * 60 + minutes
+
+
+class Rule:
+    __slots__ = ("id", "name", "kind", "product_name", "category", "value", "min_qty",
+                 "starts", "ends", "daily_from", "daily_to")
+
+    def __init__(self, id, name, kind, product_name, category, value, min_qty=1,
+                 starts_at=None, ends_at=None, daily_from=None, daily_to=None):
+        if kind not in KINDS:
+            raise ValueError(f"Unknown promotion kind {kind!r} (expected one of {', '.join(KINDS)})")
+        if (product_name is None) == (category is None):
+            raise ValueError("A promotion targets either a product or a category")
+        if value is None or value < 0 or (kind == "percent" and value > 100):
+            raise ValueError(f"Invalid {kind} value: {value}")
+        if not isinstance(min_qty, int) or min_qty < 1:
+            raise ValueError(f"Invalid minimum quantity: {min_qty}")
+        self.id = id
+        self.name = name
+        self.kind = kind
+        self.product_name = product_name
+        self.category = category
+        # Hundredths of a percent for percent rules, paisa for the others
+        self.value = round(value * 100) if kind == "percent" else to_paisa(value)
+        self.min_qty = min_qty
+        self.starts = _parse_time(starts_at)
+        self.ends = _parse_time(ends_at, end=True)
+        self.daily_from = _parse_clock(daily_from)
+        self.daily_to = _parse_clock(daily_to)
+        if (self.daily_from is None) != (self.daily_to is None) or (
+                self.daily_from is not None and self.daily_from == self.daily_to):
+            raise ValueError("Daily hours need both a start and an end time, and they must differ")
+
+    def runs_at(self, now):
+        if self.starts and now < self.starts:
+            return False
+        if self.ends and now >= self.ends:
+            return False
+        if self.daily_from is None:
+            return True
+        minute = now.hour * 60 + now.minute
+        if self.daily_from < self.daily_to:
+            return self.daily_from <= minute < self.daily_to
+        return minute >= self.daily_from or minute < self.daily_to
+
+    def next_change(self, now):
+        # Earliest time after `now` at which runs_at may change (None: never)
+        changes = [at for at in (self.starts, self.ends) if at and at > now]
+        if self.daily_from is not None:
+            for minute in (self.daily_from, self.daily_to):
+                at = now.replace(hour=minute // 60, minute=minute % 60, second=0, microsecond=0)
+                changes.append(at if at > now else at + timedelta(days=1))
+        return min(changes, default=None)
+
+    def discounts(self, lines):
+        # Paisa off each of `lines` (all of this rule's target on the bill, dearest first)
+        units = sum(line.quantity for line in lines)
+        if units < self.min_qty:
+            return [0] * len(lines)
+        if self.kind == "percent":
+            return [(line.unit_price * line.quantity * self.value + 5000) // 10000 for line in lines]
+        if self.kind == "price":
+            return [max(0, line.unit_price - self.value) * line.quantity for line in lines]
+        bundles = units // self.min_qty
+        left = bundles * self.min_qty
+        bundled = []
+        for line in lines:
+            take = min(line.quantity, left)
+            bundled.append(take * line.unit_price)
+            left -= take
+        regular = sum(bundled)
+        saving = regular - bundles * self.value
+        if saving <= 0:
+            return [0] * len(lines)
+        # Split across the bundled lines by value, to the paisa
+        shares = [saving * amount // regular for amount in bundled]
+        short = saving - sum(shares)
+        for i, amount in enumerate(bundled):
+            if not short:
+                break
+            if amount:
+                shares[i] += 1
+                short -= 1
+        return shares
+
+
+def _dearest_first(line):
+    return -line.unit_price, line.name
+
+
+class PromotionIndex:
+    # Active promotions compiled for lookups by product name and by category
+    def __init__(self, rules=(), signature=None):
+        self.rules = list(rules)
+        self.signature = signature
+        self.by_product = {}
+        self.by_category = {}
+        for rule in self.rules:
+            if rule.product_name is not None:
+                self.by_product.setdefault(rule.product_name, []).append(rule)
+            else:
+                self.by_category.setdefault(rule.category, []).append(rule)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def running(self, now):
+        # (rules by product, rules by category) that run at `now`, and when that can next
+        # change (None: not until the rules are edited)
+        until = None
+        for rule in self.rules:
+            change = rule.next_change(now)
+            if change and (until is None or change < until):
+                until = change
+        by_product = {name: running for name, rules in self.by_product.items()
+                      if (running := [rule for rule in rules if rule.runs_at(now)])}
+        by_category = {category: running for category, rules in self.by_category.items()
+                       if (running := [rule for rule in rules if rule.runs_at(now)])}
+        return by_product, by_category, until
+
+
+class BasketPricer:
+    # Keeps the discounts of one bill's lines current as lines are added, changed and
+    # removed. Lines are bill.BillLine values (name, category, unit_price in paisa,
+    # quantity); the pricer sets their discount (paisa) and promotion (Rule or None) and
+    # keeps `discount`, the bill's total discount. Each call returns the lines whose
+    # discount changed. The clock is read once per call; only when it passes the next
+    # start or end of a rule is the whole bill re-priced.
+    def __init__(self, index=None, clock=datetime.now):
+        self.index = index or PromotionIndex()
+        self.clock = clock
+        self.lines = {}          # line -> None, in the order they were added
+        self.groups = {}         # category -> {line: None} sharing its category rules
+        self.discount = 0
+        self.by_product = {}
+        self.by_category = {}
+        self.until = None
+        self.loaded = False
+
+    def set_index(self, index):
+        # New rules (promotions edited): the next call re-prices the bill
+        if index is not self.index:
+            self.index = index
+            self.loaded = False
+
+    def _current(self):
+        # False when the running rules have changed since the last call
+        now = self.clock()
+        if self.loaded and (self.until is None or now < self.until):
+            return True
+        self.by_product, self.by_category, self.until = self.index.running(now)
+        self.loaded = True
+        return False
+
+    def update(self, line):
+        # `line` was added or its quantity changed
+        self.lines[line] = None
+        if not self._current():
+            return self.reprice()
+        changed = []
+        if not self._price_own(line, changed):
+            group = self.groups.get(line.category)
+            if group is not None and line in group:
+                del group[line]
+                self._price_group(line.category, changed)
+            return changed
+        self._price_group(line.category, changed)
+        return changed
+
+    def remove(self, line):
+        del self.lines[line]
+        self.discount -= line.discount
+        line.discount, line.promotion = 0, None
+        if not self._current():
+            return self.reprice()
+        changed = []
+        group = self.groups.get(line.category)
+        if group is not None and line in group:
+            del group[line]
+            self._price_group(line.category, changed)
+        return changed
+
+    def refresh(self):
+        # Re-prices the bill if the running rules changed since the last call (a rule
+        # started or ended, or set_index); returns the lines whose discount changed
+        return [] if self._current() else self.reprice()
+
+    def reprice(self, lines=None):
+        # Every line from scratch; `lines` replaces the bill's lines (checkout prices a whole
+        # basket this way, one pass per category instead of one per line)
+        if lines is not None:
+            self.lines = dict.fromkeys(lines)
+            self.discount = sum(line.discount for line in self.lines)
+        if not self.loaded:
+            self._current()
+        self.groups = {}
+        changed = []
+        for line in self.lines:
+            self._price_own(line, changed)
+        for category in self.groups:
+            self._price_group(category, changed)
+        return changed
+
+    def clear(self):
+        self.lines = {}
+        self.groups = {}
+        self.discount = 0
+
+    def _price_own(self, line, changed):
+        # Prices `line` with its product's rules. When none of them discounts it and its
+        # category has running rules, the line joins that category's group instead and
+        # True is returned: _price_group then prices it.
+        best, best_rule = 0, None
+        for rule in self.by_product.get(line.name, ()):
+            saving = rule.discounts((line,))[0]
+            if saving > best:
+                best, best_rule = saving, rule
+        if best_rule is None and line.category in self.by_category:
+            self.groups.setdefault(line.category, {})[line] = None
+            return True
+        self._set(line, best, best_rule, changed)
+        return False
+
+    def _price_group(self, category, changed):
+        lines = sorted(self.groups[category], key=_dearest_first)
+        best, best_shares, best_rule = 0, None, None
+        for rule in self.by_category[category]:
+            shares = rule.discounts(lines)
+            saving = sum(shares)
+            if saving > best:
+                best, best_shares, best_rule = saving, shares, rule
+        for i, line in enumerate(lines):
+            share = best_shares[i] if best_shares else 0
+            self._set(line, share, best_rule if share else None, changed)
+
+    def _set(self, line, discount, rule, changed):
+        if line.discount != discount or line.promotion is not rule:
+            self.discount += discount - line.discount
+            line.discount, line.promotion = discount, rule
+            changed.append(line)
+
+
+class Promotions:
+    # The promotions table, and a compiled index of its active rules that is reloaded when
+    # the table changes (detected with one aggregate query)
+    def __init__(self, conn, reader=None):
+        self.conn = conn
+        self.reader = reader or (lambda: conn)
+        self._index = None
+
+    def index(self):
+        # Signature first: an edit that lands in between is picked up by the next call
+        conn = self.reader()
+        signature = conn.execute(SIGNATURE_SQL).fetchone()
+        index = self._index
+        if index is None or index.signature != signature:
+            rows = conn.execute(f"SELECT {RULE_COLUMNS} FROM promotions WHERE active = 1").fetchall()
+            index = self._index = PromotionIndex([Rule(*row) for row in rows], signature)
+        return index
+
+    def add(self, name, kind, value, product_name=None, category=None, min_qty=1,
+            starts_at=None, ends_at=None, daily_from=None, daily_to=None):
+        row = (name, kind, product_name, category, value, min_qty, starts_at, ends_at, daily_from, daily_to)
+        try:
+            Rule(None, *row)
+            cursor = self.conn.execute(
+                "INSERT INTO promotions (name, kind, product_name, category, value, min_qty, "
+                "starts_at, ends_at, daily_from, daily_to) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                row
+            )
+            self.conn.commit()
+        except (ValueError, sqlite3.Error) as e:
+            self.conn.rollback()
+            return f" Error adding promotion: {e}"
+        return f" Promotion #{cursor.lastrowid} '{name}' added"
+
+    def set_active(self, promotion_id, active=True):
+        cursor = self.conn.execute("UPDATE promotions SET active = ? WHERE id = ?", (int(active), promotion_id))
+        if cursor.rowcount == 0:
+            return f" Promotion #{promotion_id} not found!"
+        self.conn.commit()
+        return f" Promotion #{promotion_id} {'enabled' if active else 'disabled'}"
+
+    def delete(self, promotion_id):
+        cursor = self.conn.execute("DELETE FROM promotions WHERE id = ?", (promotion_id,))
+        if cursor.rowcount == 0:
+            return f" Promotion #{promotion_id} not found!"
+        self.conn.commit()
+        return f" Promotion #{promotion_id} deleted"
+
+    def get_all_promotions(self):
+        # (id, name, kind, product or category, value, min qty, from, to, hours, active)
+        return self.reader().execute(
+            "SELECT id, name, kind, COALESCE(product_name, 'category:' || category), value, min_qty, "
+            "starts_at, ends_at, daily_from || '-' || daily_to, active FROM promotions ORDER BY id"
+        ).fetchall()
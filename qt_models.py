@@ -0,0 +1,276 @@
+from PyQt5.QtCore import Qt, QAbstractListModel, QAbstractTableModel, QModelIndex, pyqtSignal
+from bill import format_money
+
+
+class ProductCompleterModel(QAbstractListModel):
+    # Names matching the text typed so far, fetched from ProductSearch a page at a time.
+    # Product edits patch single rows instead of reloading the catalog.
+    def __init__(self, search, page_size=20, parent=None):
+        super().__init__(parent)
+        self.search = search
+        self.page_size = page_size
+        self.query = ""
+        self.names = []
+        self.exhausted = True
+
+    def set_query(self, text):
+        self.beginResetModel()
+        self.query = text.strip()
+        self.names = self.search.names(self.query, self.page_size) if self.query else []
+        self.exhausted = len(self.names) < self.page_size
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.names)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if index.isValid() and role in (Qt.DisplayRole, Qt.EditRole):
+            return self.names[index.row()]
+        return None
+
+    # Deliberately not canFetchMore/fetchMore: QCompleter's proxy drains those eagerly
+    # after every reset, which would pull every match. The popup asks for the next page
+    # when it is scrolled to the bottom instead.
+    def fetch_more(self):
+        if self.exhausted:
+            return
+        wanted = len(self.names) + self.page_size
+        known = set(self.names)
+        more = [name for name in self.search.names(self.query, wanted) if name not in known]
+        self.exhausted = len(self.names) + len(more) < wanted
+        if more:
+            self.beginInsertRows(QModelIndex(), len(self.names), len(self.names) + len(more) - 1)
+            self.names.extend(more)
+            self.endInsertRows()
+
+    def _matches(self, name):
+        return bool(self.query) and self.query.lower() in name.lower()
+
+    def product_added(self, name):
+        if self._matches(name) and name not in self.names:
+            row = len(self.names)
+            self.beginInsertRows(QModelIndex(), row, row)
+            self.names.append(name)
+            self.endInsertRows()
+
+    def product_removed(self, name):
+        if name in self.names:
+            row = self.names.index(name)
+            self.beginRemoveRows(QModelIndex(), row, row)
+            del self.names[row]
+            self.endRemoveRows()
+
+
+class PagedTableModel(QAbstractTableModel):
+    # Rows loaded a page at a time as the view scrolls. fetch_page(limit=, after=, **filters)
+    # returns (rows, next_cursor), rows starting with their id (not shown), next_cursor None
+    # on the last page. With a TaskRunner, pages are fetched on its "read" lane and
+    # appended when they arrive.
+    HEADERS = []
+
+    def __init__(self, fetch_page, page_size=200, runner=None, parent=None):
+        super().__init__(parent)
+        self.fetch_page = fetch_page
+        self.page_size = page_size
+        self.runner = runner
+        self.filters = {}
+        self.rows = []
+        self.next_cursor = None
+        self.exhausted = False
+        self.loading = False
+        self.generation = 0
+
+    def set_filters(self, **filters):
+        self.beginResetModel()
+        self.filters = filters
+        self.rows = []
+        self.next_cursor = None
+        self.exhausted = False
+        self.loading = False
+        # Pages still in flight for the old filters are dropped when they arrive
+        self.generation += 1
+        self.endResetModel()
+        self.fetchMore()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        return str(self.rows[index.row()][index.column() + 1])
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted and not self.loading
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self.exhausted or self.loading:
+            return
+        args = dict(self.filters, limit=self.page_size, after=self.next_cursor)
+        if self.runner is None:
+            self._page_loaded(self.generation, self.fetch_page(**args))
+            return
+        self.loading = True
+        generation = self.generation
+        self.runner.submit("read", self.fetch_page, **args,
+                           on_done=lambda page: self._page_loaded(generation, page),
+                           on_error=lambda error: self._page_failed(generation, error))
+
+    def _page_failed(self, generation, error):
+        if generation == self.generation:
+            self.loading = False
+        print(f"Error loading {type(self).__name__} page: {error}")
+
+    def _page_loaded(self, generation, page):
+        if generation != self.generation:
+            return
+        rows, self.next_cursor = page
+        self.loading = False
+        self.exhausted = self.next_cursor is None
+        if rows:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(rows) - 1)
+            self.rows.extend(rows)
+            self.endInsertRows()
+
+
+class SalesHistoryModel(PagedTableModel):
+    # SaleManager.get_sales_page rows, (id, sale_time, product_name, quantity, total), newest first
+    HEADERS = ["Date", "Product", "Qty", "Total (Rs.)"]
+
+    def set_filters(self, start=None, end=None, product=None):
+        super().set_filters(start=start, end=end, product=product or None)
+
+
+class ProductTableModel(PagedTableModel):
+    # Inventory.get_products_page rows, (id, name, price, stock, barcode), by name
+    HEADERS = ["Name", "Price (Rs.)", "Stock", "Barcode"]
+
+
+class BillTableModel(QAbstractTableModel):
+    # Table view over a Bill. The Bill owns the numbers; this only translates its O(1)
+    # edits into row signals. Quantities are editable in place; DELETE_COLUMN is clicked
+    # to remove a line. A change can move other lines' promotion discounts (Bill.repriced);
+    # only those rows are repainted.
+    HEADERS = ["Product", "Qty", "Price", "Discount", "Total", "Barcode", "Delete"]
+    QTY_COLUMN = 1
+    DISCOUNT_COLUMN = 3
+    TOTAL_COLUMN = 4
+    DELETE_COLUMN = 6
+
+    totalChanged = pyqtSignal(int)
+    quantityRejected = pyqtSignal(str)
+
+    def __init__(self, bill, parent=None):
+        super().__init__(parent)
+        self.bill = bill
+        # Optional callable(line, new_quantity) -> error message or None
+        self.quantity_validator = None
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.bill)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.EditRole):
+            return None
+        line = self.bill.line(index.row())
+        column = index.column()
+        if column == 0:
+            return line.name
+        if column == 1:
+            return line.quantity if role == Qt.EditRole else str(line.quantity)
+        if column == 2:
+            return format_money(line.unit_price)
+        if column == self.DISCOUNT_COLUMN:
+            return f"-{format_money(line.discount)}" if line.discount else ""
+        if column == self.TOTAL_COLUMN:
+            return format_money(line.total - line.discount)
+        if column == 5:
+            return line.barcode or ""
+        return "🗑️"
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+        return None
+
+    def flags(self, index):
+        flags = super().flags(index)
+        if index.isValid() and index.column() == self.QTY_COLUMN:
+            flags |= Qt.ItemIsEditable
+        return flags
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if not index.isValid() or index.column() != self.QTY_COLUMN or role != Qt.EditRole:
+            return False
+        try:
+            quantity = int(value)
+        except (TypeError, ValueError):
+            return False
+        line = self.bill.line(index.row())
+        if quantity <= 0 or quantity == line.quantity:
+            return False
+        error = self.quantity_validator(line, quantity) if self.quantity_validator else None
+        if error:
+            self.quantityRejected.emit(error)
+            return False
+        self.set_quantity(index.row(), quantity)
+        return True
+
+    def set_quantity(self, row, quantity):
+        # Without the validator, e.g. to put back an edit the shared service refused
+        self.bill.set_quantity(row, quantity)
+        self._line_changed(row)
+
+    def add(self, product_id, name, price, quantity, barcode=None, category=None):
+        row = self.bill.row_of(product_id)
+        if row is not None:
+            self.bill.add(product_id, name, price, quantity, barcode, category)
+            self._line_changed(row)
+            return
+        row = len(self.bill)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.bill.add(product_id, name, price, quantity, barcode, category)
+        self.endInsertRows()
+        self._repriced()
+        self.totalChanged.emit(self.bill.total)
+
+    def remove(self, row):
+        line = self.bill.line(row)
+        self.beginRemoveRows(QModelIndex(), row, row)
+        self.bill.remove(row)
+        self.endRemoveRows()
+        self._repriced()
+        self.totalChanged.emit(self.bill.total)
+        return line
+
+    def reprice(self, index=None):
+        # Before checkout: promotions edited, started or ended since the last scan
+        if self.bill.reprice(index):
+            self._repriced()
+            self.totalChanged.emit(self.bill.total)
+
+    def clear(self):
+        self.beginResetModel()
+        self.bill.clear()
+        self.endResetModel()
+        self.totalChanged.emit(self.bill.total)
+
+    def _line_changed(self, row):
+        self.dataChanged.emit(self.index(row, self.QTY_COLUMN), self.index(row, self.TOTAL_COLUMN))
+        self._repriced()
+        self.totalChanged.emit(self.bill.total)
+
+    def _repriced(self):
+        for row in self.bill.repriced:
+            self.dataChanged.emit(self.index(row, self.DISCOUNT_COLUMN), self.index(row, self.TOTAL_COLUMN))
@@ -0,0 +1,270 @@
+import os
+import queue
+import shutil
+import subprocess
+import socket
+import threading
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from datetime import datetime
+
+
+# A completed bill as the receipt shows it. lines: [(product_name, quantity, price, total)]
+# before discounts; discounts: [(promotion name, amount)] taken off the total
+Receipt = namedtuple("Receipt", "lines bill_id when discounts", defaults=((),))
+
+# ESC/POS commands (Epson and compatible thermal printers)
+ESC_INIT = b"\x1b@"            # reset to defaults
+ESC_CODEPAGE = b"\x1bt\x00"    # PC437, what `encoding` below produces
+ESC_ALIGN_LEFT = b"\x1ba\x00"
+ESC_ALIGN_CENTER = b"\x1ba\x01"
+ESC_BOLD_ON = b"\x1bE\x01"
+ESC_BOLD_OFF = b"\x1bE\x00"
+ESC_DOUBLE_SIZE = b"\x1d!\x11"
+ESC_NORMAL_SIZE = b"\x1d!\x00"
+ESC_FEED_CUT = b"\x1dVB\x03"   # feed 3 lines, then partial cut
+
+
+class ReceiptTemplate:
+    # The one receipt layout, as plain text (receipt.txt, Qt printing) or ESC/POS bytes for
+    # thermal printers. Everything that doesn't change between bills - rules, headings,
+    # footer, the item-line format and their ESC/POS encodings - is built once here, so
+    # rendering a bill is one format call per line and a join.
+    def __init__(self, shop_name="K&B MART", cashier="Admin", width=32, encoding="cp437"):
+        # width 32 fits 58mm paper and the default font of 80mm printers
+        self.width = width
+        self.encoding = encoding
+        rule = "=" * width
+        name_width = width - 18
+        self.line_format = f"{{:<{name_width}.{name_width}}}{{:>3}} {{:>6.2f}}{{:>8.2f}}\n".format
+        self.total_format = f"{{:<{width - 10}}}{{:>10.2f}}\n".format
+        self.discount_format = f"{{:<{width - 10}.{width - 11}}}{{:>10.2f}}\n".format
+        self.cashier_line = f"Cashier: {cashier}\n"
+        self.columns = f"{rule}\n{'Item':<{name_width}}{'Qty':>3} {'Price':>6}{'Total':>8}\n{rule}\n"
+        self.rule = f"{rule}\n"
+        self.footer = f"{rule}\nThank you!\nVisit again.\n{rule}\n"
+
+        self.text_header = f"{rule}\n{shop_name[:width].center(width)}\n{rule}\n"
+        self.escpos_header = (ESC_ALIGN_CENTER + ESC_DOUBLE_SIZE + self._encode(shop_name[:width // 2]) + b"\n"
+                              + ESC_NORMAL_SIZE + ESC_ALIGN_LEFT + self._encode(self.rule))
+        self.escpos_columns = self._encode(self.columns)
+        self.escpos_footer = self._encode(self.footer) + ESC_FEED_CUT
+
+    def _encode(self, text):
+        # Characters the printer's code page lacks (emoji, ...) print as "?"
+        return text.encode(self.encoding, "replace")
+
+    def _details(self, receipt):
+        when = receipt.when or datetime.now()
+        details = f"Date: {when:%d/%m/%Y %H:%M}\n"
+        if receipt.bill_id is not None:
+            details += f"Bill #: {receipt.bill_id}\n"
+        return details + self.cashier_line
+
+    def _body(self, receipt):
+        # (item lines, subtotal and savings lines - empty without discounts -, total line)
+        line = self.line_format
+        items = "".join([line(name, quantity, price, total) for name, quantity, price, total in receipt.lines])
+        total = sum(total for _, _, _, total in receipt.lines)
+        if not receipt.discounts:
+            return items, "", self.total_format("TOTAL AMOUNT", total)
+        savings = self.total_format("SUBTOTAL", total) + "".join(
+            [self.discount_format(name, -amount) for name, amount in receipt.discounts]
+        )
+        return items, savings, self.total_format("TOTAL AMOUNT", total - sum(a for _, a in receipt.discounts))
+
+    def render(self, receipt):
+        items, savings, total = self._body(receipt)
+        return "".join((self.text_header, self._details(receipt), self.columns, items, self.rule, savings, total,
+                        self.footer, "\n"))
+
+    def render_escpos(self, receipt):
+        # One receipt, ending in a cut; printer setup (ESC_INIT) is the sink's job
+        items, savings, total = self._body(receipt)
+        return b"".join((self.escpos_header,
+                         self._encode(self._details(receipt) + self.columns + items + self.rule + savings),
+                         ESC_BOLD_ON, self._encode(total), ESC_BOLD_OFF, self.escpos_footer))
+
+
+DEFAULT_TEMPLATE = ReceiptTemplate()
+
+
+def format_receipt(lines, bill_id=None, when=None, template=DEFAULT_TEMPLATE):
+    # lines: iterable of (product_name, quantity, price, total)
+    return template.render(Receipt(list(lines), bill_id, when))
+
+
+class ReceiptSink(ABC):
+    # Receives Receipt values on the spooler (or print) thread and renders them itself
+    @abstractmethod
+    def emit(self, receipt):
+        pass
+
+    def close(self):
+        pass
+
+
+class NullReceiptSink(ReceiptSink):
+    # Headless runs (tests, servers, cron jobs) that must not touch disk or printers
+    def emit(self, receipt):
+        pass
+
+
+class FileReceiptSink(ReceiptSink):
+    def __init__(self, filename="receipt.txt", template=None):
+        self.filename = filename
+        self.template = template or DEFAULT_TEMPLATE
+
+    def emit(self, receipt):
+        with open(self.filename, "w") as f:
+            f.write(self.template.render(receipt))
+
+
+class PrinterReceiptSink(FileReceiptSink):
+    # Writes the receipt file and hands it to the OS print spooler
+    def emit(self, receipt):
+        super().emit(receipt)
+        if hasattr(os, "startfile"):
+            os.startfile(self.filename, "print")
+        elif shutil.which("lp"):
+            subprocess.run(["lp", self.filename], check=False,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+class EscPosSink(ReceiptSink):
+    # Raw ESC/POS straight to a thermal printer, no print system or rasterising involved.
+    # The connection is opened, and the printer reset to the template's code page, once;
+    # every receipt after that is a single write. A failed write reopens it once.
+    def __init__(self, template=None):
+        self.template = template or DEFAULT_TEMPLATE
+        self.out = None
+
+    @abstractmethod
+    def _open(self):
+        pass
+
+    @abstractmethod
+    def _write(self, data):
+        pass
+
+    def emit(self, receipt):
+        data = self.template.render_escpos(receipt)
+        for retry in (False, True):
+            try:
+                if self.out is None:
+                    self.out = self._open()
+                    self._write(ESC_INIT + ESC_CODEPAGE)
+                self._write(data)
+                return
+            except OSError:
+                self.close()
+                if retry:
+                    raise
+
+    def close(self):
+        if self.out is not None:
+            try:
+                self.out.close()
+            except OSError:
+                pass
+            self.out = None
+
+
+class DeviceReceiptSink(EscPosSink):
+    # A printer device node (/dev/usb/lp0, a serial port, \\.\COM3) or an ordinary file
+    def __init__(self, path, template=None):
+        super().__init__(template)
+        self.path = path
+
+    def _open(self):
+        return open(self.path, "ab", buffering=0)
+
+    def _write(self, data):
+        self.out.write(data)
+
+
+class NetworkReceiptSink(EscPosSink):
+    # Network thermal printers take raw ESC/POS on TCP port 9100
+    def __init__(self, host, port=9100, timeout=5, template=None):
+        super().__init__(template)
+        self.address = (host, port)
+        self.timeout = timeout
+
+    def _open(self):
+        return socket.create_connection(self.address, self.timeout)
+
+    def _write(self, data):
+        self.out.sendall(data)
+
+
+class LoopbackReceiptSink(EscPosSink):
+    # Keeps the exact byte stream a printer would have received (tests, previews)
+    def __init__(self, template=None):
+        super().__init__(template)
+        self.stream = bytearray()
+        self.receipts = 0
+
+    def _open(self):
+        return self.stream
+
+    def _write(self, data):
+        self.stream += data
+
+    def emit(self, receipt):
+        super().emit(receipt)
+        self.receipts += 1
+
+    def close(self):
+        # Nothing to release; the stream stays readable
+        pass
+
+
+def escpos_sink(spec, template=None):
+    # "tcp:HOST[:PORT]", "loopback", or a device/file path
+    if spec == "loopback":
+        return LoopbackReceiptSink(template)
+    if spec.startswith("tcp:"):
+        host, _, port = spec[4:].partition(":")
+        return NetworkReceiptSink(host, int(port or 9100), template=template)
+    return DeviceReceiptSink(spec, template)
+
+
+def default_receipt_sink():
+    if hasattr(os, "startfile") or shutil.which("lp"):
+        return PrinterReceiptSink()
+    return FileReceiptSink()
+
+
+class ReceiptSpooler:
+    _STOP = object()
+
+    def __init__(self, sink=None, maxsize=64):
+        self.sink = sink or default_receipt_sink()
+        self.queue = queue.Queue(maxsize)
+        self.thread = threading.Thread(target=self._run, name="receipt-spooler", daemon=True)
+        self.thread.start()
+
+    def submit(self, receipt):
+        # Blocks only when `maxsize` receipts are already waiting on the sink
+        self.queue.put(receipt)
+
+    def flush(self):
+        self.queue.join()
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(self._STOP)
+            self.thread.join()
+        self.sink.close()
+
+    def _run(self):
+        while True:
+            receipt = self.queue.get()
+            try:
+                if receipt is self._STOP:
+                    return
+                self.sink.emit(receipt)
+            except Exception as e:
+                print(f"Error printing receipt: {e}")
+            finally:
+                self.queue.task_done()
@@ -0,0 +1,200 @@
+import argparse
+import csv
+import html
+import os
+import sqlite3
+import sys
+from datetime import datetime
+
+# Report name -> (title, column headers). Rows come from report_query().
+REPORTS = {
+    "products": ("All Products Report", ("Name", "Price (Rs.)", "Stock", "Barcode")),
+    "sales": ("Sales Report", ("Date", "Product", "Qty", "Price (Rs.)", "Total (Rs.)")),
+}
+
+FORMATS = {".csv": "csv", ".html": "html", ".htm": "html", ".pdf": "pdf"}
+
+HTML_STYLE = ("table {border-collapse: collapse; width: 100%;} th, td {border: 1px solid #444; padding: 8px; "
+              "text-align: left;} th {background-color: #28a745; color: white;} "
+              "tr:nth-child(even) {background-color: #f2f2f2;}")
+
+
+def report_query(report, start=None, end=None, product=None):
+    # Returns (sql, params); start/end are inclusive 'YYYY-MM-DD' dates (sales only)
+    if report == "products":
+        return "SELECT name, price, stock, COALESCE(barcode, '') FROM products ORDER BY name", []
+    if report != "sales":
+        raise ValueError(f"Unknown report: {report}")
+    clauses = []
+    params = []
+    if start:
+        clauses.append("sale_time >= ?")
+        params.append(str(start))
+    if end:
+        clauses.append("sale_time < date(?, '+1 day')")
+        params.append(str(end))
+    if product:
+        clauses.append("product_name = ?")
+        params.append(product)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    return (f"SELECT sale_time, product_name, quantity, price, total FROM sales {where} "
+            "ORDER BY sale_time, id"), params
+
+
+def iter_chunks(conn, sql, params=(), chunk_size=1000):
+    # Lists of at most chunk_size rows, straight off the cursor
+    cursor = conn.execute(sql, params)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield rows
+
+
+def write_csv(path, title, columns, chunks, progress=None):
+    count = 0
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for rows in chunks:
+            writer.writerows(rows)
+            count += len(rows)
+            if progress:
+                progress(count)
+    return count
+
+
+def write_html(path, title, columns, chunks, progress=None):
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(f"<html><head><meta charset='utf-8'><title>{html.escape(title)}</title>"
+                f"<style>{HTML_STYLE}</style></head><body><h2>{html.escape(title)}</h2><table><tr>")
+        f.write("".join(f"<th>{html.escape(c)}</th>" for c in columns))
+        f.write("</tr>\n")
+        for rows in chunks:
+            f.write("".join(
+                "<tr>" + "".join(f"<td>{html.escape(str(v))}</td>" for v in row) + "</tr>\n"
+                for row in rows
+            ))
+            count += len(rows)
+            if progress:
+                progress(count)
+        f.write("</table></body></html>\n")
+    return count
+
+
+def write_pdf(path, title, columns, chunks, progress=None):
+    # Painted page by page onto a QPrinter in PDF mode, so only the current page is ever
+    # laid out (a QTextDocument would lay out the whole report first). Qt is imported
+    # here so CSV/HTML exports work without it.
+    from PyQt5.QtGui import QGuiApplication, QPainter, QFont, QFontMetrics
+    from PyQt5.QtPrintSupport import QPrinter
+
+    app = None
+    if QGuiApplication.instance() is None:
+        os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+        app = QGuiApplication(sys.argv[:1])
+
+    printer = QPrinter(QPrinter.HighResolution)
+    printer.setOutputFormat(QPrinter.PdfFormat)
+    printer.setOutputFileName(path)
+    printer.setPageSize(QPrinter.A4)
+    painter = QPainter()
+    if not painter.begin(printer):
+        raise OSError(f"Cannot write PDF to {path}")
+
+    count = 0
+    try:
+        page = printer.pageRect()
+        font = QFont("Helvetica", 8)
+        bold = QFont("Helvetica", 8, QFont.Bold)
+        painter.setFont(font)
+        line_height = int(QFontMetrics(font, printer).height() * 1.4)
+        widths = [page.width() // len(columns)] * len(columns)
+        # First column (name / date) gets the spare room
+        widths[0] += page.width() - sum(widths)
+        page_number = 1
+
+        def header():
+            y = line_height
+            painter.setFont(bold)
+            painter.drawText(0, y, f"{title} - page {page_number}")
+            y += line_height * 2
+            x = 0
+            for column, width in zip(columns, widths):
+                painter.drawText(x, y, column)
+                x += width
+            painter.setFont(font)
+            return y + line_height
+
+        y = header()
+        for rows in chunks:
+            for row in rows:
+                if y > page.height() - line_height:
+                    printer.newPage()
+                    page_number += 1
+                    y = header()
+                x = 0
+                for value, width in zip(row, widths):
+                    painter.drawText(x, y, str(value))
+                    x += width
+                y += line_height
+            count += len(rows)
+            if progress:
+                progress(count)
+    finally:
+        painter.end()
+        del app
+    return count
+
+
+WRITERS = {"csv": write_csv, "html": write_html, "pdf": write_pdf}
+
+
+def export_report(conn, report, path, fmt=None, chunk_size=1000, progress=None,
+                  start=None, end=None, product=None):
+    # Streams the report to `path`; the format comes from the extension unless given.
+    # Returns the number of rows written.
+    fmt = fmt or FORMATS.get(os.path.splitext(path)[1].lower())
+    if fmt not in WRITERS:
+        raise ValueError(f"Unsupported report format: {fmt or os.path.splitext(path)[1]}")
+    title, columns = REPORTS[report]
+    sql, params = report_query(report, start, end, product)
+    return WRITERS[fmt](path, title, columns, iter_chunks(conn, sql, params, chunk_size), progress)
+
+
+def open_readonly(db_name):
+    # Nightly exports read a snapshot without taking write locks on the live database
+    return sqlite3.connect(f"file:{db_name}?mode=ro", uri=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export POS reports (CSV, HTML or PDF)")
+    parser.add_argument("report", choices=sorted(REPORTS))
+    parser.add_argument("output", nargs="?",
+                        help="file to write; the extension picks the format "
+                             "(default: <report>-<date>.csv)")
+    parser.add_argument("--db", default="shop.db")
+    parser.add_argument("--format", choices=sorted(WRITERS))
+    parser.add_argument("--from", dest="start", help="first sale date, YYYY-MM-DD (sales only)")
+    parser.add_argument("--to", dest="end", help="last sale date, YYYY-MM-DD (sales only)")
+    parser.add_argument("--product", help="only sales of this product")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    output = args.output or f"{args.report}-{datetime.now():%Y-%m-%d}.{args.format or 'csv'}"
+    conn = open_readonly(args.db)
+    try:
+        count = export_report(conn, args.report, output, args.format, args.chunk_size,
+                              start=args.start, end=args.end, product=args.product)
+    except (sqlite3.Error, ValueError, OSError) as e:
+        print(f"Error exporting {args.report} report: {e}", file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+    print(f"Wrote {count} rows to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+import sqlite3
+
+SYNC_TRIGGERS = ("products_fts_ai", "products_fts_ad", "products_fts_au")
+
+
+def _escape_like(text):
+    # Typed % and _ are matched literally, not as LIKE wildcards
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class ProductSearch:
+    # Product name search backed by a NOCASE name index and an FTS5 trigram index.
+    # Triggers keep the index in sync with every insert/rename/delete, whoever writes.
+    # SQLite builds without FTS5 fall back to a LIMITed LIKE scan.
+    def __init__(self, conn, reader=None):
+        # reader: callable returning the connection searches run on
+        self.conn = conn
+        self.reader = reader or (lambda: conn)
+        self.fts = self._setup()
+
+    def _setup(self):
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='products_fts'")
+            existed = cursor.fetchone() is not None
+            cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+                name, content='products', content_rowid='id', tokenize='trigram'
+            )
+            """)
+        except sqlite3.OperationalError:
+            return False
+
+        # Missing triggers mean a bulk load was interrupted while sync was suspended
+        cursor.execute(
+            f"SELECT COUNT(*) FROM sqlite_master WHERE type='trigger' AND name IN ({', '.join('?' * len(SYNC_TRIGGERS))})",
+            SYNC_TRIGGERS
+        )
+        in_sync = existed and cursor.fetchone()[0] == len(SYNC_TRIGGERS)
+
+        cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+            INSERT INTO products_fts(rowid, name) VALUES (new.id, new.name);
+        END
+        """)
+        cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+            INSERT INTO products_fts(products_fts, rowid, name) VALUES ('delete', old.id, old.name);
+        END
+        """)
+        cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name ON products BEGIN
+            INSERT INTO products_fts(products_fts, rowid, name) VALUES ('delete', old.id, old.name);
+            INSERT INTO products_fts(rowid, name) VALUES (new.id, new.name);
+        END
+        """)
+        if not in_sync:
+            cursor.execute("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+        self.conn.commit()
+        return True
+
+    def suspend_sync(self):
+        # For bulk loads: indexing row by row costs several times a one-pass rebuild.
+        # resume_sync() puts the triggers back and rebuilds the index.
+        if not self.fts:
+            return
+        for name in SYNC_TRIGGERS:
+            self.conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        self.conn.commit()
+
+    def resume_sync(self):
+        if self.fts:
+            self._setup()
+
+    def search(self, text, limit=20):
+        # Returns up to `limit` (name, price, stock, barcode) rows: names starting with
+        # `text` first (alphabetical), then names containing it. Both legs stop after
+        # `limit` hits, so cost does not grow with the number of matching products.
+        text = text.strip()
+        if not text:
+            return []
+        rows = self.reader().execute(
+            "SELECT name, price, stock, COALESCE(barcode, '') FROM products "
+            "WHERE name >= ? COLLATE NOCASE AND name < ? COLLATE NOCASE "
+            "ORDER BY name COLLATE NOCASE LIMIT ?",
+            (text, text + chr(0x10FFFF), limit)
+        ).fetchall()
+        if len(rows) >= limit:
+            return rows
+
+        seen = {row[0] for row in rows}
+        # Trigram MATCH needs at least three characters; shorter input is cheap to scan
+        # because LIMIT stops at the first few hits.
+        if not self.fts or len(text) < 3:
+            more = self.reader().execute(
+                "SELECT name, price, stock, COALESCE(barcode, '') FROM products "
+                "WHERE name LIKE ? ESCAPE '\\' LIMIT ?",
+                (f"%{_escape_like(text)}%", limit + len(seen))
+            )
+        else:
+            more = self.reader().execute(
+                "SELECT p.name, p.price, p.stock, COALESCE(p.barcode, '') "
+                "FROM products_fts JOIN products p ON p.id = products_fts.rowid "
+                "WHERE products_fts MATCH ? LIMIT ?",
+                ('"' + text.replace('"', '""') + '"', limit + len(seen))
+            )
+        for row in more:
+            if row[0] not in seen:
+                rows.append(row)
+                if len(rows) == limit:
+                    break
+        return rows
+
+    def names(self, text, limit=20):
+        return [row[0] for row in self.search(text, limit)]
@@ -0,0 +1,381 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from database import Inventory, SaleManager, ProductCatalog
+from receipts import NullReceiptSink
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+
+class InventoryService:
+    # Shared inventory for several tills. Scans are answered from the in-memory catalog;
+    # stock a till has scanned is held for it until checkout, so the units one till is
+    # selling cannot be sold by another. All reservation bookkeeping runs on the event
+    # loop thread, which makes each reserve/release atomic without locks. Database writes
+    # go to a single worker thread so the loop keeps serving scans while a sale commits.
+    def __init__(self, inventory, sales, catalog, reservation_ttl=900):
+        self.inv = inventory
+        self.sales = sales
+        self.catalog = catalog
+        self.reservation_ttl = reservation_ttl
+        self.held = {}       # till -> {product name: quantity}
+        self.reserved = {}   # product name -> quantity held by all tills
+        self.last_seen = {}  # till -> time of last request
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inventory-writer")
+
+    def _product(self, entry):
+        return {
+            "id": entry.id,
+            "name": entry.name,
+            "price": entry.price,
+            "stock": entry.stock,
+            "barcode": entry.barcode,
+            "category": entry.category,
+            "available": entry.stock - self.reserved.get(entry.name, 0),
+        }
+
+    def lookup(self, code):
+        entry = self.catalog.lookup(code)
+        if not entry:
+            raise LookupError("Product not found!")
+        return {"product": self._product(entry)}
+
+    def search(self, text, limit=20):
+        return {"names": self.inv.search.names(text, limit)}
+
+    def reserve(self, till, code, quantity):
+        # Sets the quantity of a product held for `till` (0 releases it)
+        entry = self.catalog.lookup(code)
+        if not entry:
+            raise LookupError("Product not found!")
+        if not isinstance(quantity, int) or quantity < 0:
+            raise ValueError(f"Invalid quantity: {quantity}")
+        held = self.held.setdefault(till, {})
+        current = held.get(entry.name, 0)
+        available = entry.stock - self.reserved.get(entry.name, 0) + current
+        if quantity > available:
+            raise ValueError(f"Not enough stock! Available: {available}")
+        self._hold(till, entry.name, quantity - current)
+        return {"product": self._product(entry), "held": quantity}
+
+    def _hold(self, till, name, delta):
+        held = self.held.setdefault(till, {})
+        held[name] = held.get(name, 0) + delta
+        self.reserved[name] = self.reserved.get(name, 0) + delta
+        if held[name] == 0:
+            del held[name]
+        if self.reserved[name] == 0:
+            del self.reserved[name]
+
+    def cancel(self, till):
+        for name, quantity in list(self.held.get(till, {}).items()):
+            self._hold(till, name, -quantity)
+        self.held.pop(till, None)
+        return {}
+
+    async def checkout(self, till):
+        held = dict(self.held.get(till, {}))
+        if not held:
+            raise ValueError("No items in bill!")
+        loop = asyncio.get_running_loop()
+        # The held units stay reserved while the sale commits, then are released
+        bill_id, message = await loop.run_in_executor(
+            self.writer, self.sales.checkout, [(name, None, qty) for name, qty in held.items()]
+        )
+        if bill_id is None:
+            raise ValueError(message.strip())
+        self.cancel(till)
+        return {"bill_id": bill_id, "message": message}
+
+    async def refresh(self, name):
+        # A product was changed directly in the database (e.g. from a till's admin dialog)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.writer, self.catalog.refresh, name)
+        return {}
+
+    async def reload(self):
+        # Many products changed at once (bulk import)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.writer, self.catalog.reload)
+        return {}
+
+    def expire_idle(self, now=None):
+        now = now or time.monotonic()
+        for till, seen in list(self.last_seen.items()):
+            if now - seen > self.reservation_ttl:
+                self.cancel(till)
+                del self.last_seen[till]
+
+    async def handle(self, request):
+        op = request.get("op")
+        till = request.get("till")
+        if till is not None:
+            self.last_seen[till] = time.monotonic()
+        if op == "ping":
+            return {}
+        if op == "lookup":
+            return self.lookup(request["code"])
+        if op == "search":
+            return self.search(request["text"], request.get("limit", 20))
+        if op == "reserve":
+            return self.reserve(till, request["code"], request["quantity"])
+        if op == "cancel":
+            return self.cancel(till)
+        if op == "checkout":
+            return await self.checkout(till)
+        if op == "refresh":
+            return await self.refresh(request["name"])
+        if op == "reload":
+            return await self.reload()
+        raise ValueError(f"Unknown operation: {op}")
+
+    async def serve_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    response = await self.handle(request)
+                    response["ok"] = True
+                except (LookupError, ValueError, KeyError, TypeError) as e:
+                    response = {"ok": False, "error": str(e)}
+                writer.write((json.dumps(response) + "\n").encode())
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _expiry_loop(self):
+        while True:
+            await asyncio.sleep(min(60, self.reservation_ttl))
+            self.expire_idle()
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, started=None):
+        server = await asyncio.start_server(self.serve_client, host, port)
+        expiry = asyncio.create_task(self._expiry_loop())
+        if started:
+            started(server.sockets[0].getsockname()[1])
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            expiry.cancel()
+            self.writer.shutdown(wait=True)
+
+
+def open_service(db_name="shop.db"):
+    inv = Inventory(db_name)
+    catalog = ProductCatalog(inv)
+    sales = SaleManager(inv.conn, receipt_sink=NullReceiptSink(), catalog=catalog, reader=inv.db.reader,
+                        promotions=inv.promotions)
+    return InventoryService(inv, sales, catalog)
+
+
+class ServiceError(Exception):
+    pass
+
+
+class TillClient:
+    # Blocking client for one till; one request in flight at a time. Every failure is a
+    # ServiceError; after a network one the socket is dropped and the next call reconnects
+    # (the service keys reservations by till name, so they survive the reconnect).
+    # Lets callers catch service errors without importing this module up front
+    Error = ServiceError
+
+    def __init__(self, till, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=10):
+        self.till = till
+        self.address = (host, port)
+        self.timeout = timeout
+        self.sock = self.stream = None
+        self._connect()
+
+    def _connect(self):
+        try:
+            self.sock = socket.create_connection(self.address, timeout=self.timeout)
+        except OSError as e:
+            raise ServiceError(f"Inventory service unreachable: {e}") from e
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.stream = self.sock.makefile("rwb")
+
+    def call(self, op, **params):
+        params.update(op=op, till=self.till)
+        if self.stream is None:
+            self._connect()
+        try:
+            self.stream.write((json.dumps(params) + "\n").encode())
+            self.stream.flush()
+            line = self.stream.readline()
+            if not line:
+                raise ConnectionError("connection closed")
+            response = json.loads(line)
+        except (OSError, ValueError) as e:
+            # Includes timeouts and a garbled reply: the stream may be mid-response
+            self.close()
+            raise ServiceError(f"Inventory service unavailable: {e}") from e
+        if not response.pop("ok"):
+            raise ServiceError(response["error"])
+        return response
+
+    def lookup(self, code):
+        return self.call("lookup", code=code)["product"]
+
+    def search(self, text, limit=20):
+        return self.call("search", text=text, limit=limit)["names"]
+
+    def reserve(self, code, quantity):
+        return self.call("reserve", code=code, quantity=quantity)["product"]
+
+    def cancel(self):
+        self.call("cancel")
+
+    def checkout(self):
+        response = self.call("checkout")
+        return response["bill_id"], response["message"]
+
+    def refresh(self, name):
+        self.call("refresh", name=name)
+
+    def reload(self):
+        self.call("reload")
+
+    def close(self):
+        if self.stream is not None:
+            try:
+                self.stream.close()
+            except OSError:
+                pass
+            self.sock.close()
+        self.sock = self.stream = None
+
+
+def start_in_thread(service, host=DEFAULT_HOST, port=0):
+    # Runs the service on a background event loop; returns (stop, port)
+    loop = asyncio.new_event_loop()
+    ready = threading.Event()
+    bound = []
+
+    def started(actual_port):
+        bound.append(actual_port)
+        ready.set()
+
+    task = loop.create_task(service.serve(host, port, started))
+
+    def run():
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            loop.close()
+
+    thread = threading.Thread(target=run, name="inventory-service", daemon=True)
+    thread.start()
+    ready.wait()
+
+    def stop():
+        loop.call_soon_threadsafe(task.cancel)
+        thread.join()
+
+    return stop, bound[0]
+
+
+def simulate(tills=4, baskets=50, products=200, stock=20, workdir=None):
+    # Several tills racing for a small stock of each product on one shared service
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        service = open_service(os.path.join(tmp, "shop.db"))
+        service.inv.conn.executemany(
+            "INSERT INTO products (name, price, stock, barcode) VALUES (?, ?, ?, ?)",
+            ((f"Product {i}", 10.0, stock, f"{1000 + i}") for i in range(products))
+        )
+        service.inv.conn.commit()
+        service.catalog.reload()
+        stop, port = start_in_thread(service)
+
+        latencies = []
+        stats = {"sold": 0, "refused": 0, "bills": 0}
+        lock = threading.Lock()
+
+        def till(number):
+            client = TillClient(f"till-{number}", port=port)
+            rng = random.Random(number)
+            for _ in range(baskets):
+                basket = {}
+                for _ in range(rng.randint(1, 8)):
+                    code = f"{1000 + rng.randrange(products)}"
+                    quantity = basket.get(code, 0) + rng.randint(1, 3)
+                    started = time.perf_counter()
+                    try:
+                        client.reserve(code, quantity)
+                        basket[code] = quantity
+                    except ServiceError:
+                        with lock:
+                            stats["refused"] += 1
+                    with lock:
+                        latencies.append(time.perf_counter() - started)
+                if basket:
+                    client.checkout()
+                    with lock:
+                        stats["sold"] += sum(basket.values())
+                        stats["bills"] += 1
+            client.close()
+
+        threads = [threading.Thread(target=till, args=(n,)) for n in range(tills)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        remaining, negative = service.inv.conn.execute(
+            "SELECT SUM(stock), SUM(stock < 0) FROM products"
+        ).fetchone()
+        stop()
+        service.sales.close()
+        service.inv.close()
+        latencies.sort()
+        return dict(
+            stats,
+            tills=tills,
+            oversold_products=negative,
+            stock_consistent=remaining == products * stock - stats["sold"],
+            scan_p50_ms=round(latencies[len(latencies) // 2] * 1000, 3),
+            scan_p99_ms=round(latencies[int(len(latencies) * 0.99)] * 1000, 3),
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shared inventory service for several tills")
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve = sub.add_parser("serve", help="run the service")
+    serve.add_argument("--db", default="shop.db")
+    serve.add_argument("--host", default=DEFAULT_HOST)
+    serve.add_argument("--port", type=int, default=DEFAULT_PORT)
+    sim = sub.add_parser("simulate", help="race simulated tills against a scratch database")
+    sim.add_argument("--tills", type=int, default=4)
+    sim.add_argument("--baskets", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        service = open_service(args.db)
+        print(f"Inventory service listening on {args.host}:{args.port}")
+        try:
+            asyncio.run(service.serve(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+    else:
+        print(json.dumps(simulate(args.tills, args.baskets), indent=2))
+
+
+if __name__ == "__main__":
+    main()
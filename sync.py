@@ -0,0 +1,483 @@
+import argparse
+import glob
+import gzip
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import migrations
+from connection import ConnectionManager
+
+# Consolidates branch shop databases into one central database.
+#
+# Each shop exports delta batches: what changed since a cursor of three sequence numbers,
+# (change_seq, sale_id, movement_id):
+#   change_log.seq       - product inserts/edits/deletes and sales deletes (migrations.change_log)
+#   sales.id             - new sales, shipped as rows
+#   stock_movements.id   - products whose stock moved; the current stock is shipped
+# A product edited ten times since the last sync travels once, as its current row.
+#
+# The central database keeps, per branch, the cursor it has merged up to, so batches can
+# travel as files (offline) or be pulled straight from a reachable shop database, and a
+# batch that arrives twice is skipped.
+#
+# Conflict rules
+#   price - "latest": the most recent edit wins across branches (by change time); an edit
+#           older than the central price is not applied, nor one made before the branch
+#           logged changes (no time to compare). "central": head office owns prices,
+#           branch edits are never applied. Either way, every disagreement goes to
+#           sync_conflicts for review.
+#   stock - stock is per branch and only that branch writes it, so branch_stock keeps each
+#           branch's latest value (by movement id; stale batches never roll it back) and
+#           stock_totals sums the branches. Negative stock (a till selling past zero) is
+#           kept but logged as a conflict.
+
+PRICE_RULES = ("latest", "central")
+BATCH_SALES = 50000
+
+
+class SyncError(Exception):
+    pass
+
+
+# -------------------------------
+# Shop side
+# -------------------------------
+def export_batch(conn, branch, since=None, max_sales=BATCH_SALES):
+    # Everything that changed after `since` ((change_seq, sale_id, movement_id), None for a
+    # full snapshot), read in one snapshot. Returns the batch as a JSON-ready dict.
+    conn.execute("BEGIN")
+    try:
+        change_to = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()[0]
+        movement_to = conn.execute("SELECT COALESCE(MAX(id), 0) FROM stock_movements").fetchone()[0]
+        change_from, sale_from, movement_from = since or (0, 0, 0)
+        sales = conn.execute(
+            "SELECT id, product_name, quantity, price, total, sale_time, bill_id FROM sales "
+            "WHERE id > ? ORDER BY id LIMIT ?",
+            (sale_from, max_sales)
+        ).fetchall()
+        sale_to = sales[-1][0] if sales else sale_from
+
+        deleted_sales = []
+        deleted_products = []
+        if since is None:
+            # [name, price, barcode, old name, old price, changed at]; the change time is the
+            # row's last logged edit, None if it predates change capture
+            products = [[name, price, barcode, None, None, changed_at] for name, price, barcode, changed_at in
+                        conn.execute(
+                            "SELECT name, price, barcode, edits.changed_at FROM products LEFT JOIN "
+                            "(SELECT row_id, MAX(changed_at) AS changed_at FROM change_log "
+                            " WHERE table_name = 'products' GROUP BY row_id) AS edits ON edits.row_id = products.id"
+                        ).fetchall()]
+            stock = conn.execute("SELECT name, COALESCE(stock, 0) FROM products").fetchall()
+        else:
+            products = []
+            first = {}
+            last_at = {}
+            for table, row_id, op, old_name, old_price, changed_at in conn.execute(
+                "SELECT table_name, row_id, op, old_name, old_price, changed_at FROM change_log "
+                "WHERE seq > ? AND seq <= ? ORDER BY seq",
+                (change_from, change_to)
+            ):
+                if table == "sales":
+                    # Only sales already shipped need deleting centrally
+                    if row_id <= sale_from:
+                        deleted_sales.append(row_id)
+                    continue
+                first.setdefault(row_id, (op, old_name, old_price))
+                last_at[row_id] = changed_at
+            for row_id, (op, old_name, old_price) in first.items():
+                row = conn.execute("SELECT name, price, barcode FROM products WHERE id = ?", (row_id,)).fetchone()
+                if row is None:
+                    # Created and deleted since the last sync: nothing to send
+                    if op != "insert":
+                        deleted_products.append(old_name)
+                    continue
+                products.append(list(row) + [old_name, old_price, last_at[row_id]])
+            stock = conn.execute(
+                "SELECT name, COALESCE(stock, 0) FROM products WHERE id IN "
+                "(SELECT product_id FROM stock_movements WHERE id > ? AND id <= ?)",
+                (movement_from, movement_to)
+            ).fetchall()
+    finally:
+        conn.rollback()
+
+    return {
+        "branch": branch,
+        "since": list(since) if since is not None else None,
+        "to": [change_to, sale_to, movement_to],
+        "products": products,
+        "deleted_products": deleted_products,
+        "stock": [list(row) for row in stock],
+        "sales": [list(row) for row in sales],
+        "deleted_sales": deleted_sales,
+    }
+
+
+def is_empty(batch):
+    return batch["since"] == batch["to"] and not any(
+        batch[key] for key in ("products", "deleted_products", "stock", "sales", "deleted_sales")
+    )
+
+
+def write_batch(batch, path):
+    # gzip'd JSON; written aside and renamed, so a half-written file is never picked up
+    tmp = f"{path}.tmp"
+    with gzip.open(tmp, "wt", encoding="utf-8") as f:
+        json.dump(batch, f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def read_batch(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def export_batches(conn, branch, outbox, max_sales=BATCH_SALES):
+    # Offline mode: writes the changes since this shop's last export to numbered batch
+    # files in `outbox` (<branch>-<n>.json.gz) and returns their paths. Re-export from the
+    # central database's cursor (reset_export) if files get lost.
+    os.makedirs(outbox, exist_ok=True)
+    paths = []
+    while True:
+        row = conn.execute(
+            "SELECT change_seq, sale_id, movement_id, batches FROM sync_state WHERE branch = ?", (branch,)
+        ).fetchone()
+        since, number = (row[:3], row[3]) if row else (None, 0)
+        batch = export_batch(conn, branch, since, max_sales)
+        if is_empty(batch):
+            return paths
+        number += 1
+        batch["number"] = number
+        path = os.path.join(outbox, f"{branch}-{number:06d}.json.gz")
+        write_batch(batch, path)
+        conn.execute(
+            "INSERT INTO sync_state (branch, change_seq, sale_id, movement_id, batches) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(branch) DO UPDATE SET change_seq = excluded.change_seq, sale_id = excluded.sale_id, "
+            "movement_id = excluded.movement_id, batches = excluded.batches",
+            (branch, *batch["to"], number)
+        )
+        conn.commit()
+        paths.append(path)
+        if len(batch["sales"]) < max_sales:
+            return paths
+
+
+def reset_export(conn, branch, cursor):
+    # Next export starts from `cursor` (CentralLedger.cursor(branch); None: full snapshot)
+    if cursor is None:
+        conn.execute("DELETE FROM sync_state WHERE branch = ?", (branch,))
+    else:
+        conn.execute(
+            "INSERT INTO sync_state (branch, change_seq, sale_id, movement_id, batches) VALUES (?, ?, ?, ?, 0) "
+            "ON CONFLICT(branch) DO UPDATE SET change_seq = excluded.change_seq, sale_id = excluded.sale_id, "
+            "movement_id = excluded.movement_id",
+            (branch, *cursor)
+        )
+    conn.commit()
+
+
+def prune_change_log(conn, upto):
+    # Log rows every consumer has merged are no longer needed
+    conn.execute("DELETE FROM change_log WHERE seq <= ?", (upto,))
+    conn.commit()
+
+
+# -------------------------------
+# Central side
+# -------------------------------
+class CentralLedger:
+    def __init__(self, db_name="central.db", price_rule="latest"):
+        if price_rule not in PRICE_RULES:
+            raise ValueError(f"price_rule must be one of {PRICE_RULES}, got {price_rule!r}")
+        self.price_rule = price_rule
+        self.db = ConnectionManager(db_name)
+        self.conn = self.db.conn
+        self._setup()
+
+    def _setup(self):
+        cursor = self.conn.cursor()
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS branches(
+            name TEXT PRIMARY KEY,
+            change_seq INTEGER NOT NULL,
+            sale_id INTEGER NOT NULL,
+            movement_id INTEGER NOT NULL,
+            batches INTEGER NOT NULL DEFAULT 0,
+            synced_at TIMESTAMP
+        )
+        """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS products(
+            name TEXT PRIMARY KEY,
+            price REAL,
+            barcode TEXT,
+            price_changed_at TIMESTAMP,
+            price_branch TEXT
+        )
+        """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS branch_stock(
+            branch TEXT NOT NULL,
+            product_name TEXT NOT NULL,
+            stock INTEGER NOT NULL,
+            movement_id INTEGER NOT NULL,
+            PRIMARY KEY (branch, product_name)
+        ) WITHOUT ROWID
+        """)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sales(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            branch TEXT NOT NULL,
+            branch_sale_id INTEGER NOT NULL,
+            product_name TEXT,
+            quantity INTEGER,
+            price REAL,
+            total REAL,
+            sale_time TIMESTAMP,
+            bill_id INTEGER,
+            UNIQUE (branch, branch_sale_id)
+        )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_sales_sale_time ON sales(sale_time)")
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sync_conflicts(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            branch TEXT NOT NULL,
+            product_name TEXT,
+            field TEXT NOT NULL,
+            branch_value TEXT,
+            central_value TEXT,
+            resolution TEXT NOT NULL,
+            logged_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+        cursor.execute("""
+        CREATE VIEW IF NOT EXISTS stock_totals AS
+        SELECT product_name, SUM(stock) AS stock, COUNT(*) AS branches
+        FROM branch_stock GROUP BY product_name
+        """)
+        self.conn.commit()
+
+    def cursor(self, branch):
+        row = self.conn.execute(
+            "SELECT change_seq, sale_id, movement_id FROM branches WHERE name = ?", (branch,)
+        ).fetchone()
+        return tuple(row) if row else None
+
+    def _conflict(self, cursor, branch, name, field, branch_value, central_value, resolution):
+        cursor.execute(
+            "INSERT INTO sync_conflicts (branch, product_name, field, branch_value, central_value, resolution) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (branch, name, field, branch_value, central_value, resolution)
+        )
+
+    def apply(self, batch):
+        # Merges one batch in one transaction. Returns False when it was already merged;
+        # raises SyncError when batches are missing in between.
+        branch = batch["branch"]
+        cursor = self.conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            stored = self.cursor(branch)
+            since = tuple(batch["since"]) if batch["since"] is not None else None
+            if since != stored:
+                if stored is not None and all(to <= have for to, have in zip(batch["to"], stored)):
+                    self.conn.rollback()
+                    return False
+            # A full snapshot (since None) can always be merged; it resyncs the branch
+            if since is not None and since != stored:
+                raise SyncError(f"Batch from {branch} starts at {since} but central is at {stored}; "
+                                "export again from the central cursor")
+            self._apply_products(cursor, branch, batch)
+            self._apply_stock(cursor, branch, batch)
+            cursor.executemany(
+                "INSERT OR IGNORE INTO sales (branch, branch_sale_id, product_name, quantity, price, total, "
+                "sale_time, bill_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(branch, *row) for row in batch["sales"]]
+            )
+            cursor.executemany("DELETE FROM sales WHERE branch = ? AND branch_sale_id = ?",
+                               [(branch, sale_id) for sale_id in batch["deleted_sales"]])
+            cursor.execute(
+                "INSERT INTO branches (name, change_seq, sale_id, movement_id, batches, synced_at) "
+                "VALUES (?, ?, ?, ?, 1, CURRENT_TIMESTAMP) "
+                "ON CONFLICT(name) DO UPDATE SET change_seq = excluded.change_seq, sale_id = excluded.sale_id, "
+                "movement_id = excluded.movement_id, batches = batches + 1, synced_at = excluded.synced_at",
+                (branch, *batch["to"])
+            )
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return True
+
+    def _apply_products(self, cursor, branch, batch):
+        for name, price, barcode, old_name, old_price, changed_at in batch["products"]:
+            if old_name and old_name != name:
+                # Renamed at the branch: its stock moves to the new name; other branches may
+                # still sell under the old one, so the central product stays
+                cursor.execute("UPDATE OR REPLACE branch_stock SET product_name = ? "
+                               "WHERE branch = ? AND product_name = ?", (name, branch, old_name))
+
+            row = cursor.execute("SELECT price, price_changed_at FROM products WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                cursor.execute(
+                    "INSERT INTO products (name, price, barcode, price_changed_at, price_branch) VALUES (?, ?, ?, ?, ?)",
+                    (name, price, barcode, changed_at, branch)
+                )
+                continue
+            cursor.execute("UPDATE products SET barcode = COALESCE(?, barcode) WHERE name = ?", (barcode, name))
+            central_price, central_at = row
+            if price == central_price:
+                continue
+            if self.price_rule == "central":
+                self._conflict(cursor, branch, name, "price", price, central_price, "kept central price")
+            elif changed_at is None:
+                # Last edited before the branch logged changes: no time to compare, so review it
+                self._conflict(cursor, branch, name, "price", price, central_price,
+                               "kept central price, branch edit time unknown")
+            elif central_at is not None and changed_at < central_at:
+                self._conflict(cursor, branch, name, "price", price, central_price, "kept newer central price")
+            else:
+                if old_price is not None and old_price != central_price:
+                    # Edited here from a price another branch had since changed
+                    self._conflict(cursor, branch, name, "price", price, central_price, "branch edit is newer")
+                cursor.execute(
+                    "UPDATE products SET price = ?, price_changed_at = ?, price_branch = ? WHERE name = ?",
+                    (price, changed_at, branch, name)
+                )
+
+        cursor.executemany("DELETE FROM branch_stock WHERE branch = ? AND product_name = ?",
+                           [(branch, name) for name in batch["deleted_products"]])
+
+    def _apply_stock(self, cursor, branch, batch):
+        movement_id = batch["to"][2]
+        for name, stock in batch["stock"]:
+            cursor.execute(
+                "INSERT INTO branch_stock (branch, product_name, stock, movement_id) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(branch, product_name) DO UPDATE SET stock = excluded.stock, "
+                "movement_id = excluded.movement_id WHERE excluded.movement_id >= branch_stock.movement_id",
+                (branch, name, stock, movement_id)
+            )
+            if stock < 0:
+                self._conflict(cursor, branch, name, "stock", stock, None, "negative stock kept, recount needed")
+            if cursor.execute("SELECT 1 FROM products WHERE name = ?", (name,)).fetchone() is None:
+                cursor.execute("INSERT INTO products (name) VALUES (?)", (name,))
+
+    def apply_files(self, paths):
+        # Batches in name order (per branch that is export order); returns (applied, skipped)
+        applied = skipped = 0
+        for path in sorted(paths):
+            if self.apply(read_batch(path)):
+                applied += 1
+            else:
+                skipped += 1
+        return applied, skipped
+
+    def branches(self):
+        return self.conn.execute(
+            "SELECT name, change_seq, sale_id, movement_id, batches, synced_at FROM branches ORDER BY name"
+        ).fetchall()
+
+    def close(self):
+        self.db.close()
+
+
+def pull(central, shop_db, branch, max_sales=BATCH_SALES):
+    # Online mode: reads the deltas straight from a reachable shop database, starting at the
+    # central cursor, and prunes the shop's change log once merged. Returns batches merged.
+    shop = ConnectionManager(shop_db)
+    try:
+        migrations.migrate(shop.conn)
+        count = 0
+        while True:
+            batch = export_batch(shop.conn, branch, central.cursor(branch), max_sales)
+            if is_empty(batch):
+                break
+            central.apply(batch)
+            count += 1
+        cursor = central.cursor(branch)
+        if cursor:
+            # Another consumer (file export) may still need rows past its own cursor
+            row = shop.conn.execute("SELECT MIN(change_seq) FROM sync_state").fetchone()
+            prune_change_log(shop.conn, cursor[0] if row[0] is None else min(cursor[0], row[0]))
+        return count
+    finally:
+        shop.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Consolidate branch shop databases into a central database")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("export", help="write this shop's changes since its last export to batch files")
+    p.add_argument("--db", default="shop.db")
+    p.add_argument("--branch", required=True)
+    p.add_argument("--outbox", default="outbox")
+    p.add_argument("--central", help="restart from what this central database has merged (after a gap)")
+
+    p = sub.add_parser("apply", help="merge batch files into the central database")
+    p.add_argument("files", nargs="+", help="batch files or directories of them")
+    p.add_argument("--central", default="central.db")
+    p.add_argument("--price-rule", choices=PRICE_RULES, default="latest")
+
+    p = sub.add_parser("pull", help="merge branches straight from their database files")
+    p.add_argument("shops", nargs="+", metavar="BRANCH=PATH")
+    p.add_argument("--central", default="central.db")
+    p.add_argument("--price-rule", choices=PRICE_RULES, default="latest")
+
+    p = sub.add_parser("status", help="per-branch sync cursors and recent conflicts")
+    p.add_argument("--central", default="central.db")
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "export":
+            shop = ConnectionManager(args.db)
+            try:
+                migrations.migrate(shop.conn)
+                if args.central:
+                    central = CentralLedger(args.central)
+                    try:
+                        reset_export(shop.conn, args.branch, central.cursor(args.branch))
+                    finally:
+                        central.close()
+                paths = export_batches(shop.conn, args.branch, args.outbox)
+            finally:
+                shop.close()
+            print(f"Wrote {len(paths)} batch file(s)" + "".join(f"\n  {path}" for path in paths))
+            return 0
+
+        central = CentralLedger(args.central, getattr(args, "price_rule", "latest"))
+        try:
+            if args.command == "apply":
+                paths = []
+                for item in args.files:
+                    paths += glob.glob(os.path.join(item, "*.json.gz")) if os.path.isdir(item) else [item]
+                applied, skipped = central.apply_files(paths)
+                print(f"Merged {applied} batch(es), skipped {skipped} already merged")
+            elif args.command == "pull":
+                for spec in args.shops:
+                    branch, _, path = spec.partition("=")
+                    started = time.perf_counter()
+                    count = pull(central, path, branch)
+                    print(f"{branch}: {count} batch(es) in {time.perf_counter() - started:.2f}s")
+            else:
+                for row in central.branches():
+                    print("\t".join(str(value) for value in row))
+                for row in central.conn.execute(
+                    "SELECT logged_at, branch, product_name, field, branch_value, central_value, resolution "
+                    "FROM sync_conflicts ORDER BY id DESC LIMIT 20"
+                ):
+                    print("conflict\t" + "\t".join("" if value is None else str(value) for value in row))
+        finally:
+            central.close()
+    except (SyncError, sqlite3.Error, OSError, ValueError) as e:
+        print(f"Sync failed: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,16 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def shop_db(tmp_path):
+    # A private copy of the baseline shop database (schema version 0); tests never touch shop.db
+    path = tmp_path / "shop.db"
+    shutil.copy(os.path.join(ROOT, "shop.db"), path)
+    return str(path)
@@ -0,0 +1,133 @@
+import json
+
+import pytest
+
+from database import Inventory, SaleManager, ProductCatalog
+from journal import SalesJournal, JournalError
+from receipts import NullReceiptSink
+
+
+@pytest.fixture
+def inv(shop_db):
+    inventory = Inventory(shop_db)
+    yield inventory
+    inventory.close()
+
+
+@pytest.fixture
+def journal_path(tmp_path):
+    return str(tmp_path / "sales.journal")
+
+
+def open_till(inv, journal_path, **settings):
+    journal = SalesJournal(journal_path, inv.db.db_name, **settings)
+    journal.retry_interval = 0.01
+    catalog = ProductCatalog(inv)
+    sales = SaleManager(inv.conn, NullReceiptSink(), catalog=catalog, reader=inv.db.reader, journal=journal)
+    return journal, catalog, sales
+
+
+def close_till(journal, sales):
+    sales.close()
+    journal.close()
+
+
+def stock(inv, name):
+    return inv.conn.execute("SELECT stock FROM products WHERE name = ?", (name,)).fetchone()[0]
+
+
+def test_replays_unapplied_entries_after_crash(inv, journal_path):
+    # What a till killed before its applier ran leaves behind: durable entries (one from
+    # before promotions, with 4-item lines) and a torn last line that was never acknowledged
+    entries = [
+        {"seq": 1, "bill": 501, "time": "2025-10-11 10:00:00", "total": 40.0, "lines": [[6, "Book", 2, 20.0]]},
+        {"seq": 2, "bill": 502, "time": "2025-10-11 10:01:00", "total": 76.0,
+         "lines": [[6, "Book", 1, 20.0, 4.0, None], [1, "Juice", 1, 40.0, 0, None]]},
+    ]
+    with open(journal_path, "w") as f:
+        for entry in entries:
+            f.write(json.dumps(entry) + "\n")
+        f.write('{"seq": 3, "bill": 503, "tot')
+    book, juice = stock(inv, "Book"), stock(inv, "Juice")
+
+    journal, _, sales = open_till(inv, journal_path)
+    assert journal.replayed == 2
+    assert sales.wait_recorded(5)
+    close_till(journal, sales)
+
+    assert inv.conn.execute("SELECT id, total FROM bills ORDER BY id").fetchall() == [(501, 40.0), (502, 76.0)]
+    assert inv.conn.execute("SELECT bill_id, product_name, quantity, total, discount FROM sales "
+                            "WHERE bill_id IS NOT NULL ORDER BY id").fetchall() == [
+        (501, "Book", 2, 40.0, 0.0), (502, "Book", 1, 16.0, 4.0), (502, "Juice", 1, 40.0, 0.0)
+    ]
+    assert (stock(inv, "Book"), stock(inv, "Juice")) == (book - 3, juice - 1)
+
+    # Applied exactly once: opening again replays nothing, and new bills carry on after them
+    journal, _, sales = open_till(inv, journal_path)
+    assert journal.replayed == 0
+    bill_id, _ = sales.checkout([("Book", None, 1)])
+    assert sales.wait_recorded(5)
+    close_till(journal, sales)
+    assert bill_id > 502
+    assert stock(inv, "Book") == book - 4
+
+
+def test_bill_ids_stay_unique_with_a_second_writer(inv, shop_db, journal_path):
+    journal, _, sales = open_till(inv, journal_path, id_block=3)
+    other = Inventory(shop_db)
+    direct = SaleManager(other.conn, NullReceiptSink())
+    try:
+        ids = []
+        for _ in range(5):
+            ids.append(sales.checkout([("Book", None, 1)])[0])
+            ids.append(direct.checkout([("Juice", None, 1)])[0])
+        assert None not in ids and len(set(ids)) == len(ids)
+        assert sales.wait_recorded(5)
+        assert inv.conn.execute("SELECT COUNT(*) FROM bills").fetchone()[0] == len(ids)
+    finally:
+        direct.close()
+        other.close()
+        close_till(journal, sales)
+
+    # A reopened journal reserves past every bill written so far
+    journal, _, sales = open_till(inv, journal_path)
+    try:
+        assert sales.checkout([("Book", None, 1)])[0] > max(ids)
+    finally:
+        close_till(journal, sales)
+
+
+def test_entry_the_database_refuses_stops_the_journal(inv, journal_path):
+    journal, _, sales = open_till(inv, journal_path)
+    try:
+        # Another writer took the id the journal reserved next (e.g. restored from a backup)
+        inv.conn.execute("INSERT INTO bills (id, total) VALUES (?, 0)", (journal.bill_id + 1,))
+        inv.conn.commit()
+        bill_id, _ = sales.checkout([("Book", None, 1)])
+        assert bill_id is not None
+        with pytest.raises(JournalError):
+            sales.wait_recorded(5)
+        bill_id, message = sales.checkout([("Book", None, 1)])
+        assert bill_id is None and "cannot be applied" in message
+    finally:
+        close_till(journal, sales)
+
+
+def test_catalog_edits_keep_journaled_stock(inv, journal_path):
+    journal, catalog, sales = open_till(inv, journal_path)
+    try:
+        # The applier can't write while its connection's lock is held, so products.stock lags
+        with journal.db.write_lock:
+            available = catalog.get(name="Book").stock
+            assert sales.checkout([("Book", None, available)])[0] is not None
+            catalog.update_price("Book", 25.0)
+            catalog.set_category("Book", "Stationery")
+            assert stock(inv, "Book") == available
+            assert catalog.get(name="Book").stock == 0
+            assert sales.checkout([("Book", None, 1)])[0] is None
+            catalog.restock("Book", 4)
+            assert catalog.get(name="Book").stock == 4
+        assert sales.wait_recorded(5)
+        assert stock(inv, "Book") == 4
+    finally:
+        close_till(journal, sales)
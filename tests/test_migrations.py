@@ -0,0 +1,81 @@
+import threading
+
+import pytest
+
+import migrations
+from connection import ConnectionManager
+
+
+@pytest.fixture
+def conn(shop_db):
+    db = ConnectionManager(shop_db)
+    yield db.conn
+    db.close()
+
+
+def rollups(conn):
+    # (table rows, the same figures grouped straight from sales), rounded for float sums
+    result = []
+    for table, bucket, width in (("sales_daily", "day", 10), ("sales_hourly", "hour", 13)):
+        kept = conn.execute(
+            f"SELECT {bucket}, product_name, quantity, ROUND(revenue, 2), sale_count FROM {table} "
+            "WHERE sale_count > 0 ORDER BY 1, 2"
+        ).fetchall()
+        grouped = conn.execute(
+            f"SELECT substr(sale_time, 1, {width}), product_name, SUM(quantity), ROUND(SUM(total), 2), COUNT(*) "
+            "FROM sales GROUP BY 1, 2 ORDER BY 1, 2"
+        ).fetchall()
+        result.append((kept, grouped))
+    return result
+
+
+def test_migrates_baseline_and_reruns_as_noop(conn):
+    assert migrations.schema_version(conn) == 0
+    applied = migrations.migrate(conn)
+    assert applied == [step.__name__ for _, step in migrations.MIGRATIONS]
+    assert migrations.schema_version(conn) == migrations.SCHEMA_VERSION
+    assert migrations.pending_backfills(conn) == []
+
+    assert migrations.migrate(conn) == []
+    assert migrations.schema_version(conn) == migrations.SCHEMA_VERSION
+
+
+def test_backfilled_rollups_match_sales(conn):
+    migrations.migrate(conn)
+    for kept, grouped in rollups(conn):
+        assert kept and kept == grouped
+    # The stock ledger opens with each product's stock
+    assert conn.execute(
+        "SELECT COUNT(*) FROM products WHERE COALESCE(stock, 0) <> "
+        "(SELECT COALESCE(SUM(delta), 0) FROM stock_movements WHERE product_id = products.id)"
+    ).fetchone()[0] == 0
+
+
+def test_online_backfill_with_writes_and_resume(conn):
+    last_id = conn.execute("SELECT MAX(id) FROM sales").fetchone()[0]
+    migrations.migrate(conn, backfill=False)
+    assert migrations.pending_backfills(conn) == [("sales_rollups", 0, last_id)]
+
+    # Tills keep selling and deleting while the backfill is pending
+    conn.execute("INSERT INTO sales (product_name, quantity, price, total, sale_time) "
+                 "VALUES ('Book', 2, 20, 40, '2025-10-06 09:30:00')")
+    conn.execute("DELETE FROM sales WHERE id = (SELECT MIN(id) FROM sales)")
+    conn.commit()
+
+    # Stopped after the first batch, e.g. the till closed; the next run picks up from there
+    stop = threading.Event()
+    done = migrations.run_backfills(conn, batch_size=5, stop=stop, pause=0,
+                                    progress=lambda name, end, total: stop.set())
+    assert done is False
+    assert migrations.pending_backfills(conn) == [("sales_rollups", 5, last_id)]
+
+    assert migrations.run_backfills(conn, batch_size=5, pause=0) is True
+    assert migrations.pending_backfills(conn) == []
+    for kept, grouped in rollups(conn):
+        assert kept == grouped
+
+
+def test_newer_schema_is_refused(conn):
+    conn.execute(f"PRAGMA user_version = {migrations.SCHEMA_VERSION + 1}")
+    with pytest.raises(migrations.MigrationError):
+        migrations.migrate(conn)
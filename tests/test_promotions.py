@@ -0,0 +1,138 @@
+import random
+from datetime import datetime, timedelta
+
+import pytest
+
+from bill import Bill, BillLine, to_paisa
+from database import Inventory, SaleManager
+from promotions import BasketPricer, PromotionIndex, Rule
+from receipts import NullReceiptSink
+
+# name -> (price, category)
+PRODUCTS = {
+    "Juice": (40.0, "drinks"),
+    "Cola": (70.0, "drinks"),
+    "Water": (15.5, "drinks"),
+    "Chips": (30.0, "snacks"),
+    "Nuts": (99.99, "snacks"),
+    "Book": (20.0, None),
+    "Pen": (7.25, None),
+}
+
+RULES = [
+    Rule(1, "Juice 10% off", "percent", "Juice", None, 10),
+    Rule(2, "Cola at 60", "price", "Cola", None, 60, min_qty=2),
+    Rule(3, "Drinks 3 for 100", "bundle", None, "drinks", 100, min_qty=3),
+    Rule(4, "Drinks 5% off", "percent", None, "drinks", 5, min_qty=2),
+    Rule(5, "Snacks buy 2 get 1", "bundle", None, "snacks", 0.01, min_qty=3),
+    Rule(6, "Books 2 for 35", "bundle", "Book", None, 35, min_qty=2),
+    Rule(7, "Happy hour pens", "percent", "Pen", None, 50, daily_from="17:00", daily_to="19:00"),
+    Rule(8, "Autumn snacks", "percent", None, "snacks", 20, starts_at="2025-10-01", ends_at="2025-10-31"),
+]
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def full_reprice(bill, index, now):
+    # The same lines priced from scratch by a new pricer: (discount, rule id) per line and the total
+    copies = []
+    for line in bill.lines:
+        copy = BillLine(line.product_id, line.name, line.barcode, line.unit_price, line.quantity, line.category)
+        copies.append(copy)
+    pricer = BasketPricer(index, clock=Clock(now))
+    pricer.reprice(copies)
+    return [(line.discount, line.promotion and line.promotion.id) for line in copies], pricer.discount
+
+
+def priced(bill):
+    return [(line.discount, line.promotion and line.promotion.id) for line in bill.lines]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_incremental_pricing_matches_full_reprice(seed):
+    rng = random.Random(seed)
+    index = PromotionIndex(RULES)
+    clock = Clock(datetime(2025, 10, 30, 16, 50))
+    bill = Bill(BasketPricer(index, clock=clock))
+    ids = {name: i for i, name in enumerate(PRODUCTS)}
+
+    for step in range(60):
+        before = priced(bill)
+        edited = None
+        action = rng.random()
+        if action < 0.5 or not len(bill):
+            name = rng.choice(list(PRODUCTS))
+            price, category = PRODUCTS[name]
+            edited, _ = bill.add(ids[name], name, price, rng.randint(1, 4), category=category)
+        elif action < 0.75:
+            edited = rng.randrange(len(bill))
+            bill.set_quantity(edited, rng.randint(1, 6))
+        elif action < 0.9:
+            removed = rng.randrange(len(bill))
+            bill.remove(removed)
+            del before[removed]
+        else:
+            # Time passes: happy hour starts and ends, the autumn rule ends at midnight
+            clock.now += timedelta(minutes=rng.randint(1, 90))
+            bill.reprice()
+
+        expected, discount = full_reprice(bill, index, clock.now)
+        assert priced(bill) == expected, f"step {step}"
+        assert bill.discount == discount
+        assert bill.subtotal == sum(line.total for line in bill.lines)
+        assert bill.total == bill.subtotal - discount
+        assert bill.rows == {line.product_id: row for row, line in enumerate(bill.lines)}
+        # `repriced` names every other row whose discount moved, so the view redraws just those
+        moved = {row for row, (old, new) in enumerate(zip(before, priced(bill))) if old != new}
+        assert moved - {edited} <= set(bill.repriced), f"step {step}"
+
+
+def test_new_rules_reprice_the_open_bill():
+    clock = Clock(datetime(2025, 10, 30, 12, 0))
+    bill = Bill(BasketPricer(PromotionIndex(), clock=clock))
+    bill.add(1, "Juice", 40.0, 3, category="drinks")
+    assert bill.discount == 0
+    assert bill.reprice(PromotionIndex(RULES))
+    assert bill.repriced == [0]
+    expected, discount = full_reprice(bill, PromotionIndex(RULES), clock.now)
+    assert priced(bill) == expected and bill.discount == discount
+
+
+def test_bundle_saving_splits_to_the_paisa():
+    # 3 for Rs.100 over four units, dearest first: one Water stays at full price
+    lines = [BillLine(i, name, None, to_paisa(PRODUCTS[name][0]), quantity, "drinks")
+             for i, (name, quantity) in enumerate([("Cola", 1), ("Juice", 1), ("Water", 2)])]
+    shares = RULES[2].discounts(lines)
+    assert sum(shares) == 7000 + 4000 + 1550 - 10000
+    assert shares == [1423, 813, 314]
+
+
+def test_checkout_charges_what_the_bill_showed(shop_db):
+    inv = Inventory(shop_db)
+    sales = SaleManager(inv.conn, NullReceiptSink(), promotions=inv.promotions)
+    try:
+        inv.set_category("Juice", "drinks")
+        inv.set_category("Next Cola 300ml", "drinks")
+        inv.promotions.add("Drinks 3 for 100", "bundle", 100, category="drinks", min_qty=3)
+        inv.promotions.add("Book 10% off", "percent", 10, product_name="Book")
+
+        bill = Bill(BasketPricer(inv.promotions.index()))
+        for product_id, name, price, category, quantity in [
+            (1, "Juice", 40.0, "drinks", 2), (6, "Book", 20.0, None, 3), (2, "Next Cola 300ml", 70.0, "drinks", 2)
+        ]:
+            bill.add(product_id, name, price, quantity, category=category)
+        bill_id, _ = sales.checkout(bill.checkout_lines())
+        assert bill_id is not None
+        charged = inv.conn.execute(
+            "SELECT ROUND(SUM(total), 2), ROUND(SUM(discount), 2) FROM sales WHERE bill_id = ?", (bill_id,)
+        ).fetchone()
+        assert charged == (bill.total / 100, bill.discount / 100)
+    finally:
+        sales.close()
+        inv.close()
@@ -0,0 +1,109 @@
+import shutil
+
+import pytest
+
+import migrations
+import sync
+from connection import ConnectionManager
+
+
+@pytest.fixture
+def branches(shop_db, tmp_path):
+    # Two shops opened from the same baseline database
+    paths = {}
+    for name in ("north", "south"):
+        paths[name] = str(tmp_path / f"{name}.db")
+        shutil.copy(shop_db, paths[name])
+        db = ConnectionManager(paths[name])
+        migrations.migrate(db.conn)
+        db.close()
+    return paths
+
+
+@pytest.fixture
+def central(tmp_path):
+    ledger = sync.CentralLedger(str(tmp_path / "central.db"))
+    yield ledger
+    ledger.close()
+
+
+def set_price(path, name, price, changed_at=None):
+    db = ConnectionManager(path)
+    db.conn.execute("UPDATE products SET price = ? WHERE name = ?", (price, name))
+    if changed_at:
+        db.conn.execute("UPDATE change_log SET changed_at = ? WHERE seq = (SELECT MAX(seq) FROM change_log)",
+                        (changed_at,))
+    db.conn.commit()
+    db.close()
+
+
+def central_price(central, name):
+    return central.conn.execute("SELECT price FROM products WHERE name = ?", (name,)).fetchone()[0]
+
+
+def conflicts(central):
+    return central.conn.execute(
+        "SELECT branch, product_name, branch_value, central_value, resolution FROM sync_conflicts ORDER BY id"
+    ).fetchall()
+
+
+def test_first_snapshot_carries_branch_edit_time(branches, central):
+    sync.pull(central, branches["south"], "south")
+    set_price(branches["north"], "Book", 25.0)
+    sync.pull(central, branches["north"], "north")
+    assert central_price(central, "Book") == 25.0
+    assert conflicts(central) == []
+
+
+def test_snapshot_without_edit_time_is_reported(branches, central):
+    set_price(branches["south"], "Juice", 45.0)
+    sync.pull(central, branches["south"], "south")
+    # North's Juice was never edited after change capture started: its time is unknown
+    sync.pull(central, branches["north"], "north")
+    assert central_price(central, "Juice") == 45.0
+    assert conflicts(central) == [
+        ("north", "Juice", "40.0", "45.0", "kept central price, branch edit time unknown"),
+    ]
+
+
+def test_latest_edit_wins(branches, central):
+    sync.pull(central, branches["north"], "north")
+    sync.pull(central, branches["south"], "south")
+    set_price(branches["north"], "Book", 22.0, "2030-01-01 10:00:00")
+    sync.pull(central, branches["north"], "north")
+    set_price(branches["south"], "Book", 21.0, "2029-12-31 10:00:00")
+    sync.pull(central, branches["south"], "south")
+    assert central_price(central, "Book") == 22.0
+    assert conflicts(central) == [("south", "Book", "21.0", "22.0", "kept newer central price")]
+
+    # Edited at the south from a price the north has since changed: applied, but reported
+    set_price(branches["south"], "Book", 23.0, "2030-01-02 10:00:00")
+    sync.pull(central, branches["south"], "south")
+    assert central_price(central, "Book") == 23.0
+    assert conflicts(central)[-1] == ("south", "Book", "23.0", "22.0", "branch edit is newer")
+
+
+def test_central_rule_keeps_central_prices(branches, tmp_path):
+    central = sync.CentralLedger(str(tmp_path / "central.db"), price_rule="central")
+    try:
+        sync.pull(central, branches["north"], "north")
+        set_price(branches["north"], "Book", 30.0)
+        sync.pull(central, branches["north"], "north")
+        assert central_price(central, "Book") == 20.0
+        assert conflicts(central) == [("north", "Book", "30.0", "20.0", "kept central price")]
+    finally:
+        central.close()
+
+
+def test_negative_stock_is_kept_and_reported(branches, central):
+    db = ConnectionManager(branches["north"])
+    db.conn.execute("UPDATE products SET stock = -2 WHERE name = 'Book'")
+    db.conn.execute("INSERT INTO stock_movements (product_id, delta, reason) VALUES (6, -302, 'sale')")
+    db.conn.commit()
+    db.close()
+    sync.pull(central, branches["north"], "north")
+    stock = central.conn.execute(
+        "SELECT stock FROM branch_stock WHERE branch = 'north' AND product_name = 'Book'"
+    ).fetchone()[0]
+    assert stock == -2
+    assert conflicts(central) == [("north", "Book", "-2", None, "negative stock kept, recount needed")]
@@ -0,0 +1,62 @@
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+
+class WorkerSignals(QObject):
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(object)
+
+
+class Worker(QRunnable):
+    def __init__(self, fn, args, kwargs):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = WorkerSignals()
+
+    def run(self):
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except Exception as e:
+            self.signals.failed.emit(e)
+        else:
+            self.signals.finished.emit(result)
+
+
+class TaskRunner(QObject):
+    # Runs blocking work off the GUI thread. Each lane is its own thread pool:
+    #   "db"    - one thread, so writes through the shared writer connection stay serialised
+    #   "read"  - report/history queries on per-thread reader connections
+    #   "print" - one thread, so receipts come out in order
+    #   "maintenance" - one thread for long background jobs (schema backfills)
+    #   "till"  - one thread for the shared-till client, whose requests must go out in order
+    # on_done/on_error are queued back to the GUI thread by the signal connection.
+    LANES = {"db": 1, "read": 2, "print": 1, "maintenance": 1, "till": 1}
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.pools = {}
+        for lane, threads in self.LANES.items():
+            pool = QThreadPool(self)
+            pool.setMaxThreadCount(threads)
+            self.pools[lane] = pool
+        self.pending = set()
+
+    def submit(self, lane, fn, *args, on_done=None, on_error=None, **kwargs):
+        worker = Worker(fn, args, kwargs)
+        # Keep the signals object alive until its result has been delivered
+        self.pending.add(worker.signals)
+        worker.signals.finished.connect(lambda result: self._deliver(worker.signals, on_done, result))
+        worker.signals.failed.connect(lambda error: self._deliver(worker.signals, on_error, error))
+        self.pools[lane].start(worker)
+
+    def _deliver(self, signals, callback, value):
+        self.pending.discard(signals)
+        if callback:
+            callback(value)
+        elif isinstance(value, Exception):
+            print(f"Background task failed: {value}")
+
+    def wait(self, msecs=-1):
+        for pool in self.pools.values():
+            pool.waitForDone(msecs)